@@ -0,0 +1,8 @@
+"""
+PostgreSQL backend whose connections come from a bounded per-process pool.
+
+Use it with ENGINE 'backend.db_pool' (settings.py does when DB_POOL=1). Pool
+limits come from the database's POOL settings: MAX_SIZE connections, at most
+TIMEOUT seconds of waiting for one, and a health check on connections that
+sat idle for longer than CHECK_AFTER seconds.
+"""
@@ -0,0 +1,31 @@
+"""
+Cooperative psycopg2 for gevent workers.
+
+psycopg2 blocks in C while it waits for the server, which would stall every
+greenlet of the worker. With this wait callback installed it instead polls the
+connection and parks the greenlet on the socket, the same thing psycogreen
+does.
+"""
+import psycopg2
+from psycopg2 import extensions
+
+
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f'Bad result from poll: {state!r}')
+
+
+def make_psycopg_green():
+    if not hasattr(extensions, 'set_wait_callback'):
+        raise ImportError('psycopg2 does not support wait callbacks')
+    extensions.set_wait_callback(gevent_wait_callback)
@@ -0,0 +1,176 @@
+"""
+A bounded pool of psycopg2 connections.
+
+Checkout hands out the most recently returned idle connection (so a few stay
+warm and the rest can age), runs a ``SELECT 1`` on it if it has been idle for
+longer than ``check_after`` seconds, and otherwise opens a new one while the
+pool is below ``max_size``. When every connection is in use, callers wait up
+to ``timeout`` seconds and then get an OperationalError. Returned connections
+are rolled back if a transaction was left open, and dropped if that fails.
+
+The pool only uses threading primitives, which gevent's monkey patching turns
+into cooperative ones, so it serves OS threads and greenlets alike.
+"""
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+DEFAULT_MAX_SIZE = 10
+DEFAULT_TIMEOUT = 5
+DEFAULT_CHECK_AFTER = 30
+
+
+class ConnectionPool:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, timeout=DEFAULT_TIMEOUT, check_after=DEFAULT_CHECK_AFTER):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._in_use = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'failed_health_checks': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+
+    def acquire(self, connect):
+        """Check a connection out, calling ``connect()`` when a new one is needed"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        connection, returned_at = None, None
+        with self._condition:
+            waited = False
+            while True:
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise psycopg2.OperationalError(
+                        f'No database connection available within {self.timeout}s '
+                        f'({self.max_size} in use)'
+                    )
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                self._condition.wait(remaining)
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            wait_ms = (time.monotonic() - started) * 1000
+            self._stats['total_wait_ms'] += wait_ms
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+
+        try:
+            if connection is not None and not self._healthy(connection, returned_at):
+                self._discard(connection)
+                connection = None
+            if connection is None:
+                connection = connect()
+                with self._condition:
+                    self._stats['created'] += 1
+        except BaseException:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return connection
+
+    def release(self, connection):
+        reusable = self._reset(connection)
+        with self._condition:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+        if not reusable:
+            self._discard(connection)
+
+    def _healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            with self._condition:
+                self._stats['failed_health_checks'] += 1
+            return False
+
+    def _reset(self, connection):
+        """Make a returned connection safe to hand out again; False if it is not"""
+        if connection.closed:
+            return False
+        try:
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _discard(self, connection):
+        with self._condition:
+            self._stats['discarded'] += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def close_idle(self):
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._condition:
+            checkouts = self._stats['checkouts']
+            stats = {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                **self._stats,
+                'avg_wait_ms': self._stats['total_wait_ms'] / checkouts if checkouts else 0,
+            }
+        for key in ('total_wait_ms', 'max_wait_ms', 'avg_wait_ms'):
+            stats[key] = round(stats[key], 3)
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, options):
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                max_size=options.get('MAX_SIZE', DEFAULT_MAX_SIZE),
+                timeout=options.get('TIMEOUT', DEFAULT_TIMEOUT),
+                check_after=options.get('CHECK_AFTER', DEFAULT_CHECK_AFTER),
+            )
+        return pool
+
+
+def pool_stats():
+    """Stats of every pool in this process, by database alias"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {alias: pool.stats() for (alias, _), pool in pools}
@@ -0,0 +1,15 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from .pool import pool_stats
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def db_pool_stats(request):
+    """
+    Connection pool usage (in use, idle, waits) of this worker process
+    """
+    return Response({'pools': pool_stats()}, status=status.HTTP_200_OK)
@@ -0,0 +1,251 @@
+"""
+Read replica routing.
+
+Reads go to a replica only while handling one of the read-heavy endpoints in
+REPLICA_READ_URL_NAMES (analytics and bill lists); everything else, and every
+write, uses ``default``. ReplicaRoutingMiddleware marks those requests in a
+context variable, which also follows the analytics queries into their worker
+threads.
+
+Read-your-writes: once a request writes, the rest of it stays on the primary,
+and so do the same client's requests for DATABASE_REPLICA_PIN_SECONDS after
+it (clients are told apart by their Authorization header). The pins live in
+DATABASE_REPLICA_PIN_CACHE, which every worker process must share: the
+client's next request may be answered by another worker. With replicas
+configured, a process-local cache there is refused at startup.
+
+A replica is skipped when it cannot be reached or lags more than
+DATABASE_REPLICA_MAX_LAG_SECONDS behind; its state is re-checked at most every
+DATABASE_REPLICA_CHECK_INTERVAL seconds per process. On PostgreSQL the lag is
+the replay delay of the standby. SQLite has no replication, so for local
+testing a replica file counts as lagging by how much older it is than the
+primary file.
+"""
+import contextvars
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+
+REPLICA_READ_URL_NAMES = {
+    'bills',
+    'active_bills',
+    'completed_bills',
+    'cancelled_bills',
+    'analytics_overview',
+    'analytics_barcodes',
+    'analytics_performance',
+    'analytics_dashboard',
+}
+
+PIN_KEY = 'db:primary-pin:{client}'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Cache backends whose entries other worker processes cannot see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# {'replica': reads may use a replica, 'wrote': this request wrote}
+_routing = contextvars.ContextVar('db_routing', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _max_lag():
+    return getattr(settings, 'DATABASE_REPLICA_MAX_LAG_SECONDS', 5)
+
+
+def _check_interval():
+    return getattr(settings, 'DATABASE_REPLICA_CHECK_INTERVAL', 5)
+
+
+def replica_lag_seconds(alias):
+    """How far ``alias`` is behind the primary, in seconds; raises if it is unreachable"""
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT CASE WHEN NOT pg_is_in_recovery() '
+                'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+            )
+            return float(cursor.fetchone()[0])
+    if connection.vendor == 'sqlite':
+        replica_file = connection.settings_dict['NAME']
+        primary_file = connections[PRIMARY].settings_dict['NAME']
+        if not os.path.exists(replica_file):
+            # Connecting would silently create an empty database
+            raise OSError(f'{replica_file} does not exist')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return max(0.0, os.path.getmtime(primary_file) - os.path.getmtime(replica_file))
+    return 0.0
+
+
+class ReplicaHealth:
+    """Per-process cache of which replicas are usable"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def is_usable(self, alias):
+        now = time.monotonic()
+        state = self._state.get(alias)
+        if state is None or now - state['checked_at'] >= _check_interval():
+            with self._lock:
+                state = self._state.get(alias)
+                if state is None or now - state['checked_at'] >= _check_interval():
+                    state = self._check(alias, now)
+                    self._state[alias] = state
+        return state['usable']
+
+    def _check(self, alias, now):
+        try:
+            lag = replica_lag_seconds(alias)
+        except (DatabaseError, OSError) as e:
+            logger.warning('Replica %s unavailable: %s', alias, e)
+            connections[alias].close()
+            return {'usable': False, 'lag': None, 'error': str(e), 'checked_at': now}
+        usable = lag <= _max_lag()
+        if not usable:
+            logger.warning('Replica %s lags %.1fs behind, reading from the primary', alias, lag)
+        return {'usable': usable, 'lag': lag, 'error': None, 'checked_at': now}
+
+    def status(self):
+        return {
+            alias: {key: value for key, value in state.items() if key != 'checked_at'}
+            for alias, state in self._state.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._state.clear()
+
+
+health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if not routing or not routing['replica'] or routing['wrote']:
+            return PRIMARY
+        if connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        usable = [alias for alias in replica_aliases() if health.is_usable(alias)]
+        return random.choice(usable) if usable else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing['wrote'] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
+
+
+def _client_key(request):
+    credentials = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return hashlib.sha256(credentials.encode()).hexdigest()[:32]
+
+
+def _pin_cache_alias():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_CACHE', 'default')
+
+
+def _pin_cache():
+    return caches[_pin_cache_alias()]
+
+
+def check_pin_cache():
+    """Raise ImproperlyConfigured if replicas are in use and the pins would stay in one process"""
+    alias = _pin_cache_alias()
+    if replica_aliases() and settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            f'DATABASE_REPLICA_PIN_CACHE ({alias!r}) must be shared between worker processes '
+            f'when DATABASE_REPLICAS are configured, not {settings.CACHES[alias]["BACKEND"]}'
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """Lets the read-heavy endpoints read from replicas (see module docstring)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        check_pin_cache()
+
+    def _start(self, request):
+        routing = {'replica': False, 'wrote': False}
+        request._db_routing = routing
+        return _routing.set(routing)
+
+    def _finish(self, request, routing):
+        client = _client_key(request)
+        if client and (routing['wrote'] or request.method not in SAFE_METHODS):
+            _pin_cache().set(
+                PIN_KEY.format(client=client), 1,
+                timeout=getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 10),
+            )
+
+    def _is_pinned(self, request):
+        client = _client_key(request)
+        return bool(client) and _pin_cache().get(PIN_KEY.format(client=client)) is not None
+
+    def __call__(self, request):
+        if not replica_aliases():
+            return self.get_response(request)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+            self._finish(request, request._db_routing)
+            return response
+        finally:
+            _routing.reset(token)
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+            await sync_to_async(self._finish)(request, request._db_routing)
+            return response
+        finally:
+            _routing.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = getattr(request, '_db_routing', None)
+        if routing is None or request.method not in SAFE_METHODS:
+            return None
+        if request.resolver_match.url_name in REPLICA_READ_URL_NAMES and not self._is_pinned(request):
+            routing['replica'] = True
+        return None
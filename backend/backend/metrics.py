@@ -0,0 +1,126 @@
+"""
+In-process latency histograms.
+
+Observations are counted into fixed millisecond buckets per (name, label), so
+recording is O(1) and memory does not grow with traffic. Percentiles are
+estimated from the buckets by linear interpolation, which is accurate to the
+bucket width. Histograms are per worker process and reset on restart.
+
+A label is a string or, for histograms split along several dimensions, a
+tuple; ``describe`` names those dimensions for the Prometheus exposition
+(backend/prometheus.py).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds (ms) of the buckets; a final overflow bucket catches the rest
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+DEFAULT_PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(estimate, self.max)
+            seen += bucket_count
+        return self.max
+
+    def snapshot(self, percentiles=DEFAULT_PERCENTILES):
+        data = {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 2) if self.count else None,
+            'max_ms': round(self.max, 2) if self.count else None,
+        }
+        for fraction in percentiles:
+            value = self.percentile(fraction)
+            data[f'p{round(fraction * 100):g}_ms'] = round(value, 2) if value is not None else None
+        data['buckets'] = [
+            {'le_ms': bound, 'count': bucket_count}
+            for bound, bucket_count in zip(self.buckets + (None,), self.counts)
+        ]
+        return data
+
+
+_lock = threading.Lock()
+_histograms = {}
+_descriptions = {}
+
+
+def describe(name, help_text, labels=('label',), unit='ms'):
+    """Document a histogram name: what it measures, its label names and its unit ('ms' or None)"""
+    _descriptions[name] = {'help': help_text, 'labels': tuple(labels), 'unit': unit}
+
+
+def description(name):
+    return _descriptions.get(name, {'help': '', 'labels': ('label',), 'unit': 'ms'})
+
+
+def observe(name, label, value_ms, buckets=DEFAULT_BUCKETS_MS):
+    with _lock:
+        histogram = _histograms.get((name, label))
+        if histogram is None:
+            histogram = _histograms[(name, label)] = Histogram(buckets)
+        histogram.observe(value_ms)
+
+
+@contextmanager
+def timed(name):
+    """
+    Time the enclosed block. The block sets ``timer['label']`` to the outcome
+    it wants the observation filed under (default 'error', so exceptions count).
+    """
+    timer = {'label': 'error'}
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        observe(name, timer['label'], (time.perf_counter() - started) * 1000)
+
+
+def snapshot(name):
+    """Per-label statistics for one histogram name"""
+    with _lock:
+        return {
+            label: histogram.snapshot()
+            for (histogram_name, label), histogram in sorted(_histograms.items())
+            if histogram_name == name
+        }
+
+
+def collect():
+    """A consistent copy of every histogram as (name, label, buckets, counts, count, total) tuples"""
+    with _lock:
+        return [
+            (name, label, histogram.buckets, list(histogram.counts), histogram.count, histogram.total)
+            for (name, label), histogram in sorted(_histograms.items())
+        ]
+
+
+def reset(name=None):
+    with _lock:
+        for key in list(_histograms):
+            if name is None or key[0] == name:
+                del _histograms[key]
@@ -0,0 +1,197 @@
+"""
+Prometheus text exposition of the metrics: the histograms in backend.metrics
+(request timings, scan latency) and the connection pool gauges. Millisecond
+histograms are exported in seconds, as Prometheus expects.
+
+The metrics live in each worker process, and a scrape reaches one of them.
+With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py empties it at startup),
+every worker writes a snapshot there every SNAPSHOT_INTERVAL_SECONDS and the
+answering worker merges them: histograms are summed over all workers, exited
+ones included, so their counts never go back; pool gauges are reported per
+live worker, under a ``worker`` (pid) label. Without it, a scrape only sees
+the answering worker.
+"""
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from backend import metrics
+from backend.db_pool.pool import pool_stats
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = 'tracking'
+SNAPSHOT_INTERVAL_SECONDS = 5
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+POOL_GAUGES = {
+    'max_size': 'Maximum connections in the pool',
+    'in_use': 'Connections checked out of the pool',
+    'idle': 'Idle connections in the pool',
+}
+POOL_COUNTERS = {
+    'checkouts': 'Connections handed out by the pool',
+    'waits': 'Checkouts that had to wait for a free connection',
+    'timeouts': 'Checkouts that gave up waiting',
+    'created': 'Connections opened by the pool',
+    'discarded': 'Connections closed by the pool',
+    'failed_health_checks': 'Idle connections that failed their health check',
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return f'{value:.6g}' if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(histograms):
+    lines = []
+    described = set()
+    for name, label, buckets, counts, count, total in histograms:
+        info = metrics.description(name)
+        scale = 1000.0 if info['unit'] == 'ms' else 1
+        metric = f"{NAMESPACE}_{name}_seconds" if info['unit'] == 'ms' else f'{NAMESPACE}_{name}'
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {metric} {info['help']}")
+            lines.append(f'# TYPE {metric} histogram')
+        values = label if isinstance(label, tuple) else (label,)
+        pairs = list(zip(info['labels'], values))
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            le = bound if bound == '+Inf' else _number(bound / scale)
+            lines.append(f'{metric}_bucket{_labels(pairs + [("le", le)])} {cumulative}')
+        lines.append(f'{metric}_sum{_labels(pairs)} {_number(total / scale)}')
+        lines.append(f'{metric}_count{_labels(pairs)} {count}')
+    return lines
+
+
+def _pool_lines(pools_by_worker):
+    """``pools_by_worker`` maps a worker label (None: no label) to that worker's pool_stats()"""
+    if not any(pools_by_worker.values()):
+        return []
+    lines = []
+    for families, kind in ((POOL_GAUGES, 'gauge'), (POOL_COUNTERS, 'counter')):
+        for key, help_text in families.items():
+            metric = f'{NAMESPACE}_db_pool_{key}' + ('_total' if kind == 'counter' else '')
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for worker, pools in sorted(pools_by_worker.items(), key=lambda item: str(item[0])):
+                for alias, stats in pools.items():
+                    pairs = [('alias', alias)] + ([('worker', worker)] if worker is not None else [])
+                    lines.append(f'{metric}{_labels(pairs)} {stats[key]}')
+    return lines
+
+
+def multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR', '')
+
+
+def _snapshot_path(directory, pid):
+    return Path(directory) / f'worker-{pid}.json'
+
+
+def write_snapshot(directory=None, pid=None, live=True):
+    """
+    Write this process' metrics to its snapshot file (atomically). ``live=False``
+    keeps only the histograms, for a worker that is exiting.
+    """
+    directory = directory or multiprocess_dir()
+    pid = pid or os.getpid()
+    path = _snapshot_path(directory, pid)
+    if live:
+        data = {
+            'histograms': [
+                [name, list(label) if isinstance(label, tuple) else label, list(buckets), counts, count, total]
+                for name, label, buckets, counts, count, total in metrics.collect()
+            ],
+            'pools': pool_stats(),
+        }
+    else:
+        try:
+            data = {**json.loads(path.read_text()), 'pools': {}}
+        except (OSError, ValueError):
+            return
+    # Per thread: the snapshot writer and a scrape may write at once
+    temporary = path.with_name(f'{path.stem}.{threading.get_ident()}.tmp')
+    temporary.write_text(json.dumps(data))
+    os.replace(temporary, path)
+
+
+def start_snapshot_writer(directory):
+    """Write this worker's snapshot every SNAPSHOT_INTERVAL_SECONDS (gunicorn post_fork)"""
+    def run():
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+            try:
+                write_snapshot(directory)
+            except Exception:
+                logger.exception('Could not write the metrics snapshot')
+
+    threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+
+
+def _merged_snapshots(directory):
+    """(histograms summed over every snapshot, {pid: pool stats})"""
+    merged = {}
+    pools_by_worker = {}
+    for path in sorted(Path(directory).glob('worker-*.json')):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        pools_by_worker[path.stem.removeprefix('worker-')] = data.get('pools') or {}
+        for name, label, buckets, counts, count, total in data['histograms']:
+            key = (name, tuple(label) if isinstance(label, list) else label)
+            if key not in merged:
+                merged[key] = [tuple(buckets), list(counts), count, total]
+            else:
+                entry = merged[key]
+                entry[1] = [a + b for a, b in zip(entry[1], counts)]
+                entry[2] += count
+                entry[3] += total
+    histograms = [(name, label, *entry) for (name, label), entry in sorted(merged.items(), key=str)]
+    return histograms, pools_by_worker
+
+
+def render_metrics():
+    directory = multiprocess_dir()
+    if directory:
+        # This worker's own numbers as of now, the others' as of their last write
+        write_snapshot(directory)
+        histograms, pools_by_worker = _merged_snapshots(directory)
+    else:
+        histograms, pools_by_worker = metrics.collect(), {None: pool_stats()}
+    return '\n'.join(_histogram_lines(histograms) + _pool_lines(pools_by_worker)) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Scrapers must send METRICS_TOKEN as a bearer
+    token; while it is unset the endpoint is disabled.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        return HttpResponse('Metrics are disabled: METRICS_TOKEN is not set\n', status=403,
+                            content_type=CONTENT_TYPE)
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return HttpResponse('Unauthorized\n', status=401, content_type=CONTENT_TYPE)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,107 @@
+"""
+orjson-backed JSON rendering and parsing for DRF.
+
+FastJSONRenderer and FastJSONParser replace DRF's JSONRenderer and JSONParser
+(see REST_FRAMEWORK in settings). They produce and accept exactly what the
+stdlib versions do, only faster, and fall back to them whenever orjson is not
+installed or would not give the same result:
+
+- Everything orjson does not natively write the way the json module does
+  (datetimes, dates, times, Decimals, UUIDs, lazy strings, querysets...) goes
+  through DRF's own JSONEncoder.default, so e.g. datetimes keep their
+  trailing 'Z' and Decimals stay floats.
+- orjson writes floats below 1e-4 or from 1e16 up differently from repr()
+  ('1e16' rather than '1e+16'). Output that may contain such a float is
+  rendered again with the stdlib encoder; the check is a byte scan of the
+  output, so a string that merely looks like one costs a second render, not
+  a different response.
+- Integers outside 64 bits, lone surrogates and other values orjson rejects
+  are rendered by the stdlib encoder. Indented output (the browsable API,
+  ?format=json; indent=4) and non-default UNICODE_JSON/COMPACT_JSON settings
+  are left to it too.
+- Request bodies orjson cannot parse are parsed again by JSONParser, so
+  malformed JSON and NaN get its exact errors. So are bodies with a run of 20
+  digits: orjson reads integers beyond 64 bits as floats.
+
+One difference remains: with orjson, NaN and infinity render as null instead
+of failing the request. The API computes none (ratios are guarded against
+empty denominators), so this only matters for new code.
+"""
+import io
+import re
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+# Datetimes go through DRF's encoder ('Z' suffix, microseconds as DRF trims them)
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+# An exponent as orjson writes it: '1e16', '5e-7' (the json module writes
+# '1e+16', '5e-07'). Searched for from the 'e' (a digit-first pattern is several
+# times slower); the byte before it is checked separately.
+_EXPONENT = re.compile(rb'e[-0-9]')
+
+
+# 2 ** 64 and up
+_BIG_INTEGER = re.compile(rb'[0-9]{20}')
+
+
+def _has_different_float(ret):
+    """Whether orjson output may contain a float the json module writes differently"""
+    # 0.00001: fixed notation where the json module switches to 1e-05
+    if b'0.0000' in ret:
+        return True
+    return any(ret[match.start() - 1:match.start()].isdigit() for match in _EXPONENT.finditer(ret))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer using orjson; byte-identical output"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=OPTIONS)
+        except TypeError:  # orjson.JSONEncodeError is a TypeError
+            return super().render(data, accepted_media_type, renderer_context)
+        if _has_different_float(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escaped for the same reason as JSONRenderer: JSON as a strict javascript
+        # subset. One search for their shared UTF-8 prefix (also that of dashes
+        # and curly quotes) instead of two full scans.
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser using orjson; same results and errors"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        if _BIG_INTEGER.search(body):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+        try:
+            return orjson.loads(body if encoding.lower().replace('-', '') == 'utf8' else body.decode(encoding))
+        except (ValueError, LookupError):  # orjson.JSONDecodeError and UnicodeDecodeError are ValueErrors
+            return super().parse(io.BytesIO(body), media_type, parser_context)
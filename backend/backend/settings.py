@@ -51,11 +51,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.timing.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'backend.db_router.ReplicaRoutingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -81,6 +83,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# The live dashboard feed (bills/analytics/live/) streams, so production runs under ASGI
+ASGI_APPLICATION = 'backend.asgi.application'
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -96,6 +101,15 @@ if os.environ.get('POSTGRES_DB'):
             'PORT': os.environ.get('POSTGRES_PORT', '5432'),
         }
     }
+    # DB_POOL=1 borrows connections from a bounded per-process pool instead of
+    # opening one per request (see backend/db_pool)
+    if os.environ.get('DB_POOL') == '1':
+        DATABASES['default']['ENGINE'] = 'backend.db_pool'
+        DATABASES['default']['POOL'] = {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+            'CHECK_AFTER': float(os.environ.get('DB_POOL_CHECK_AFTER', 30)),
+        }
 else:
     DATABASES = {
         'default': {
@@ -104,6 +118,66 @@ else:
         }
     }
 
+# Read replicas (backend/db_router.py): analytics and bill list reads go to
+# them. POSTGRES_REPLICA_HOSTS is a comma separated list of hosts sharing the
+# primary's credentials; for local testing SQLITE_REPLICAS lists copies of the
+# SQLite file instead.
+if os.environ.get('POSTGRES_DB'):
+    REPLICA_OVERRIDES = [
+        {'HOST': host.strip()}
+        for host in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()
+    ]
+else:
+    REPLICA_OVERRIDES = [
+        {'NAME': path.strip()}
+        for path in os.environ.get('SQLITE_REPLICAS', '').split(',') if path.strip()
+    ]
+
+DATABASE_REPLICAS = []
+for index, overrides in enumerate(REPLICA_OVERRIDES, start=1):
+    alias = f'replica{index}'
+    DATABASES[alias] = {**DATABASES['default'], **overrides, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['backend.db_router.ReplicaRouter']
+DATABASE_REPLICA_MAX_LAG_SECONDS = float(os.environ.get('DATABASE_REPLICA_MAX_LAG_SECONDS', 5))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.environ.get('DATABASE_REPLICA_CHECK_INTERVAL', 5))
+# How long a client that wrote keeps reading from the primary
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', 10))
+
+
+# Caches
+# The analytics response cache (bills/cache.py) defaults to local memory; set
+# ANALYTICS_CACHE_BACKEND=file to share it (and its invalidation counter)
+# between worker processes through ANALYTICS_CACHE_LOCATION. With read
+# replicas it defaults to file, since it also holds their read-your-writes pins.
+
+ANALYTICS_CACHE_ALIAS = 'analytics'
+ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 60))
+
+if os.environ.get('ANALYTICS_CACHE_BACKEND', 'file' if DATABASE_REPLICAS else 'locmem') == 'file':
+    ANALYTICS_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('ANALYTICS_CACHE_LOCATION', str(BASE_DIR / 'cache' / 'analytics')),
+    }
+else:
+    ANALYTICS_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analytics',
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    ANALYTICS_CACHE_ALIAS: ANALYTICS_CACHE,
+}
+
+# Replica read-your-writes pins live in the analytics cache. It must be shared
+# between worker processes when DATABASE_REPLICAS are configured (checked at
+# startup by backend/db_router.py)
+DATABASE_REPLICA_PIN_CACHE = ANALYTICS_CACHE_ALIAS
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -161,11 +235,54 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # orjson-backed drop-ins for DRF's JSON renderer and parser (byte-identical
+    # output); the rest are DRF's defaults
+    'DEFAULT_RENDERER_CLASSES': (
+        'backend.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'backend.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
 }
 
 
+# Independent analytics queries run concurrently on this many threads (each
+# with its own database connection, released after every query, so with
+# DB_POOL they share its MAX_SIZE with the requests); 1 runs them one after another
+ANALYTICS_QUERY_WORKERS = int(os.environ.get('ANALYTICS_QUERY_WORKERS', 8))
+
+
+# Bearer token Prometheus must send to scrape /metrics (disabled when empty).
+# Set PROMETHEUS_MULTIPROC_DIR to report every gunicorn worker, not only the
+# one answering (see backend/prometheus.py)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+# Barcode ranges larger than this are issued by a background job
+BARCODE_BACKGROUND_ISSUE_THRESHOLD = int(os.environ.get('BARCODE_BACKGROUND_ISSUE_THRESHOLD', 50000))
+# A background issue job without progress for this long lost its worker
+BARCODE_ISSUE_JOB_STALE_SECONDS = int(os.environ.get('BARCODE_ISSUE_JOB_STALE_SECONDS', 300))
+
+
+# Offline scan receipts (idempotency keys) are kept this long; a device
+# flushing its queue later gets its scans processed again
+SCAN_RECEIPT_RETENTION_DAYS = int(os.environ.get('SCAN_RECEIPT_RETENTION_DAYS', 30))
+
+
+# Changed rows per bills/changes/ response; clients page through the rest
+BILL_CHANGES_LIMIT = int(os.environ.get('BILL_CHANGES_LIMIT', 1000))
+
+
+# `manage.py archive_bills` moves completed and cancelled bills issued this
+# many days ago or more out of the hot table (see bills/archive.py)
+BILL_ARCHIVE_AFTER_DAYS = int(os.environ.get('BILL_ARCHIVE_AFTER_DAYS', 180))
+
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=5),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=24),
@@ -0,0 +1,118 @@
+"""
+Query budgets for the API tests.
+
+QueryBudgetTestCase requests an endpoint with its data seeded at two sizes and
+fails when the number of queries differs between them (an N+1 query crept in)
+or exceeds the budget the test declares. The seeding helpers below create
+just enough rows for each endpoint to do real work.
+"""
+from datetime import timedelta
+from itertools import count
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from bills.models import Bill
+from codes.models import Barcode
+from enterprise.models import Location, Person
+from userauth.models import User
+
+_sequence = count(1)
+
+
+def make_person(role='Staff', location=None):
+    number = next(_sequence)
+    user = User.objects.create_user(
+        email=f'person{number}@example.com', name=f'Person {number}', password='password',
+    )
+    return Person.objects.create(user=user, role=role, location=location)
+
+
+def make_location():
+    return Location.objects.create(name=f'Location {next(_sequence)}')
+
+
+def make_barcode(assigned_to, assigned_by, status='issued', associated_bill=None):
+    return Barcode.objects.create(
+        code=f'QB{next(_sequence):08d}', status=status,
+        assigned_to=assigned_to, assigned_by=assigned_by, associated_bill=associated_bill,
+    )
+
+
+def bill_data(code, **fields):
+    return {
+        'code': code,
+        'customer_name': 'Customer',
+        'amount': 1500.0,
+        'issue_location': 'Kathmandu',
+        'vehicle_number': 'BA 1 KHA 1234',
+        'material': 'gravel',
+        'destination': 'Pokhara',
+        'vehicle_size': '260 cubic feet',
+        'region': 'crossborder',
+        'eta': (timezone.now() + timedelta(hours=6)).isoformat(),
+        **fields,
+    }
+
+
+def make_bill(issued_by, status='pending', modified_by=None):
+    """A bill with its barcode in the matching state"""
+    barcode = make_barcode(issued_by, issued_by, status='issued')
+    data = bill_data(barcode.code, eta=timezone.now() + timedelta(hours=6))
+    if status != 'pending':
+        data.update(modified_by=modified_by or issued_by, modified_date=timezone.now())
+    bill = Bill.objects.create(issued_by=issued_by, status=status, **data)
+    barcode.associated_bill = bill
+    barcode.status = 'active' if status == 'pending' else ('used' if status == 'completed' else 'cancelled')
+    barcode.save(update_fields=['associated_bill', 'status'])
+    return bill
+
+
+def authenticated_client(person):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(person.user).access_token}')
+    return client
+
+
+# Seeding creates many users; the default password hasher is slow on purpose
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryBudgetTestCase(TestCase):
+    SIZES = (2, 12)
+
+    def setUp(self):
+        # Cached values (the archive horizon, ETag generations) outlive each test's data
+        for cache in caches.all():
+            cache.clear()
+        self.admin = make_person(role='Admin', location=make_location())
+        self.client = authenticated_client(self.admin)
+
+    def assertQueryBudget(self, budget, seed, request, status_code=200):
+        """
+        Call ``seed(n)`` to add n more rows, then ``request()``, for each of
+        SIZES. The query count must be the same at both sizes and at most
+        ``budget``. Caches are cleared before each request so cached
+        endpoints do their real work.
+        """
+        counts = []
+        seeded = 0
+        for size in self.SIZES:
+            seed(size - seeded)
+            seeded = size
+            for cache in caches.all():
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertEqual(response.status_code, status_code, response.content[:500])
+            counts.append(len(queries))
+        small, large = counts
+        self.assertEqual(
+            small, large,
+            f'Query count grows with the data: {small} queries with {self.SIZES[0]} rows, '
+            f'{large} with {self.SIZES[1]}\n' + '\n'.join(query['sql'] for query in queries.captured_queries),
+        )
+        self.assertLessEqual(large, budget, f'{large} queries exceed the budget of {budget}')
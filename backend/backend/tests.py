@@ -0,0 +1,370 @@
+import os
+import re
+import tempfile
+import threading
+import uuid
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from time import monotonic
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+import psycopg2
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils.translation import gettext_lazy
+from psycopg2 import extensions
+from rest_framework.renderers import JSONRenderer
+
+from . import db_router, metrics, prometheus, timing
+from .db_pool.pool import ConnectionPool
+from .renderers import FastJSONRenderer
+from .testing import QueryBudgetTestCase, make_bill, make_person
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    values = {
+        'decimal': [Decimal('1500.50'), Decimal('0.00001'), Decimal('-12345678901234567890.5')],
+        'datetime': [
+            datetime(2025, 1, 1, 0, 0, 0, 123456, tzinfo=dt_timezone.utc),
+            datetime(2025, 1, 1, 5, 45, tzinfo=ZoneInfo('Asia/Kathmandu')),
+            datetime(2025, 1, 1, 5, 45, 0, 500),
+        ],
+        'date': [date(2025, 1, 1)],
+        'time': [time(23, 59, 59, 999999), time(6, 0)],
+        'timedelta': [timedelta(hours=5, seconds=1.5), timedelta(days=-1)],
+        'uuid': [uuid.UUID('12345678-1234-5678-1234-567812345678')],
+        'int': [0, 2 ** 63 - 1, 2 ** 63, 2 ** 64, -(2 ** 64) - 1, 10 ** 30],
+        'float': [0.1, 1e16, 1.5e-5, 0.00001, 123456789.125, -0.0],
+        'str': ['Kathmandu', '\u0928\u0947\u092a\u093e\u0932', 'line\u2028sep\u2029', '\u2014\u201cquoted\u201d', '1e16', 'tab\tquote"'],
+        'lazy': [gettext_lazy('Bill not found')],
+        'nested': [{'a': [1, {'b': None}], 1: True}, [], {}],
+    }
+
+    def test_byte_identical_to_json_renderer(self):
+        for kind, values in self.values.items():
+            for value in values:
+                for data in (value, {'value': value}, [value, value]):
+                    with self.subTest(kind=kind, data=data):
+                        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_fast_path_taken(self):
+        data = {'amount': Decimal('1500.50'), 'date_issued': datetime(2025, 1, 1, tzinfo=dt_timezone.utc), 'id': 2 ** 40}
+        expected = JSONRenderer().render(data)
+        with mock.patch.object(JSONRenderer, 'render', side_effect=AssertionError('fell back to JSONRenderer')):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+
+    def test_indented_output(self):
+        data = {'amount': Decimal('1.5'), 'when': date(2025, 1, 1)}
+        for media_type in ('application/json; indent=4', None):
+            self.assertEqual(
+                FastJSONRenderer().render(data, media_type, {'indent': 2}),
+                JSONRenderer().render(data, media_type, {'indent': 2}),
+            )
+
+
+
+class FakeConnection:
+    """Enough of a psycopg2 connection for the pool"""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.closed = 0
+        self.queries = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def execute(self, sql):
+                if connection.broken:
+                    raise psycopg2.OperationalError('server closed the connection unexpectedly')
+                connection.queries += 1
+
+        return Cursor()
+
+    def get_transaction_status(self):
+        return extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_wait_times_out(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.acquire(FakeConnection)
+        with self.assertRaisesMessage(psycopg2.OperationalError, 'No database connection available within 0.05s'):
+            pool.acquire(FakeConnection)
+        stats = pool.stats()
+        self.assertEqual((stats['in_use'], stats['waits'], stats['timeouts'], stats['checkouts']), (1, 1, 1, 1))
+
+    def test_waiter_gets_released_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        first = pool.acquire(FakeConnection)
+        release = threading.Timer(0.05, pool.release, [first])
+        release.start()
+        try:
+            self.assertIs(pool.acquire(FakeConnection), first)
+        finally:
+            release.join()
+        stats = pool.stats()
+        self.assertEqual((stats['waits'], stats['timeouts'], stats['created']), (1, 0, 1))
+        self.assertGreaterEqual(stats['max_wait_ms'], 40)
+
+    def test_health_check_evicts_dead_connection(self):
+        pool = ConnectionPool(max_size=2, check_after=0)
+        dead = pool.acquire(FakeConnection)
+        pool.release(dead)
+        dead.broken = True
+
+        fresh = pool.acquire(FakeConnection)
+        self.assertIsNot(fresh, dead)
+        self.assertTrue(dead.closed)
+        stats = pool.stats()
+        self.assertEqual(
+            (stats['failed_health_checks'], stats['discarded'], stats['created'], stats['in_use'], stats['idle']),
+            (1, 1, 2, 1, 0),
+        )
+
+    def test_health_check_only_after_idle_time(self):
+        pool = ConnectionPool(check_after=60)
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+        self.assertIs(pool.acquire(FakeConnection), connection)
+        self.assertEqual(connection.queries, 0)
+
+        pool.release(connection)
+        with mock.patch('backend.db_pool.pool.time.monotonic', return_value=monotonic() + 61):
+            self.assertIs(pool.acquire(FakeConnection), connection)
+        self.assertEqual(connection.queries, 1)
+
+    def test_closed_connection_not_reused(self):
+        pool = ConnectionPool()
+        connection = pool.acquire(FakeConnection)
+        connection.close()
+        pool.release(connection)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertIsNot(pool.acquire(FakeConnection), connection)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """Routing between two SQLite files, the primary and its 'replica' copy"""
+    # Connections of their own (see setUp); the SQLite backend class is shared
+    # with the test database, whose guard would refuse them
+    databases = {'default'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.primary = os.path.join(directory.name, 'primary.sqlite3')
+        self.replica = os.path.join(directory.name, 'replica.sqlite3')
+        self.connections = ConnectionHandler({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.primary},
+            'replica1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.replica},
+        })
+        self.addCleanup(self.connections.close_all)
+        for alias in ('default', 'replica1'):
+            with self.connections[alias].cursor() as cursor:
+                cursor.execute('CREATE TABLE bill (id integer)')
+        self.set_lag(0)
+
+        self.enterContext(mock.patch.object(db_router, 'connections', self.connections))
+        self.enterContext(mock.patch.object(db_router, 'health', db_router.ReplicaHealth()))
+        self.enterContext(override_settings(
+            DATABASE_REPLICAS=['replica1'],
+            DATABASE_REPLICA_MAX_LAG_SECONDS=5,
+            DATABASE_REPLICA_CHECK_INTERVAL=0,
+            DATABASE_REPLICA_PIN_CACHE='pins',
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'pins': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': os.path.join(directory.name, 'pins'),
+                },
+            },
+        ))
+        self.router = db_router.ReplicaRouter()
+
+    def set_lag(self, seconds):
+        now = os.path.getmtime(self.primary)
+        os.utime(self.replica, (now - seconds, now - seconds))
+
+    def request(self, method='get', url_name='bills', client='token-a', write=False):
+        """Run a request through the middleware; the database each read used"""
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(None))
+            if write:
+                self.router.db_for_write(None)
+                reads.append(self.router.db_for_read(None))
+            return HttpResponse()
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = db_router.ReplicaRoutingMiddleware(get_response)
+        request = getattr(RequestFactory(), method)(reverse(url_name), HTTP_AUTHORIZATION=f'Bearer {client}')
+        request.resolver_match = resolve(request.path)
+        middleware(request)
+        return reads
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.request(), ['replica1'])
+        # Only the read-heavy endpoints, and nothing outside a request
+        self.assertEqual(self.request(url_name='scan_metrics'), ['default'])
+        self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_read_after_write_in_request(self):
+        self.assertEqual(self.request(write=True), ['replica1', 'default'])
+
+    def test_client_pinned_after_write(self):
+        self.request(write=True)
+        self.assertEqual(self.request(), ['default'])
+        self.assertEqual(self.request(client='token-b'), ['replica1'])
+
+    def test_client_pinned_after_unsafe_request(self):
+        self.request(method='post', url_name='scan_metrics')
+        self.assertEqual(self.request(), ['default'])
+        self.assertEqual(self.request(client='token-b'), ['replica1'])
+
+    def test_lagging_replica_skipped(self):
+        self.set_lag(60)
+        with self.assertLogs('backend.db_router', 'WARNING') as logs:
+            self.assertEqual(self.request(), ['default'])
+        self.assertIn('lags 60.0s behind', logs.output[0])
+        self.assertEqual(db_router.health.status()['replica1']['lag'], 60)
+        self.set_lag(1)
+        self.assertEqual(self.request(), ['replica1'])
+
+    def test_missing_replica_skipped(self):
+        os.remove(self.replica)
+        self.connections['replica1'].close()
+        with self.assertLogs('backend.db_router', 'WARNING'):
+            self.assertEqual(self.request(), ['default'])
+        self.assertFalse(db_router.health.status()['replica1']['usable'])
+        # Not recreated as an empty database by the check
+        self.assertFalse(os.path.exists(self.replica))
+
+    def test_health_rechecked_after_interval(self):
+        with override_settings(DATABASE_REPLICA_CHECK_INTERVAL=60):
+            self.assertEqual(self.request(), ['replica1'])
+            self.set_lag(60)
+            self.assertEqual(self.request(), ['replica1'])
+            db_router.health.reset()
+            with self.assertLogs('backend.db_router', 'WARNING'):
+                self.assertEqual(self.request(), ['default'])
+
+    def test_process_local_pin_cache_refused(self):
+        with override_settings(DATABASE_REPLICA_PIN_CACHE='default'):
+            with self.assertRaises(ImproperlyConfigured):
+                db_router.ReplicaRoutingMiddleware(lambda request: HttpResponse())
+
+
+class RequestTimingTests(QueryBudgetTestCase):
+    HEADER = re.compile(
+        r'db;dur=(?P<db>[0-9.]+);desc="(?P<queries>[0-9]+) queries", ser;dur=(?P<ser>[0-9.]+), '
+        r'app;dur=(?P<app>[0-9.]+), total;dur=(?P<total>[0-9.]+)'
+    )
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_server_timing_header(self):
+        make_bill(make_person(), 'pending')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bills'))
+        match = self.HEADER.fullmatch(response['Server-Timing'])
+        self.assertIsNotNone(match, response['Server-Timing'])
+        self.assertEqual(int(match['queries']), len(queries))
+        db, ser, app, total = (float(match[name]) for name in ('db', 'ser', 'app', 'total'))
+        # Each part rounded to 0.1ms
+        self.assertAlmostEqual(db + ser + app, total, delta=0.2)
+
+        label = ('GET', resolve(reverse('bills')).route)
+        self.assertEqual(metrics.snapshot(timing.REQUEST_QUERIES_METRIC)[label]['count'], 1)
+        self.assertEqual(metrics.snapshot(timing.REQUEST_METRIC)[label]['count'], 1)
+
+    def test_serializing_excludes_sql(self):
+        timings = timing.RequestTimings()
+        token = timing._current.set(timings)
+        try:
+            with timing.serializing():
+                timings.add_query(1000.0)
+        finally:
+            timing._current.reset(token)
+        self.assertEqual((timings.queries, timings.db_ms), (1, 1000.0))
+        self.assertLess(timings.serialize_ms, 100)
+
+    def test_unmatched_route(self):
+        response = self.client.get('/no-such-page/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertIn(('GET', 'unmatched'), metrics.snapshot(timing.REQUEST_METRIC))
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.enterContext(mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': ''}))
+
+    def scrape(self, authorization=None):
+        headers = {'HTTP_AUTHORIZATION': authorization} if authorization is not None else {}
+        return self.client.get(reverse('metrics'), **headers)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_disabled_without_token(self):
+        response = self.scrape('Bearer ')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token_required(self):
+        for authorization in (None, '', 'Bearer wrong', 's3cre', 'Bearer s3cret2', 'Basic s3cret'):
+            with self.subTest(authorization=authorization):
+                self.assertEqual(self.scrape(authorization).status_code, 401)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_exposition(self):
+        metrics.observe(timing.REQUEST_METRIC, ('GET', 'bills/bills/'), 30.0)
+        metrics.observe(timing.REQUEST_QUERIES_METRIC, ('GET', 'bills/bills/'), 3, buckets=timing.QUERY_COUNT_BUCKETS)
+        response = self.scrape('Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], prometheus.CONTENT_TYPE)
+        body = response.content.decode()
+        # Milliseconds are exported as seconds; counts as they are
+        self.assertIn('# TYPE tracking_request_seconds histogram', body)
+        self.assertIn('tracking_request_seconds_sum{method="GET",route="bills/bills/"} 0.03\n', body)
+        self.assertIn('tracking_request_seconds_count{method="GET",route="bills/bills/"} 1\n', body)
+        self.assertIn('tracking_request_queries_bucket{method="GET",route="bills/bills/",le="2"} 0\n', body)
+        self.assertIn('tracking_request_queries_bucket{method="GET",route="bills/bills/",le="5"} 1\n', body)
+        self.assertIn('tracking_request_queries_bucket{method="GET",route="bills/bills/",le="+Inf"} 1\n', body)
+
+    def test_snapshots_merged_across_workers(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        metrics.observe('scan', 'ok', 10.0)
+        prometheus.write_snapshot(directory, pid=1)
+        prometheus.write_snapshot(directory, pid=2, live=True)
+        # Worker 2 exits: its histograms stay, its pool gauges go
+        prometheus.write_snapshot(directory, pid=2, live=False)
+        histograms, pools_by_worker = prometheus._merged_snapshots(directory)
+        self.assertEqual([(name, label, count) for name, label, _, _, count, _ in histograms], [('scan', 'ok', 2)])
+        self.assertEqual(pools_by_worker['2'], {})
@@ -0,0 +1,171 @@
+"""
+Per-request timings.
+
+RequestTimingMiddleware measures each request's database queries (count and
+time), serialization time and total time. It reports them in a Server-Timing
+header and files them into per-route histograms in backend.metrics, which
+/metrics exposes to Prometheus (backend/prometheus.py).
+
+Queries are counted by an execute wrapper installed on every connection. It
+finds the current request through a context variable, so queries the
+analytics thread pool runs for a request (it copies the caller's context)
+count too. Serialization is the rendering of the response plus any block
+wrapped in ``serializing()``, less the SQL run inside it: lazy querysets are
+usually evaluated while they are being serialized.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from backend import metrics
+
+REQUEST_METRIC = 'request'
+REQUEST_DB_METRIC = 'request_db'
+REQUEST_SERIALIZE_METRIC = 'request_serialize'
+REQUEST_QUERIES_METRIC = 'request_queries'
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+ROUTE_LABELS = ('method', 'route')
+
+metrics.describe(REQUEST_METRIC, 'Total request time by route', labels=ROUTE_LABELS)
+metrics.describe(REQUEST_DB_METRIC, 'Time spent in SQL per request by route', labels=ROUTE_LABELS)
+metrics.describe(REQUEST_SERIALIZE_METRIC, 'Serialization time per request by route', labels=ROUTE_LABELS)
+metrics.describe(REQUEST_QUERIES_METRIC, 'SQL queries per request by route', labels=ROUTE_LABELS, unit=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.serialize_ms = 0.0
+
+    def add_query(self, elapsed_ms):
+        with self._lock:
+            self.queries += 1
+            self.db_ms += elapsed_ms
+
+    def add_serialize(self, elapsed_ms):
+        with self._lock:
+            self.serialize_ms += max(elapsed_ms, 0.0)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query((time.perf_counter() - started) * 1000)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@contextmanager
+def serializing():
+    """Count the enclosed block, less its SQL time, as serialization of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    db_before = timings.db_ms
+    try:
+        yield
+    finally:
+        timings.add_serialize((time.perf_counter() - started) * 1000 - (timings.db_ms - db_before))
+
+
+def server_timing_header(timings, total_ms):
+    app_ms = max(total_ms - timings.db_ms - timings.serialize_ms, 0.0)
+    return ', '.join([
+        f'db;dur={timings.db_ms:.1f};desc="{timings.queries} queries"',
+        f'ser;dur={timings.serialize_ms:.1f}',
+        f'app;dur={app_ms:.1f}',
+        f'total;dur={total_ms:.1f}',
+    ])
+
+
+def route_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return (request.method, match.route if match is not None else 'unmatched')
+
+
+class RequestTimingMiddleware:
+    """Server-Timing header and per-route histograms (see module docstring)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        # Connections opened before this module was imported missed the signal
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(sender=None, connection=connection)
+        timings = RequestTimings()
+        request._timings = timings
+        return timings, _current.set(timings)
+
+    def _finish(self, request, response, timings):
+        # A streaming response (the live feed) has only just started
+        if response.streaming:
+            return response
+        total_ms = timings.elapsed_ms()
+        label = route_label(request)
+        metrics.observe(REQUEST_METRIC, label, total_ms)
+        metrics.observe(REQUEST_DB_METRIC, label, timings.db_ms)
+        metrics.observe(REQUEST_SERIALIZE_METRIC, label, timings.serialize_ms)
+        metrics.observe(REQUEST_QUERIES_METRIC, label, timings.queries, buckets=QUERY_COUNT_BUCKETS)
+        response['Server-Timing'] = server_timing_header(timings, total_ms)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered (JSON encoded) after the view returns
+        timings = getattr(request, '_timings', None)
+        if timings is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: timings.add_serialize((time.perf_counter() - started) * 1000)
+            )
+        return response
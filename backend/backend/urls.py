@@ -17,10 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from backend.db_pool.views import db_pool_stats
+from backend.prometheus import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('bills/', include('bills.urls')),
     path('codes/', include('codes.urls')),
     path('enterprise/', include('enterprise.urls')),
     path('userauth/', include('userauth.urls')),
+    path('db/pool/', db_pool_stats, name='db_pool_stats'),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -6,108 +6,128 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models.functions import TruncDate, Extract
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db.models.functions import Coalesce, TruncDate, Extract
 from collections import defaultdict
 import calendar
+import math
 
-from .models import Bill
+from asgiref.sync import sync_to_async
+
+from .models import Bill, DailyBillRollup, DailyDestinationRollup
+from .archive import bills_for_range
+from .async_api import async_api_view, authenticate_request, unauthorized
+from .cache import cache_stats, cached_analytics
+from .conditional import conditional_get
+from .completion_stats import completion_time_stats
+from .live import LIVE_TICKET_SECONDS, compute_live_metrics, event_stream, issue_ticket, ticket_user
+from .query_pool import gather_queries
+from codes import counters as barcode_counters
 from codes.models import Barcode
 from enterprise.models import Person
 
+# Widest completion-time histogram bucket (a year)
+MAX_BUCKET_HOURS = 24 * 366
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def analytics_overview(request):
+
+@async_api_view
+@conditional_get('overview', tenant=True, clock=True)
+@cached_analytics('overview')
+async def analytics_overview(request):
     """
     Comprehensive analytics overview with key metrics and trends
     """
     try:
         days = int(request.GET.get('days', 30))
         end_date = timezone.now()
-        start_date = end_date - timedelta(days=days)
 
-        # Base queryset for the period (exclude cancelled as per new requirement)
-        period_queryset = Bill.objects.filter(
-            date_issued__range=[start_date, end_date]
-        )
+        # The period is the last `days` local dates, today included, as the
+        # rollup tables are keyed by local issue date; it starts at local
+        # midnight, and the previous period is the `days` dates before it
+        end_day = timezone.localtime(end_date).date()
+        start_day = end_day - timedelta(days=days - 1)
+        start_date = timezone.make_aware(datetime.combine(start_day, datetime.min.time()))
+        prev_start_day = start_day - timedelta(days=days)
+
+        period_rollups = DailyBillRollup.objects.filter(date__range=[start_day, end_day])
 
         # Exclude cancelled everywhere for revenue / core metrics
-        bills_queryset = period_queryset.exclude(status='cancelled')
+        rollups_queryset = period_rollups.exclude(status='cancelled')
+
+        def distribution(field, limit=None):
+            queryset = rollups_queryset.values(field).annotate(
+                count=Sum('bills_count'),
+                revenue=Sum('revenue')
+            ).filter(count__gt=0).order_by('-count')
+            return lambda: list(queryset[:limit] if limit else queryset)
+
+        # The queries are independent of each other, so they all run at once
+        results = await gather_queries({
+            # Per-status totals for the period in one query over the rollups
+            'status_totals': lambda: list(period_rollups.values('status').annotate(
+                count=Sum('bills_count'),
+                revenue=Sum('revenue'),
+            ).order_by()),
+            # Overdue pending bills (exclude cancelled by definition already)
+            'overdue_bills': Bill.objects.filter(
+                date_issued__range=[start_date, end_date],
+                status='pending',
+                eta__lt=timezone.now()
+            ).count,
+            # Previous period, for the growth rate (cancelled excluded)
+            'prev_bills_count': lambda: DailyBillRollup.objects.filter(
+                date__gte=prev_start_day,
+                date__lt=start_day,
+            ).exclude(status='cancelled').aggregate(total=Sum('bills_count'))['total'] or 0,
+            # Daily trends (local dates, exclude cancelled)
+            'daily_trends': lambda: list(rollups_queryset.values('date').annotate(
+                day_count=Sum('bills_count'),
+                day_revenue=Sum('revenue'),
+                completed_count=Coalesce(Sum('bills_count', filter=Q(status='completed')), 0)
+            ).filter(day_count__gt=0).order_by('date')),
+            # Distributions (exclude cancelled)
+            'material_distribution': distribution('material'),
+            'regional_distribution': distribution('region'),
+            'vehicle_distribution': distribution('vehicle_size'),
+            'issue_locations': distribution('issue_location', limit=10),
+            # Top destinations (exclude cancelled)
+            'top_destinations': lambda: list(DailyDestinationRollup.objects.filter(
+                date__range=[start_day, end_day]
+            ).exclude(status='cancelled').values('destination').annotate(
+                count=Sum('bills_count'),
+                revenue=Sum('revenue')
+            ).filter(count__gt=0).order_by('-count')[:10]),
+        })
+
+        status_totals = {row['status']: row for row in results['status_totals']}
+
+        def status_total(name, field):
+            row = status_totals.get(name)
+            return (row[field] or 0) if row else 0
 
         # Keep cancelled count separately (frontend expects the field, but it is not added to totals)
-        cancelled_bills = period_queryset.filter(status='cancelled').count()
+        cancelled_bills = status_total('cancelled', 'count')
 
         # Summary statistics (cancelled excluded from total_bills & revenue)
-        total_bills = bills_queryset.count()
-        completed_bills = bills_queryset.filter(status='completed').count()
-        pending_bills = bills_queryset.filter(status='pending').count()
-
-        # Overdue pending bills (exclude cancelled by definition already)
-        overdue_bills = bills_queryset.filter(
-            status='pending',
-            eta__lt=timezone.now()
-        ).count()
+        completed_bills = status_total('completed', 'count')
+        pending_bills = status_total('pending', 'count')
+        total_bills = completed_bills + pending_bills
 
         # Revenue (cancelled excluded)
-        total_revenue = bills_queryset.aggregate(total=Sum('amount'))['total'] or 0
-        completed_revenue = bills_queryset.filter(status='completed').aggregate(total=Sum('amount'))['total'] or 0
+        completed_revenue = status_total('completed', 'revenue')
+        total_revenue = completed_revenue + status_total('pending', 'revenue')
 
         # Completion rate
         completion_rate = (completed_bills / total_bills * 100) if total_bills > 0 else 0
 
         # Average bill value (exclude cancelled)
-        avg_bill_value = bills_queryset.aggregate(avg=Avg('amount'))['avg'] or 0
+        avg_bill_value = (total_revenue / total_bills) if total_bills > 0 else 0
 
         # Growth rate vs previous period (cancelled excluded in both periods)
-        prev_start_date = start_date - timedelta(days=days)
-        prev_bills_count = Bill.objects.filter(
-            date_issued__range=[prev_start_date, start_date]
-        ).exclude(status='cancelled').count()
+        prev_bills_count = results['prev_bills_count']
         growth_rate = 0
         if prev_bills_count > 0:
             growth_rate = ((total_bills - prev_bills_count) / prev_bills_count) * 100
-
-        # Daily trends (timezone-aware, exclude cancelled)
-        # Use TruncDate with project timezone to avoid UTC shifting issues.
-        from django.db.models.functions import TruncDate
-        current_tz = timezone.get_current_timezone()
-        daily_trends = bills_queryset.annotate(
-            local_date=TruncDate('date_issued', tzinfo=current_tz)
-        ).values('local_date').annotate(
-            bills_count=Count('id'),
-            revenue=Sum('amount'),
-            completed_count=Count('id', filter=Q(status='completed'))
-        ).order_by('local_date')
-
-        # Material distribution (exclude cancelled)
-        material_distribution = bills_queryset.values('material').annotate(
-            count=Count('id'),
-            revenue=Sum('amount')
-        ).order_by('-count')
-
-        # Regional distribution (exclude cancelled)
-        regional_distribution = bills_queryset.values('region').annotate(
-            count=Count('id'),
-            revenue=Sum('amount')
-        ).order_by('-count')
-
-        # Vehicle size distribution (exclude cancelled)
-        vehicle_distribution = bills_queryset.values('vehicle_size').annotate(
-            count=Count('id'),
-            revenue=Sum('amount')
-        ).order_by('-count')
-
-        # Top destinations (exclude cancelled)
-        top_destinations = bills_queryset.values('destination').annotate(
-            count=Count('id'),
-            revenue=Sum('amount')
-        ).order_by('-count')[:10]
-
-        # Issue locations distribution (exclude cancelled)
-        issue_locations = bills_queryset.values('issue_location').annotate(
-            count=Count('id'),
-            revenue=Sum('amount')
-        ).order_by('-count')[:10]
         
         response_data = {
             'summary': {
@@ -115,7 +135,7 @@ def analytics_overview(request):
                 'completed_bills': completed_bills,
                 'pending_bills': pending_bills,
                 'cancelled_bills': cancelled_bills,  # Provided for UI but not part of totals
-                'overdue_bills': overdue_bills,
+                'overdue_bills': results['overdue_bills'],
                 'total_revenue': float(total_revenue),  # Excludes cancelled
                 'completed_revenue': float(completed_revenue),
                 'completion_rate': round(completion_rate, 2),
@@ -124,17 +144,17 @@ def analytics_overview(request):
             },
             'daily_trends': [
                 {
-                    'date': dt['local_date'].isoformat() if dt['local_date'] else None,
-                    'bills_count': dt['bills_count'],
-                    'revenue': dt['revenue'],
+                    'date': dt['date'].isoformat() if dt['date'] else None,
+                    'bills_count': dt['day_count'],
+                    'revenue': dt['day_revenue'],
                     'completed_count': dt['completed_count']
-                } for dt in daily_trends
+                } for dt in results['daily_trends']
             ],
-            'material_distribution': list(material_distribution),
-            'regional_distribution': list(regional_distribution),
-            'vehicle_distribution': list(vehicle_distribution),
-            'top_destinations': list(top_destinations),
-            'issue_locations': list(issue_locations),
+            'material_distribution': results['material_distribution'],
+            'regional_distribution': results['regional_distribution'],
+            'vehicle_distribution': results['vehicle_distribution'],
+            'top_destinations': results['top_destinations'],
+            'issue_locations': results['issue_locations'],
             'period': f'{days} days',
             'date_range': {
                 'start': start_date.isoformat(),
@@ -151,9 +171,10 @@ def analytics_overview(request):
         )
 
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def analytics_barcodes(request):
+@async_api_view
+@conditional_get('barcodes', tenant=True, clock=True)
+@cached_analytics('barcodes')
+async def analytics_barcodes(request):
     """
     Barcode analytics and usage statistics
     """
@@ -167,57 +188,57 @@ def analytics_barcodes(request):
         barcodes_queryset = Barcode.objects.filter(
         )
         
-        total_barcodes = barcodes_queryset.count()
-        issued_barcodes = barcodes_queryset.filter(status='issued').count()
-        active_barcodes = barcodes_queryset.filter(status='active').count()
-        used_barcodes = barcodes_queryset.filter(status='used').count()
-        cancelled_barcodes = barcodes_queryset.filter(status='cancelled').count()
+        results = await gather_queries({
+            # All counts in one small read of the status counters
+            'counts': barcode_counters.summary,
+            # Recent barcode activity
+            'recent_barcodes': lambda: list(barcodes_queryset.filter(
+                updated_at__range=[start_date, end_date]
+            ).extra(
+                select={'date': 'DATE(updated_at)'}
+            ).values('date').annotate(
+                count=Count('id')
+            ).order_by('date')),
+            # Barcode assignment trends
+            'assignment_trends': lambda: list(barcodes_queryset.filter(
+                assigned_at__range=[start_date, end_date]
+            ).extra(
+                select={'date': 'DATE(assigned_at)'}
+            ).values('date').annotate(
+                count=Count('id')
+            ).order_by('date')),
+        })
+        
+        counts = results['counts']
+        by_status = counts['by_status']
+        total_barcodes = counts['total']
         
         # Usage rate calculation
-        usage_rate = (used_barcodes / total_barcodes * 100) if total_barcodes > 0 else 0
+        usage_rate = (by_status['used'] / total_barcodes * 100) if total_barcodes > 0 else 0
         
         # Bill association rate
-        associated_barcodes = barcodes_queryset.filter(
-            associated_bill__isnull=False
-        ).count()
-        bill_association_rate = (associated_barcodes / total_barcodes * 100) if total_barcodes > 0 else 0
-        
-        # Recent barcode activity
-        recent_barcodes = barcodes_queryset.filter(
-            updated_at__range=[start_date, end_date]
-        ).extra(
-            select={'date': 'DATE(updated_at)'}
-        ).values('date').annotate(
-            count=Count('id')
-        ).order_by('date')
+        bill_association_rate = (counts['associated'] / total_barcodes * 100) if total_barcodes > 0 else 0
         
         # Status distribution
-        status_distribution = barcodes_queryset.values('status').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        # Barcode assignment trends
-        assignment_trends = barcodes_queryset.filter(
-            assigned_at__range=[start_date, end_date]
-        ).extra(
-            select={'date': 'DATE(assigned_at)'}
-        ).values('date').annotate(
-            count=Count('id')
-        ).order_by('date')
+        status_distribution = [
+            {'status': barcode_status, 'count': count}
+            for barcode_status, count in sorted(by_status.items(), key=lambda item: -item[1])
+            if count > 0
+        ]
         
         response_data = {
             'barcode_summary': {
                 'total_barcodes': total_barcodes,
-                'issued_barcodes': issued_barcodes,
-                'active_barcodes': active_barcodes,
-                'used_barcodes': used_barcodes,
-                'cancelled_barcodes': cancelled_barcodes,
+                'issued_barcodes': by_status['issued'],
+                'active_barcodes': by_status['active'],
+                'used_barcodes': by_status['used'],
+                'cancelled_barcodes': by_status['cancelled'],
                 'usage_rate': round(usage_rate, 2),
                 'bill_association_rate': round(bill_association_rate, 2)
             },
-            'recent_activity': list(recent_barcodes),
-            'status_distribution': list(status_distribution),
-            'assignment_trends': list(assignment_trends),
+            'recent_activity': results['recent_barcodes'],
+            'status_distribution': status_distribution,
+            'assignment_trends': results['assignment_trends'],
             'period': f'{days} days'
         }
         
@@ -230,44 +251,37 @@ def analytics_barcodes(request):
         )
 
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def analytics_performance(request):
+@async_api_view
+@conditional_get('performance', tenant=True, clock=True)
+@cached_analytics('performance', params={'bucket_hours': '1'})
+async def analytics_performance(request):
     """
     Performance analytics including completion times and staff performance
     """
+    try:
+        bucket_hours = float(request.GET.get('bucket_hours', 1))
+    except ValueError:
+        bucket_hours = None
+    if bucket_hours is None or not (math.isfinite(bucket_hours) and 0 < bucket_hours <= MAX_BUCKET_HOURS):
+        return Response(
+            {'error': f'bucket_hours must be a number above 0 and at most {MAX_BUCKET_HOURS}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
     try:
         days = int(request.GET.get('days', 30))
         end_date = timezone.now()
         start_date = end_date - timedelta(days=days)
         
-        user_enterprise = request.user.person.enterprise
-        
-        bills_queryset = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise,
+        # Persons no longer belong to an enterprise, so (like the overview) this covers all bills,
+        # archived ones too when the period reaches back that far
+        bills = await sync_to_async(bills_for_range)(date_issued=(start_date, end_date))
+        bills_queryset = bills.filter(
             date_issued__range=[start_date, end_date]
         )
         
-        # Calculate average completion time for completed bills
         completed_bills = bills_queryset.filter(status='completed')
         
-        # Estimate completion time using modified_date - date_issued
-        completion_times = []
-        for bill in completed_bills:
-            if bill.modified_date:
-                completion_time = bill.modified_date - bill.date_issued
-                completion_times.append(completion_time.total_seconds() / 3600)  # Convert to hours
-        
-        avg_completion_time = sum(completion_times) / len(completion_times) if completion_times else 0
-        
-        # On-time delivery rate (bills completed before ETA)
-        on_time_bills = completed_bills.filter(
-            modified_date__lte=F('eta')
-        ).count()
-        
-        total_completed = completed_bills.count()
-        on_time_delivery_rate = (on_time_bills / total_completed * 100) if total_completed > 0 else 0
-        
         # Staff performance
         staff_performance = bills_queryset.values(
             'issued_by__user__name',
@@ -295,9 +309,6 @@ def analytics_performance(request):
             )
         ).order_by('-bills_count')
         
-        # Get total unique locations
-        total_locations = bills_queryset.values('issue_location').distinct().count()
-        
         # Performance trends over time
         performance_trends = bills_queryset.extra(
             select={'date': 'DATE(date_issued)'}
@@ -313,16 +324,39 @@ def analytics_performance(request):
             )
         ).order_by('date')
         
+        results = await gather_queries({
+            # Completion time (modified_date - date_issued) statistics, computed in the database
+            'completion_times': lambda: completion_time_stats(bills_queryset, bucket_hours=bucket_hours),
+            # On-time delivery rate (bills completed before ETA)
+            'completed_counts': lambda: completed_bills.aggregate(
+                total_completed=Count('id'),
+                on_time_bills=Count('id', filter=Q(modified_date__lte=F('eta'))),
+            ),
+            'staff_performance': lambda: list(staff_performance),
+            'location_performance': lambda: list(location_performance),
+            # Get total unique locations
+            'total_locations': bills_queryset.values('issue_location').distinct().count,
+            'performance_trends': lambda: list(performance_trends),
+        })
+        
+        completion_times = results['completion_times']
+        avg_completion_time = completion_times['overall']['mean_hours'] or 0
+        
+        total_completed = results['completed_counts']['total_completed']
+        on_time_bills = results['completed_counts']['on_time_bills']
+        on_time_delivery_rate = (on_time_bills / total_completed * 100) if total_completed > 0 else 0
+        
         response_data = {
             'performance_summary': {
                 'avg_completion_time_hours': round(avg_completion_time, 2),
                 'on_time_delivery_rate': round(on_time_delivery_rate, 2),
-                'total_locations': total_locations,
-                'total_staff': staff_performance.count()
+                'total_locations': results['total_locations'],
+                'total_staff': len(results['staff_performance'])
             },
-            'staff_performance': list(staff_performance),
-            'location_performance': list(location_performance),
-            'performance_trends': list(performance_trends),
+            'staff_performance': results['staff_performance'],
+            'location_performance': results['location_performance'],
+            'performance_trends': results['performance_trends'],
+            'completion_times': completion_times,
             'period': f'{days} days'
         }
         
@@ -338,60 +372,37 @@ def analytics_performance(request):
 
 
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def analytics_dashboard(request):
+@async_api_view
+@conditional_get('dashboard', tenant=True, clock=True)
+@cached_analytics('dashboard')
+async def analytics_dashboard(request):
     """
     Real-time dashboard data for live metrics
     """
     try:
-        user_enterprise = request.user.person.enterprise
-        today = timezone.now().date()
-        
-        # Today's statistics
-        today_bills = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise,
-            date_issued__date=today
-        )
-        
-        today_stats = {
-            'bills_issued': today_bills.count(),
-            'revenue': float(today_bills.aggregate(total=Sum('amount'))['total'] or 0),
-            'completed': today_bills.filter(status='completed').count(),
-            'pending': today_bills.filter(status='pending').count()
-        }
-        
-        # Live metrics
-        active_shipments = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise,
-            status='pending'
-        ).count()
-        
-        # Recent completions (last 24 hours)
-        last_24h = timezone.now() - timedelta(hours=24)
-        recent_completions = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise,
-            status='completed',
-            modified_date__gte=last_24h
-        ).count()
-        
-        # Overdue shipments
-        overdue_count = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise,
-            status='pending',
-            eta__lt=timezone.now()
-        ).count()
-        
-        # High-value shipments (top 25% by amount)
-        avg_amount = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise
-        ).aggregate(avg=Avg('amount'))['avg'] or 0
-        
-        high_value_pending = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise,
-            status='pending',
-            amount__gte=avg_amount * 1.5  # 50% above average
-        ).count()
+        today = timezone.localdate()
+        
+        results = await gather_queries({
+            # Today's statistics
+            'today_stats': lambda: Bill.objects.filter(date_issued__date=today).aggregate(
+                bills_issued=Count('id'),
+                revenue=Sum('amount'),
+                completed=Count('id', filter=Q(status='completed')),
+                pending=Count('id', filter=Q(status='pending')),
+            ),
+            # Live metrics (also pushed by the live feed)
+            'live_metrics': compute_live_metrics,
+            # Recent activity (last 10 bills)
+            'recent_activity': lambda: list(Bill.objects.order_by('-date_issued')[:10].values(
+                'code', 'amount', 'destination', 'status', 'date_issued'
+            )),
+        })
+        
+        today_stats = results['today_stats']
+        today_stats['revenue'] = float(today_stats['revenue'] or 0)
+        live_metrics = results['live_metrics']
+        overdue_count = live_metrics['overdue_count']
+        high_value_pending = live_metrics['high_value_pending']
         
         # Generate alerts
         alerts = []
@@ -420,26 +431,11 @@ def analytics_dashboard(request):
                 'priority': 'low'
             })
         
-        # Recent activity (last 10 bills)
-        recent_activity = Bill.objects.filter(
-            issued_by__enterprise=user_enterprise
-        ).order_by('-date_issued')[:10].values(
-            'code', 'amount', 'destination', 'status', 'date_issued'
-        )
-        
-        # Quick stats for widgets
-        live_metrics = {
-            'active_shipments': active_shipments,
-            'recent_completions': recent_completions,
-            'overdue_count': overdue_count,
-            'high_value_pending': high_value_pending
-        }
-        
         response_data = {
             'today_stats': today_stats,
             'live_metrics': live_metrics,
             'alerts': alerts,
-            'recent_activity': list(recent_activity),
+            'recent_activity': results['recent_activity'],
             'last_updated': timezone.now().isoformat()
         }
         
@@ -450,3 +446,45 @@ def analytics_dashboard(request):
             {'error': f'Failed to fetch dashboard data: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def analytics_cache_stats(request):
+    """
+    Hit/miss counters and the current generation of the analytics cache
+    """
+    return Response(cache_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def analytics_live_ticket(request):
+    """
+    A ticket for opening the live stream (EventSource cannot send the JWT),
+    valid for a few seconds
+    """
+    return Response({
+        'ticket': issue_ticket(request.user),
+        'expires_in': LIVE_TICKET_SECONDS,
+    }, status=status.HTTP_200_OK)
+
+
+async def analytics_live(request):
+    """
+    Server-Sent Events stream of bill events and live_metrics changes for the
+    real-time dashboard, opened with ?ticket= from analytics_live_ticket (or
+    the usual Authorization header). Needs an ASGI server (backend/asgi.py).
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    ticket = request.GET.get('ticket')
+    user = await ticket_user(ticket) if ticket else await authenticate_request(request)
+    if user is None:
+        return unauthorized()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BillsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bills'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .archive import install_archive
+        from .search import install_search_index
+
+        post_migrate.connect(install_search_index, sender=self)
+        post_migrate.connect(install_archive, sender=self)
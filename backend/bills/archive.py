@@ -0,0 +1,229 @@
+"""
+Archival of old bills out of the hot Bill table.
+
+Day to day the app touches pending bills and the last few weeks, so
+`manage.py archive_bills` moves completed and cancelled bills issued more than
+BILL_ARCHIVE_AFTER_DAYS ago into ArchivedBill, in chunks of one transaction
+each, keeping their ids. Bill, its indexes and everything joined to it stay
+proportional to recent activity.
+
+* PostgreSQL: the archive is natively range partitioned by date_issued month.
+  The mover creates the partitions it needs, so date bounded reads of the
+  archive only scan the months they cover. Bill itself stays unpartitioned:
+  barcodes, search documents and the change log refer to its id alone.
+* SQLite (and anything else): the archive is a plain table indexed by
+  date_issued.
+
+Reads: BillHistory is a UNION ALL view of both tables with the same columns.
+Date filtered reads whose range starts at or before the newest archived date
+use it (``bills_for_range``), and so do the completed and cancelled lists,
+which cover every date, once anything is archived (``bills_with_archive``);
+the others never see the archive. Rollups (and so the overview analytics) are
+untouched by the move: the archived bills still count, and a rebuild reads
+BillHistory.
+
+Moving skips the model signals on purpose: an archived bill is not deleted
+(no rollup change). It does leave the hot table, which is all bills/changes/
+syncs, so the move leaves a tombstone for it like a deletion. Its search
+document is dropped; searching the archive matches the columns directly.
+Barcodes keep pointing at their bill's id, which is why
+Barcode.associated_bill has no database constraint.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .cache import bump_generation, get_analytics_cache, get_ttl
+from .changes import record_deletion, stamping
+from .models import ArchivedBill, Bill, BillHistory, BillSearchDocument
+
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+DEFAULT_CHUNK_SIZE = 1000
+
+HORIZON_KEY = 'archive:horizon'
+
+
+def archive_after_days():
+    return getattr(settings, 'BILL_ARCHIVE_AFTER_DAYS', 180)
+
+
+def _columns(conn):
+    """Column names shared by Bill, ArchivedBill and the BillHistory view, quoted"""
+    return ', '.join(conn.ops.quote_name(field.column) for field in Bill._meta.concrete_fields)
+
+
+def _archive_ddl():
+    bill_table = Bill._meta.db_table
+    archive_table = ArchivedBill._meta.db_table
+    statements = [
+        f"""CREATE TABLE IF NOT EXISTS {archive_table} (LIKE {bill_table} INCLUDING DEFAULTS)
+            PARTITION BY RANGE (date_issued)""",
+    ]
+    for index in ArchivedBill._meta.indexes:
+        columns = ', '.join(ArchivedBill._meta.get_field(name).column for name in index.fields)
+        statements.append(f'CREATE INDEX IF NOT EXISTS {index.name} ON {archive_table} ({columns})')
+    return statements
+
+
+def install_archive(using='default', **kwargs):
+    """Create the archive table and the BillHistory view (post_migrate handler, idempotent)"""
+    conn = connections[using]
+    if ArchivedBill._meta.db_table not in conn.introspection.table_names():
+        if conn.vendor == 'postgresql':
+            with conn.cursor() as cursor:
+                for statement in _archive_ddl():
+                    cursor.execute(statement)
+        else:
+            with conn.schema_editor() as editor:
+                editor.create_model(ArchivedBill)
+
+    columns = _columns(conn)
+    view = BillHistory._meta.db_table
+    with conn.cursor() as cursor:
+        # Recreated every time so it follows new Bill columns
+        cursor.execute(f'DROP VIEW IF EXISTS {view}')
+        cursor.execute(
+            f'CREATE VIEW {view} AS '
+            f'SELECT {columns} FROM {Bill._meta.db_table} '
+            f'UNION ALL SELECT {columns} FROM {ArchivedBill._meta.db_table}'
+        )
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _ensure_partitions(cursor, oldest, newest):
+    """Create the monthly archive partitions covering [oldest, newest] (UTC months)"""
+    table = ArchivedBill._meta.db_table
+    month = _month_start(oldest.astimezone(dt_timezone.utc))
+    last = _month_start(newest.astimezone(dt_timezone.utc))
+    while month <= last:
+        following = _month_start(month + timedelta(days=32))
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {table}_p{month:%Y_%m} PARTITION OF {table} '
+            'FOR VALUES FROM (%s) TO (%s)',
+            [month, following],
+        )
+        month = following
+
+
+def archive_bills(older_than_days=None, chunk_size=DEFAULT_CHUNK_SIZE, now=None, progress=None):
+    """
+    Move completed and cancelled bills issued more than ``older_than_days``
+    (default BILL_ARCHIVE_AFTER_DAYS) ago to the archive, ``chunk_size`` per
+    transaction, oldest first, leaving a tombstone for each. Returns the number
+    of bills moved.
+    """
+    if older_than_days is None:
+        older_than_days = archive_after_days()
+    cutoff = (now or timezone.now()) - timedelta(days=older_than_days)
+    using = router.db_for_write(Bill)
+    conn = connections[using]
+    bill_table = Bill._meta.db_table
+    columns = _columns(conn)
+    candidates = Bill.objects.using(using).filter(
+        status__in=ARCHIVED_STATUSES, date_issued__lt=cutoff,
+    ).order_by('date_issued', 'id')
+
+    moved = 0
+    while True:
+        with transaction.atomic(using=using), stamping(using):
+            chunk = list(candidates.select_for_update().values_list('id', 'date_issued')[:chunk_size])
+            if not chunk:
+                break
+            ids = [pk for pk, _ in chunk]
+            placeholders = ', '.join(['%s'] * len(ids))
+            with conn.cursor() as cursor:
+                if conn.vendor == 'postgresql':
+                    _ensure_partitions(cursor, chunk[0][1], chunk[-1][1])
+                cursor.execute(
+                    f'INSERT INTO {ArchivedBill._meta.db_table} ({columns}) '
+                    f'SELECT {columns} FROM {bill_table} WHERE id IN ({placeholders})',
+                    ids,
+                )
+                cursor.execute(
+                    f'DELETE FROM {BillSearchDocument._meta.db_table} WHERE bill_id IN ({placeholders})', ids,
+                )
+                cursor.execute(f'DELETE FROM {bill_table} WHERE id IN ({placeholders})', ids)
+            for pk in ids:
+                record_deletion(pk, using)
+        moved += len(ids)
+        if progress:
+            progress(moved)
+
+    if moved:
+        get_analytics_cache().delete(HORIZON_KEY)
+        # The hot lists changed
+        bump_generation()
+    return moved
+
+
+def archive_horizon():
+    """
+    The newest date_issued and modified_date in the archive, as a dict (values
+    None while it is empty). Cached for ANALYTICS_CACHE_TTL: a process that
+    does not share the cache with the archive run sees new archives that late.
+    """
+    cache = get_analytics_cache()
+    horizon = cache.get(HORIZON_KEY)
+    if horizon is None:
+        horizon = ArchivedBill.objects.aggregate(
+            date_issued=Max('date_issued'), modified_date=Max('modified_date'),
+        )
+        cache.set(HORIZON_KEY, horizon, timeout=get_ttl())
+    return horizon
+
+
+def bills_with_archive():
+    """
+    Bill.objects, or BillHistory.objects once anything has been archived, for
+    the lists that cover every date (completed and cancelled bills)
+    """
+    if archive_horizon()['date_issued'] is None:
+        return Bill.objects
+    return BillHistory.objects
+
+
+def _as_datetime(value):
+    """A datetime from a datetime or an ISO date/datetime string (None if unparseable)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            return None
+        parsed = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def bills_for_range(**ranges):
+    """
+    Bill.objects, or BillHistory.objects when a date range filter may match
+    archived bills. Keyword arguments name the filtered column (date_issued or
+    modified_date) with a (start, end) pair of datetimes or ISO dates, either
+    of which may be None; a range with neither bound is no filter.
+
+    Any range starting at or before the newest archived value of its column
+    reaches the archive (so does an unparseable start, to be safe).
+    """
+    horizon = None
+    for column, (start, end) in ranges.items():
+        if not (start or end):
+            continue
+        if horizon is None:
+            horizon = archive_horizon()
+        newest = horizon[column]
+        if newest is None:
+            continue
+        start = _as_datetime(start) if start else None
+        if start is None or start <= newest:
+            return BillHistory.objects
+    return Bill.objects
@@ -0,0 +1,69 @@
+"""
+Helpers for the async (ASGI) API views. DRF's @api_view only wraps sync
+views, so authentication and rendering are done here with the same JWT
+authentication and JSON renderer the DRF views use.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from backend.renderers import FastJSONRenderer
+from backend.timing import serializing
+
+
+async def authenticate_request(request):
+    """The active user behind the request's JWT, or None"""
+    header = request.headers.get('Authorization', '')
+    raw_token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+    if not raw_token:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        user = await sync_to_async(authentication.get_user)(validated_token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return user if user.is_active else None
+
+
+def unauthorized():
+    return JsonResponse(
+        {'detail': 'Authentication credentials were not provided.'},
+        status=status.HTTP_401_UNAUTHORIZED,
+    )
+
+
+def render(response):
+    """Finalize a DRF Response returned by an async view"""
+    if isinstance(response, Response):
+        response.accepted_renderer = FastJSONRenderer()
+        response.accepted_media_type = FastJSONRenderer.media_type
+        response.renderer_context = {}
+        with serializing():
+            response.render()
+    return response
+
+
+def async_api_view(view):
+    """
+    GET-only, authenticated async view returning DRF Responses; the async
+    counterpart of @api_view(['GET']) + @permission_classes([IsAuthenticated]).
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return JsonResponse(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status=status.HTTP_405_METHOD_NOT_ALLOWED,
+            )
+        user = await authenticate_request(request)
+        if user is None:
+            return unauthorized()
+        request.user = user
+        return render(await view(request, *args, **kwargs))
+    return wrapper
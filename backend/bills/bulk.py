@@ -0,0 +1,87 @@
+"""
+Bulk bill status transitions (end-of-shift batch closing).
+
+All bills and their barcodes are fetched up front in two queries, validated
+in Python, and closed together through transitions.close_bills, which writes
+them with set-based conditional UPDATEs.
+"""
+from codes.models import Barcode
+
+from .models import Bill
+from .transitions import BILL_TRANSITIONS, close_bills
+
+BULK_TARGET_STATUSES = BILL_TRANSITIONS['pending']
+
+MAX_BULK_TRANSITION = 1000
+
+
+def _outcome(bill, ok, error=None, identifier=None):
+    outcome = {
+        'id': bill.pk if bill else identifier,
+        'code': bill.code if bill else None,
+        'ok': ok,
+    }
+    if bill:
+        outcome['status'] = bill.status
+    if error:
+        outcome['error'] = error
+    return outcome
+
+
+def _pick_bills(ids=None, codes=None):
+    """
+    Resolve the requested identifiers to bills, keeping the request order.
+    Returns a list of (identifier, bill or None).
+    """
+    if ids is not None:
+        bills = Bill.objects.in_bulk(ids)
+        return [(pk, bills.get(pk)) for pk in ids]
+
+    by_code = {}
+    for bill in Bill.objects.filter(code__in=codes).order_by('date_issued'):
+        # Bill codes are not unique; prefer the pending bill, then the newest
+        current = by_code.get(bill.code)
+        if current is None or current.status != 'pending' or bill.status == 'pending':
+            by_code[bill.code] = bill
+    return [(code, by_code.get(code)) for code in codes]
+
+
+def bulk_transition(target_status, person, ids=None, codes=None):
+    """
+    Move pending bills (and their active barcodes) to ``target_status``.
+    Returns one outcome dict per requested id/code, in request order.
+    """
+    picked = _pick_bills(ids=ids, codes=codes)
+    found = [bill for _, bill in picked if bill is not None]
+    barcodes = {
+        barcode.code: barcode
+        for barcode in Barcode.objects.filter(code__in={bill.code for bill in found})
+    }
+
+    outcomes, pairs = [], []
+    seen = set()
+    for identifier, bill in picked:
+        if bill is None:
+            outcomes.append((None, identifier, 'Bill not found'))
+            continue
+        if bill.pk in seen:
+            outcomes.append((bill, identifier, 'Bill listed more than once'))
+            continue
+        seen.add(bill.pk)
+        if bill.status != 'pending':
+            outcomes.append((bill, identifier, f'Bill is already {bill.status}'))
+            continue
+        barcode = barcodes.get(bill.code)
+        if barcode is None or barcode.status != 'active':
+            outcomes.append((bill, identifier, 'Barcode is either not active or already expired.'))
+            continue
+        pairs.append((bill, barcode))
+        outcomes.append((bill, identifier, None))
+
+    errors = close_bills(pairs, target_status, person) if pairs else {}
+    results = []
+    for bill, identifier, error in outcomes:
+        if error is None and bill.pk in errors:
+            error = errors[bill.pk]
+        results.append(_outcome(bill, error is None, error, identifier=identifier))
+    return results
@@ -0,0 +1,196 @@
+"""
+Response cache for the analytics endpoints.
+
+Entries are keyed by (endpoint, generation, the query parameters the view
+reads, tenant scope). Any write to a
+Bill or Barcode bumps the generation counter once the transaction commits, so
+older entries simply stop being addressed and age out through their TTL. The
+generation and the hit/miss counters live in the cache itself, so every
+process sharing a cache backend (e.g. the file based one) sees the same values.
+A counter lost with the cache restarts from the clock rather than from 1, so
+generations never repeat; conditional.py relies on that for its ETags.
+"""
+import asyncio
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+GENERATION_KEY = 'analytics:generation'
+CHANGED_AT_KEY = 'analytics:generation:changed_at'
+STATS_KEY = 'analytics:stats:{endpoint}:{outcome}'
+
+CACHED_ENDPOINTS = []
+
+# Query parameters every cached view reads, with their defaults
+DEFAULT_PARAMS = {'days': '30'}
+
+
+def get_analytics_cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]
+
+
+def get_ttl():
+    return getattr(settings, 'ANALYTICS_CACHE_TTL', 60)
+
+
+def _start_generation(cache):
+    """
+    Create a missing counter, starting at the current time in milliseconds:
+    above every generation handed out before the cache was cleared. Whatever
+    happened meanwhile counts as a change now.
+    """
+    now = time.time()
+    generation = int(now * 1000)
+    if cache.add(GENERATION_KEY, generation, timeout=None):
+        cache.set(CHANGED_AT_KEY, now, timeout=None)
+    return cache.get(GENERATION_KEY, generation)
+
+
+def current_generation():
+    cache = get_analytics_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = _start_generation(cache)
+    return generation
+
+
+def generation_state():
+    """The current generation and when it last changed (a timestamp, None if unknown)"""
+    cache = get_analytics_cache()
+    values = cache.get_many([GENERATION_KEY, CHANGED_AT_KEY])
+    if GENERATION_KEY not in values:
+        return _start_generation(cache), cache.get(CHANGED_AT_KEY)
+    return values[GENERATION_KEY], values.get(CHANGED_AT_KEY)
+
+
+def bump_generation():
+    """Invalidate every cached analytics response"""
+    cache = get_analytics_cache()
+    # Before the bump: a reader in between pairs the old generation with the
+    # new time, never the new generation with an old Last-Modified
+    cache.set(CHANGED_AT_KEY, time.time(), timeout=None)
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Counter missing (cache cleared or never used): start a new one
+        return _start_generation(cache)
+
+
+def bump_generation_on_commit():
+    transaction.on_commit(bump_generation)
+
+
+def tenant_scope(request):
+    """
+    The tenant part of the cache key. Analytics are scoped per enterprise when
+    the person has one; persons currently have no enterprise, so everybody
+    shares the global scope.
+    """
+    person = getattr(request.user, 'person', None)
+    enterprise_id = getattr(person, 'enterprise_id', None)
+    return f'e{enterprise_id}' if enterprise_id is not None else 'global'
+
+
+def cache_key(endpoint, request, generation, params=DEFAULT_PARAMS):
+    """
+    The key of ``request``'s response: ``params`` maps each query parameter
+    the view reads to its default. Other parameters do not split the cache.
+    """
+    query = urlencode(sorted((name, request.GET.get(name, default)) for name, default in params.items()))
+    return f'analytics:{endpoint}:g{generation}:{query}:{tenant_scope(request)}'
+
+
+def _count(endpoint, outcome):
+    cache = get_analytics_cache()
+    key = STATS_KEY.format(endpoint=endpoint, outcome=outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cached_analytics(endpoint, params=None):
+    """
+    Cache the data of successful responses of an analytics view (sync or
+    async). Goes below @api_view/@permission_classes (or @async_api_view) so
+    only authenticated requests are served. ``params`` adds the query
+    parameters the view reads besides ``days``, with their defaults.
+    """
+    CACHED_ENDPOINTS.append(endpoint)
+    params = {**DEFAULT_PARAMS, **(params or {})}
+
+    def lookup(request):
+        """The cache key for ``request`` and the cached response, if any"""
+        cache = get_analytics_cache()
+        key = cache_key(endpoint, request, current_generation(), params)
+        data = cache.get(key)
+        if data is None:
+            _count(endpoint, 'misses')
+            return key, None
+        _count(endpoint, 'hits')
+        response = Response(data)
+        response['X-Cache'] = 'HIT'
+        return key, response
+
+    def store(key, response):
+        if response.status_code == 200:
+            get_analytics_cache().set(key, response.data, timeout=get_ttl())
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                key, response = await sync_to_async(lookup)(request)
+                if response is not None:
+                    return response
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(store)(key, response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, response = lookup(request)
+            if response is not None:
+                return response
+            return store(key, view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    """Hit/miss counters per endpoint plus the current generation"""
+    cache = get_analytics_cache()
+    endpoints = {}
+    for endpoint in CACHED_ENDPOINTS:
+        hits = cache.get(STATS_KEY.format(endpoint=endpoint, outcome='hits'), 0)
+        misses = cache.get(STATS_KEY.format(endpoint=endpoint, outcome='misses'), 0)
+        lookups = hits + misses
+        endpoints[endpoint] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups * 100, 2) if lookups else 0,
+        }
+    return {
+        'generation': current_generation(),
+        'ttl': get_ttl(),
+        'backend': settings.CACHES[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]['BACKEND'],
+        'endpoints': endpoints,
+    }
+
+
+def reset_stats():
+    cache = get_analytics_cache()
+    cache.delete_many([
+        STATS_KEY.format(endpoint=endpoint, outcome=outcome)
+        for endpoint in CACHED_ENDPOINTS
+        for outcome in ('hits', 'misses')
+    ])
@@ -0,0 +1,225 @@
+"""
+Change stamps for delta sync of the bill lists (bills/changes/).
+
+Every write to a bill sets Bill.change_stamp to the next value of a single
+row counter, BillChangeCounter, incremented inside the writing transaction;
+deleting (or archiving) a bill leaves a BillTombstone stamped the same way.
+The increment locks the counter row until commit, so stamps become visible in
+the order they were handed out: once a reader sees the counter at n, every
+write stamped n or lower is visible too and nothing committed later gets a
+lower stamp. The counter value is therefore a safe resume token: a client
+that asks for changes after it never misses one (it may see a row twice).
+
+Since every bill write takes that one lock, it is taken as late as possible:
+writers collect the bills they wrote in a ``stamping()`` block, and leaving
+the outermost block (at the end of the writing transaction, after rollups,
+counters, search documents...) stamps them all with one counter increment
+and one UPDATE of rows the transaction already holds. The counter lock is
+thus held only for the last statements of a transaction and never while
+waiting for another row lock, and every writer takes it last, so it cannot
+be part of a lock order inversion. Writes outside a block (queryset deletes
+cascading to bills) are stamped on the spot.
+
+Reads of the token and of the changed rows must go to the same database, so
+bills/changes/ is not one of the replica routed endpoints.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Max
+
+from .models import Bill, BillChangeCounter, BillTombstone
+
+COUNTER_ID = 1
+
+
+def _create_counter(using):
+    """Start the counter above every stamp already handed out"""
+    start = max(
+        Bill.objects.using(using).aggregate(stamp=Max('change_stamp'))['stamp'] or 0,
+        BillTombstone.objects.using(using).aggregate(stamp=Max('change_stamp'))['stamp'] or 0,
+    )
+    with transaction.atomic(using=using):
+        BillChangeCounter.objects.using(using).get_or_create(pk=COUNTER_ID, defaults={'value': start})
+
+
+def next_stamp(using=None):
+    """Increment the counter and return its new value; the counter stays locked until commit"""
+    using = using or router.db_for_write(BillChangeCounter)
+    connection = connections[using]
+    table = connection.ops.quote_name(BillChangeCounter._meta.db_table)
+    with connection.cursor() as cursor:
+        # RETURNING: PostgreSQL, SQLite 3.35+
+        cursor.execute(f'UPDATE {table} SET value = value + 1 WHERE id = %s RETURNING value', [COUNTER_ID])
+        row = cursor.fetchone()
+    if row is None:
+        _create_counter(using)
+        return next_stamp(using)
+    return row[0]
+
+
+class PendingStamps:
+    """The bills written in a ``stamping()`` block, stamped when it ends"""
+
+    # Bills per UPDATE (SQLite allows 999 parameters)
+    BATCH_SIZE = 500
+
+    def __init__(self):
+        self.bill_ids = set()
+        self.unlocked_ids = set()
+        self.deleted_ids = set()
+        self.instances = []
+
+    def add(self, bills, locked=True):
+        """
+        Stamp ``bills`` (instances, whose change_stamp is set too, or ids).
+        ``locked=False`` for rows the transaction has not written: they are
+        locked before the counter is.
+        """
+        for bill in bills:
+            if isinstance(bill, Bill):
+                self.instances.append(bill)
+                bill = bill.pk
+            self.bill_ids.add(bill)
+            if not locked:
+                self.unlocked_ids.add(bill)
+
+    def add_deletion(self, bill_id):
+        self.deleted_ids.add(bill_id)
+
+    def flush(self, using):
+        if not (self.bill_ids or self.deleted_ids):
+            return None
+        bills = Bill.objects.using(using)
+        if self.unlocked_ids and connections[using].features.has_select_for_update:
+            list(bills.select_for_update().filter(pk__in=self.unlocked_ids).values_list('pk', flat=True))
+        deleted_ids = self.deleted_ids
+        if deleted_ids:
+            # A deletion undone with its savepoint leaves the bill in place
+            deleted_ids = deleted_ids - set(bills.filter(pk__in=deleted_ids).values_list('pk', flat=True))
+
+        stamp = next_stamp(using)
+        bill_ids = sorted(self.bill_ids - deleted_ids)
+        for start in range(0, len(bill_ids), self.BATCH_SIZE):
+            bills.filter(pk__in=bill_ids[start:start + self.BATCH_SIZE]).update(change_stamp=stamp)
+        if deleted_ids:
+            BillTombstone.objects.using(using).bulk_create(
+                [BillTombstone(bill_id=bill_id, change_stamp=stamp) for bill_id in sorted(deleted_ids)],
+                batch_size=self.BATCH_SIZE,
+                update_conflicts=True, unique_fields=['bill_id'], update_fields=['change_stamp'],
+            )
+        for instance in self.instances:
+            instance.change_stamp = stamp
+        return stamp
+
+
+@contextmanager
+def stamping(using=None):
+    """
+    Collect the bills written in the block (``PendingStamps.add``) and stamp
+    them as its last statements. Open it inside the writing transaction;
+    nested blocks join the outermost one, which does the stamping. Nothing is
+    stamped when the block raises.
+    """
+    using = using or router.db_for_write(Bill)
+    pending = _pending(using)
+    if pending is not None:
+        yield pending
+        return
+    connection = connections[using]
+    pending = connection.pending_bill_stamps = PendingStamps()
+    try:
+        yield pending
+    finally:
+        connection.pending_bill_stamps = None
+    pending.flush(using)
+
+
+def _pending(using):
+    return getattr(connections[using], 'pending_bill_stamps', None)
+
+
+def stamp_bills(bills, using=None, locked=True):
+    """
+    Stamp ``bills`` (instances or ids) at the end of the enclosing
+    ``stamping()`` block, or right away (in a transaction of its own) outside
+    of one
+    """
+    using = using or router.db_for_write(Bill)
+    pending = _pending(using)
+    if pending is not None:
+        pending.add(bills, locked=locked)
+        return
+    with transaction.atomic(using=using), stamping(using) as pending:
+        pending.add(bills, locked=locked)
+
+
+def record_deletion(bill_id, using=None):
+    """Leave a tombstone for a deleted bill, stamped like a write"""
+    using = using or router.db_for_write(BillTombstone)
+    pending = _pending(using)
+    if pending is not None:
+        pending.add_deletion(bill_id)
+        return
+    with transaction.atomic(using=using), stamping(using) as pending:
+        pending.add_deletion(bill_id)
+
+
+def current_token():
+    """The highest stamp whose writes are all committed"""
+    return BillChangeCounter.objects.filter(pk=COUNTER_ID).values_list('value', flat=True).first() or 0
+
+
+def changes_limit():
+    return getattr(settings, 'BILL_CHANGES_LIMIT', 1000)
+
+
+def _page_end(since, token, limit):
+    """
+    The stamp a page of changes after ``since`` ends at: the stamp of the
+    ``limit``-th changed row (bill or tombstone) or ``token`` if there are
+    fewer. Rows sharing a stamp were written together and are never split.
+    """
+    stamps = []
+    for model in (Bill, BillTombstone):
+        stamps += model.objects.filter(change_stamp__gt=since, change_stamp__lte=token).order_by(
+            'change_stamp',
+        ).values_list('change_stamp', flat=True)[:limit]
+    stamps.sort()
+    return stamps[limit - 1] if len(stamps) >= limit else token
+
+
+def changes_since(since, status=None, token=None, limit=None):
+    """
+    What changed after the token ``since`` (at most ``token``, the current
+    one): a BillRowSerializer queryset of bills created or updated since
+    (with ``status``, only those now in it), the ids of bills that are gone
+    (deleted or archived, or with ``status``, no longer in it) and the token
+    to pass next time. From 0 nothing is gone: the client has nothing yet.
+
+    A page holds about ``limit`` (default BILL_CHANGES_LIMIT) changed rows;
+    the returned token is then below the current one and the caller asks
+    again from it. ``since`` must not be ahead of the current token.
+
+    The token is read first (or passed in as ``token``, read before this
+    call); rows committed after it are left for the next call.
+    """
+    if token is None:
+        token = current_token()
+    if since > token:
+        raise ValueError(f'since {since} is ahead of the current token {token}')
+    end = _page_end(since, token, limit or changes_limit())
+    changed = Bill.objects.filter(change_stamp__gt=since, change_stamp__lte=end).select_related(
+        'issued_by__user', 'modified_by__user',
+    ).order_by('change_stamp', 'id')
+    removed = []
+    if since:
+        removed += BillTombstone.objects.filter(
+            change_stamp__gt=since, change_stamp__lte=end,
+        ).values_list('bill_id', flat=True)
+    if status is not None:
+        if since:
+            removed += changed.exclude(status=status).values_list('pk', flat=True)
+        changed = changed.filter(status=status)
+    return changed, sorted(removed), end
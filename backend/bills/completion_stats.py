@@ -0,0 +1,183 @@
+"""
+Completion-time statistics (issue -> completion) computed in the database.
+
+On PostgreSQL mean, percentiles and the histogram are all single grouped
+queries (percentile_cont). Backends without ordered-set aggregates (SQLite)
+get count/mean/histogram from SQL and the percentiles from one streamed,
+database-sorted values_list pass per breakdown, which only ever holds the
+handful of ranks it needs, so memory stays bounded however many bills match.
+"""
+from math import floor
+
+from django.db import NotSupportedError, connection
+from django.db.models import Aggregate, Avg, Count, F, FloatField, Func
+from django.db.models.functions import Floor
+
+DEFAULT_PERCENTILES = (0.5, 0.9, 0.99)
+DEFAULT_BREAKDOWNS = ('material', 'region', 'issue_location')
+STREAM_CHUNK_SIZE = 2000
+
+
+class DurationSeconds(Func):
+    """Seconds elapsed between two datetime expressions (end - start)"""
+    output_field = FloatField()
+    arity = 2
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'DurationSeconds is not supported on {connection.vendor}')
+
+    def _compile(self, compiler):
+        end, start = self.get_source_expressions()
+        end_sql, end_params = compiler.compile(end)
+        start_sql, start_params = compiler.compile(start)
+        return end_sql, start_sql, (*end_params, *start_params)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        end_sql, start_sql, params = self._compile(compiler)
+        # Rounded to the millisecond: julianday() differences are a float
+        # error away from whole seconds, enough to drop a bill into the
+        # histogram bucket below
+        return f'ROUND((julianday({end_sql}) - julianday({start_sql})) * 86400.0, 3)', params
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        end_sql, start_sql, params = self._compile(compiler)
+        return f'EXTRACT(EPOCH FROM ({end_sql} - {start_sql}))::double precision', params
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        end_sql, start_sql, params = self._compile(compiler)
+        return f'(TIMESTAMPDIFF(MICROSECOND, {start_sql}, {end_sql}) / 1000000.0)', params
+
+
+class PercentileCont(Aggregate):
+    """PostgreSQL percentile_cont(fraction) WITHIN GROUP (ORDER BY expression)"""
+    function = 'percentile_cont'
+    name = 'PercentileCont'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, fraction, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def supports_percentiles():
+    return connection.vendor == 'postgresql'
+
+
+def _label(fraction):
+    return f'p{round(fraction * 100):g}'
+
+
+def _hours(seconds):
+    return round(seconds / 3600, 2) if seconds is not None else None
+
+
+def _interpolate(values_at, count, fraction):
+    """percentile_cont over a sorted sequence given as {rank: value}"""
+    position = fraction * (count - 1)
+    lower = floor(position)
+    upper = min(lower + 1, count - 1)
+    low_value = values_at[lower]
+    return low_value + (values_at[upper] - low_value) * (position - lower)
+
+
+def _wanted_ranks(count, fractions):
+    ranks = set()
+    for fraction in fractions:
+        position = floor(fraction * (count - 1))
+        ranks.update((position, min(position + 1, count - 1)))
+    return ranks
+
+
+def _streamed_percentiles(queryset, field, counts, fractions):
+    """
+    Percentiles per group from one pass over (group, duration) rows sorted by
+    the database. ``counts`` maps each group value to its number of rows.
+    """
+    group_fields = (field,) if field else ()
+    rows = queryset.order_by(*group_fields, 'duration').values_list(*group_fields, 'duration')
+
+    results = {}
+    current, rank, wanted, values_at = object(), 0, set(), {}
+    for row in rows.iterator(chunk_size=STREAM_CHUNK_SIZE):
+        group = row[0] if field else None
+        if group != current:
+            current, rank, values_at = group, 0, {}
+            wanted = _wanted_ranks(counts[group], fractions)
+            results[group] = values_at
+        if rank in wanted:
+            values_at[rank] = row[-1]
+        rank += 1
+
+    return {
+        group: {fraction: _interpolate(values_at, counts[group], fraction) for fraction in fractions}
+        for group, values_at in results.items()
+    }
+
+
+def _stats(queryset, field, fractions):
+    """count/mean/percentiles, overall (field=None) or per value of ``field``"""
+    aggregates = {'count': Count('id'), 'mean': Avg('duration')}
+    if supports_percentiles():
+        for fraction in fractions:
+            aggregates[_label(fraction)] = PercentileCont('duration', fraction)
+
+    if field:
+        rows = list(queryset.values(field).annotate(**aggregates).order_by('-count'))
+    else:
+        rows = [queryset.aggregate(**aggregates)]
+
+    if not supports_percentiles():
+        counts = {(row[field] if field else None): row['count'] for row in rows if row['count']}
+        percentiles = _streamed_percentiles(queryset, field, counts, fractions) if counts else {}
+        for row in rows:
+            group_percentiles = percentiles.get(row[field] if field else None, {})
+            for fraction in fractions:
+                row[_label(fraction)] = group_percentiles.get(fraction)
+
+    stats = []
+    for row in rows:
+        entry = {field: row[field]} if field else {}
+        entry['count'] = row['count']
+        entry['mean_hours'] = _hours(row['mean'])
+        for fraction in fractions:
+            entry[f'{_label(fraction)}_hours'] = _hours(row[_label(fraction)])
+        stats.append(entry)
+    return stats
+
+
+def completion_time_stats(bills, bucket_hours=1, percentiles=DEFAULT_PERCENTILES,
+                          breakdowns=DEFAULT_BREAKDOWNS):
+    """
+    Completion-time statistics for the completed bills of ``bills``: overall
+    mean/percentiles, a histogram with ``bucket_hours`` wide buckets, and the
+    same statistics broken down per value of each field in ``breakdowns``.
+    """
+    queryset = bills.filter(
+        status='completed',
+        modified_date__isnull=False,
+    ).annotate(
+        duration=DurationSeconds('modified_date', 'date_issued'),
+    ).order_by()
+
+    bucket_seconds = bucket_hours * 3600
+    histogram = queryset.annotate(
+        bucket_index=Floor(F('duration') / bucket_seconds),
+    ).values('bucket_index').annotate(count=Count('id')).order_by('bucket_index')
+
+    return {
+        'overall': _stats(queryset, None, percentiles)[0],
+        'histogram': {
+            'bucket_hours': bucket_hours,
+            'buckets': [
+                {
+                    'start_hours': round(row['bucket_index'] * bucket_hours, 2),
+                    'count': row['count'],
+                }
+                for row in histogram
+            ],
+        },
+        'breakdowns': {
+            field: _stats(queryset, field, percentiles)
+            for field in breakdowns
+        },
+    }
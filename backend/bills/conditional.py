@@ -0,0 +1,111 @@
+"""
+Conditional GETs (ETag / Last-Modified) for the bill lists and analytics.
+
+The ETag hashes a write watermark with what else the response depends on:
+the endpoint, the query string, the negotiated media type and, for the
+analytics (``tenant=True``), the tenant scope they are cached under. When the
+client's If-None-Match (or If-Modified-Since) still matches, the view is never
+called: the 304 costs the watermark lookup and no other queries besides
+authentication.
+
+The bill lists use the change counter of bills/changes.py as the watermark.
+It lives in the database, so every worker process sees every write: each
+bill write, deletion, archival and rename of a person shown next to a bill
+increments it in its transaction. It carries no time, so these responses
+have no Last-Modified.
+
+Analytics use the analytics cache generation (see cache.py), which every
+Bill or Barcode write bumps on commit, and depend on the clock anyway
+(rolling windows, "last updated"): with ``clock=True`` the ETag also changes
+every ANALYTICS_CACHE_TTL seconds. With a per-process cache a worker may
+miss another's writes for that long, the same staleness its cached response
+has; they get a Last-Modified from the generation's timestamp.
+
+Responses are marked ``Cache-Control: private, no-cache`` so browsers keep
+them but revalidate on every use instead of guessing a freshness lifetime
+from Last-Modified.
+"""
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import cache, changes
+
+
+def validators(endpoint, request, tenant=False, clock=False):
+    """The ETag and the Last-Modified timestamp (or None) of ``endpoint``'s response to ``request``"""
+    if clock:
+        generation, changed_at = cache.generation_state()
+        watermark = f'g{generation}'
+    else:
+        token = changes.current_token()
+        # Read before the view: bills/changes/ answers from the same token
+        request.bill_change_token = token
+        watermark, changed_at = f'c{token}', None
+    now = time.time()
+    parts = [
+        endpoint,
+        watermark,
+        request.get_full_path(),
+        # DRF views negotiate (JSON or the browsable API); async views only render JSON
+        getattr(request, 'accepted_media_type', 'application/json'),
+    ]
+    if tenant:
+        parts.append(cache.tenant_scope(request))
+    if clock:
+        ttl = cache.get_ttl()
+        period_start = now // ttl * ttl
+        parts.append(str(period_start))
+        changed_at = max(changed_at, period_start) if changed_at is not None else None
+    etag = 'W/"%s"' % hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+    # Last-Modified has a one second resolution: announcing the current second
+    # would hide a second write within it from If-Modified-Since
+    if changed_at is None or now - changed_at < 1:
+        return etag, None
+    return etag, int(changed_at)
+
+
+def conditional_get(endpoint, tenant=False, clock=False):
+    """
+    Answer GETs of a view (sync or async) with 304 Not Modified while the
+    client's copy is current. Goes below @api_view/@permission_classes (or
+    @async_api_view), above @cached_analytics, so only authenticated requests
+    are answered and a 304 skips the response cache as well.
+    """
+    def check(request):
+        """The validators and, when the client's copy is current, the 304 (or 412) to send"""
+        etag, last_modified = validators(endpoint, request, tenant, clock)
+        return etag, last_modified, get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    def finish(response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            if last_modified is not None:
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                etag, last_modified, response = await sync_to_async(check)(request)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return finish(response, etag, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag, last_modified, response = check(request)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return finish(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,379 @@
+"""
+Deterministic bulk generation of realistic bills and barcodes for load and
+scaling tests.
+
+Bill number ``i`` always gets the same data for a given seed and reference
+time: bills are generated in fixed chunks of CHUNK_SIZE, each with its own
+random generator seeded from (seed, chunk). The chunking therefore does not
+change the output, and chunks can be inserted by several worker processes at
+once (PostgreSQL only: SQLite allows one writer, so there it stays in process).
+Every bill is inserted with its barcode in the matching state, through
+bulk_create. Signals do not run for those inserts, so callers rebuild the
+rollups, the search index and the barcode counters afterwards
+(``refresh_derived_tables``).
+
+The distributions are skewed the way real traffic is: more bills on recent
+days and working days (Saturday is the weekly holiday), most issued during
+the working hours, a few materials, destinations and customers accounting
+for most bills, and log-normal amounts and transit times.
+"""
+import math
+import random
+from bisect import bisect
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+from multiprocessing import get_context
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from codes import counters
+from codes.models import Barcode
+from enterprise.models import Person
+from userauth.models import User
+
+from .cache import bump_generation
+from .changes import stamping
+from .models import Bill
+from .rollups import rebuild
+from .search import rebuild_index
+
+CHUNK_SIZE = 5000
+CODE_PREFIX = 'SD'
+SPARE_CODE_PREFIX = 'SX'
+PENDING_CODE_PREFIX = 'SP'
+CODE_DIGITS = 9
+DEFAULT_STAFF = 20
+ADMIN_EMAIL = 'seed-admin@example.com'
+STAFF_EMAIL = 'seed-staff{index}@example.com'
+
+# Weights below are relative; they need not sum to anything in particular
+MATERIALS = {
+    'roda': 30, 'baluwa': 22, 'gravel': 14, 'dhunga': 10, 'chips': 7, 'dust': 5,
+    'mato': 4, 'base/subbase': 3, 'itta': 2, 'kawadi': 1, 'kaath/daura': 1, 'other': 1,
+}
+DESTINATIONS = {
+    'Kathmandu Ring Road': 28, 'Prithvi Highway': 20, 'East-West Highway': 16, 'Tribhuvan Highway': 10,
+    'Araniko Highway': 8, 'BP Highway': 6, 'Postal Highway': 5, 'Pasang Lhamu Highway': 3,
+    'Mid-Hill Highway': 2, 'Local Road': 2,
+}
+ISSUE_LOCATIONS = {
+    'Kathmandu': 30, 'Lalitpur': 18, 'Bhaktapur': 14, 'Chitwan': 12, 'Pokhara': 10,
+    'Butwal': 6, 'Hetauda': 5, 'Biratnagar': 5,
+}
+# (vehicle size, weight, median amount)
+VEHICLE_SIZES = [
+    ('420 cubic feet', 15, 42000),
+    ('260 cubic feet', 35, 26000),
+    ('160 cubic feet', 30, 16000),
+    ('100 cubic feet', 15, 10000),
+    ('other', 5, 20000),
+]
+# Bills issued per hour of the day (local time)
+HOUR_WEIGHTS = [1, 1, 1, 1, 2, 4, 8, 12, 15, 16, 16, 15, 13, 14, 15, 14, 12, 10, 7, 5, 4, 3, 2, 1]
+# Monday..Sunday; Saturday is the weekly holiday
+WEEKDAY_WEIGHTS = [10, 10, 10, 10, 9, 3, 10]
+# How much busier the most recent day is than the first day of the history
+GROWTH = 1.5
+CUSTOMER_COUNT = 300
+CUSTOMER_WORDS = [
+    'Everest', 'Himalayan', 'Annapurna', 'Bagmati', 'Gandaki', 'Koshi', 'Narayani', 'Sagarmatha',
+    'Janakpur', 'Lumbini', 'Makalu', 'Kanchan', 'Shree', 'Nepal', 'Valley', 'Mountain',
+]
+CUSTOMER_KINDS = ['Construction', 'Builders', 'Suppliers', 'Infrastructure', 'Developers', 'Traders']
+VEHICLE_ZONES = ['BA', 'BA', 'BA', 'NA', 'LU', 'GA', 'KO', 'JA', 'ME', 'SA']
+CANCEL_RATE = 0.06
+LOCAL_SHARE = 0.2
+
+
+def _cumulative(weights):
+    return list(accumulate(weights))
+
+
+def _pick(rng, values, cumulative):
+    return values[bisect(cumulative, rng.random() * cumulative[-1])]
+
+
+def bill_code(index):
+    return f'{CODE_PREFIX}{index:0{CODE_DIGITS}d}'
+
+
+def spare_code(index):
+    return f'{SPARE_CODE_PREFIX}{index:0{CODE_DIGITS}d}'
+
+
+def pending_code(index):
+    return f'{PENDING_CODE_PREFIX}{index:0{CODE_DIGITS}d}'
+
+
+def ensure_people(staff=DEFAULT_STAFF):
+    """The seed admin and ``staff`` seed staff, created on first use; returns (admin pk, staff pks)"""
+    emails = [ADMIN_EMAIL] + [STAFF_EMAIL.format(index=index) for index in range(1, staff + 1)]
+    existing = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+    password = make_password(None)
+    User.objects.bulk_create([
+        User(email=email, name='Seed Admin' if email == ADMIN_EMAIL else f'Seed Staff {index}',
+             password=password, is_active=True)
+        for index, email in enumerate(emails) if email not in existing
+    ])
+    users = dict(User.objects.filter(email__in=emails).values_list('email', 'pk'))
+    have_person = set(Person.objects.filter(user__in=users.values()).values_list('pk', flat=True))
+    Person.objects.bulk_create([
+        Person(user_id=users[email], role='Admin' if email == ADMIN_EMAIL else 'Staff')
+        for email in emails if users[email] not in have_person
+    ])
+    return users[ADMIN_EMAIL], [users[email] for email in emails[1:]]
+
+
+class BillGenerator:
+    """Builds the bills and barcodes of one chunk; picklable, so worker processes can rebuild it"""
+
+    def __init__(self, seed, now, days, admin, staff):
+        self.seed = seed
+        self.now = now
+        self.days = days
+        self.admin = admin
+        self.staff = staff
+        tz = timezone.get_current_timezone()
+        local_now = timezone.localtime(now, tz)
+        self.first_day = (local_now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        day_weights = [
+            WEEKDAY_WEIGHTS[(self.first_day + timedelta(days=day)).weekday()]
+            * (1 + (GROWTH - 1) * day / max(days - 1, 1))
+            for day in range(days)
+        ]
+        self.day_cumulative = _cumulative(day_weights)
+        self.hour_cumulative = _cumulative(HOUR_WEIGHTS)
+        self.materials = list(MATERIALS)
+        self.material_cumulative = _cumulative(MATERIALS.values())
+        self.destinations = list(DESTINATIONS)
+        self.destination_cumulative = _cumulative(DESTINATIONS.values())
+        self.locations = list(ISSUE_LOCATIONS)
+        self.location_cumulative = _cumulative(ISSUE_LOCATIONS.values())
+        self.size_cumulative = _cumulative(weight for _, weight, _ in VEHICLE_SIZES)
+        customers = random.Random(f'{seed}:customers')
+        self.customers = [
+            f'{customers.choice(CUSTOMER_WORDS)} {customers.choice(CUSTOMER_WORDS)} {customers.choice(CUSTOMER_KINDS)}'
+            for _ in range(CUSTOMER_COUNT)
+        ]
+        # Zipf: the n-th customer orders about 1/n as often as the first
+        self.customer_cumulative = _cumulative(1 / rank for rank in range(1, CUSTOMER_COUNT + 1))
+
+    def __getstate__(self):
+        return {'seed': self.seed, 'now': self.now, 'days': self.days, 'admin': self.admin, 'staff': self.staff}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def issued_at(self, rng):
+        while True:
+            day = bisect(self.day_cumulative, rng.random() * self.day_cumulative[-1])
+            hour = bisect(self.hour_cumulative, rng.random() * self.hour_cumulative[-1])
+            moment = self.first_day + timedelta(days=day, hours=hour, seconds=rng.randrange(3600))
+            # The last day is only partly over
+            if moment < self.now:
+                return moment
+
+    def bill(self, rng, index):
+        date_issued = self.issued_at(rng)
+        size, _, median_amount = VEHICLE_SIZES[bisect(self.size_cumulative, rng.random() * self.size_cumulative[-1])]
+        region = 'local' if rng.random() < LOCAL_SHARE else 'crossborder'
+        transit_hours = 2 if region == 'local' else rng.lognormvariate(math.log(14), 0.5)
+        eta = date_issued + timedelta(hours=transit_hours * rng.uniform(0.9, 1.3))
+        # Local bills are completed when issued; the rest when they arrive
+        closed_at = date_issued if region == 'local' else date_issued + timedelta(
+            hours=transit_hours * rng.lognormvariate(0, 0.25)
+        )
+        if closed_at > self.now:
+            status, modified_by, modified_date = 'pending', None, None
+        else:
+            status = 'cancelled' if region != 'local' and rng.random() < CANCEL_RATE else 'completed'
+            modified_by, modified_date = rng.choice(self.staff), closed_at
+        return Bill(
+            code=bill_code(index),
+            customer_name=_pick(rng, self.customers, self.customer_cumulative),
+            date_issued=date_issued,
+            amount=round(median_amount * rng.lognormvariate(0, 0.3), 2),
+            issue_location=_pick(rng, self.locations, self.location_cumulative),
+            issued_by_id=rng.choice(self.staff),
+            vehicle_number=f'{rng.choice(VEHICLE_ZONES)} {rng.randint(1, 9)} KHA {rng.randint(1000, 9999)}',
+            material=_pick(rng, self.materials, self.material_cumulative),
+            destination=_pick(rng, self.destinations, self.destination_cumulative),
+            vehicle_size=size,
+            region=region,
+            eta=eta,
+            status=status,
+            remark='Partial load' if rng.random() < 0.05 else None,
+            modified_by_id=modified_by,
+            modified_date=modified_date,
+        )
+
+    def barcode(self, rng, bill):
+        assigned_at = bill.date_issued - timedelta(hours=rng.uniform(1, 240))
+        return Barcode(
+            code=bill.code,
+            status={'pending': 'active', 'completed': 'used', 'cancelled': 'cancelled'}[bill.status],
+            created_at=assigned_at,
+            updated_at=bill.modified_date or bill.date_issued,
+            assigned_at=assigned_at,
+            assigned_to_id=bill.issued_by_id,
+            assigned_by_id=self.admin,
+            associated_bill=bill,
+        )
+
+    def chunk(self, chunk_index, start, stop):
+        """(bill, barcode) pairs for bills ``start``..``stop``-1 of chunk ``chunk_index``"""
+        rng = random.Random(f'{self.seed}:{chunk_index}')
+        pairs = []
+        for index in range(chunk_index * CHUNK_SIZE, stop):
+            bill = self.bill(rng, index)
+            pairs.append((bill, self.barcode(rng, bill)))
+        # Appending to a chunk: drop the bills generated by the earlier run
+        return pairs[start - chunk_index * CHUNK_SIZE:]
+
+    def spare_barcodes(self, start, stop):
+        rng = random.Random(f'{self.seed}:spare:{start}')
+        barcodes = []
+        for index in range(start, stop):
+            assigned_at = self.now - timedelta(hours=rng.uniform(1, 240))
+            barcodes.append(Barcode(
+                code=spare_code(index), status='issued',
+                created_at=assigned_at, updated_at=assigned_at, assigned_at=assigned_at,
+                assigned_to_id=rng.choice(self.staff), assigned_by_id=self.admin,
+            ))
+        return barcodes
+
+    def pending_pairs(self, start, stop):
+        """(bill, barcode) pairs of bills still in transit at ``now``, with active barcodes"""
+        rng = random.Random(f'{self.seed}:pending:{start}')
+        pairs = []
+        for index in range(start, stop):
+            bill = self.bill(rng, index)
+            bill.code = pending_code(index)
+            bill.date_issued = self.now - timedelta(minutes=rng.uniform(10, 120))
+            bill.eta = self.now + timedelta(hours=rng.uniform(1, 12))
+            bill.status, bill.modified_by_id, bill.modified_date = 'pending', None, None
+            pairs.append((bill, self.barcode(rng, bill)))
+        return pairs
+
+
+@contextmanager
+def explicit_timestamps():
+    """Let bulk_create keep the auto_now/auto_now_add values set by the generator"""
+    fields = [Bill._meta.get_field('date_issued'), Barcode._meta.get_field('created_at'),
+              Barcode._meta.get_field('updated_at')]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _insert_chunk(generator, chunk_index, start, stop, batch_size):
+    return _insert_pairs(generator.chunk(chunk_index, start, stop), batch_size)
+
+
+def _insert_pairs(pairs, batch_size):
+    # One transaction per chunk: its bills share a change stamp, taken last,
+    # which must not be visible before they are
+    with transaction.atomic(), explicit_timestamps(), stamping() as stamps:
+        Bill.objects.bulk_create([bill for bill, _ in pairs], batch_size=batch_size)
+        Barcode.objects.bulk_create([barcode for _, barcode in pairs], batch_size=batch_size)
+        stamps.add([bill for bill, _ in pairs])
+    return len(pairs)
+
+
+def _chunks(start, stop):
+    index = start
+    while index < stop:
+        chunk_index = index // CHUNK_SIZE
+        chunk_stop = min((chunk_index + 1) * CHUNK_SIZE, stop)
+        yield chunk_index, index, chunk_stop
+        index = chunk_stop
+
+
+def next_index():
+    """The index after the highest generated bill, to append to earlier runs"""
+    last = Bill.objects.filter(code__startswith=CODE_PREFIX).order_by('-code').values_list('code', flat=True).first()
+    return int(last[len(CODE_PREFIX):]) + 1 if last else 0
+
+
+def next_spare_index():
+    last = Barcode.objects.filter(code__startswith=SPARE_CODE_PREFIX).order_by('-code').values_list('code', flat=True).first()
+    return int(last[len(SPARE_CODE_PREFIX):]) + 1 if last else 0
+
+
+def next_pending_index():
+    last = Bill.objects.filter(code__startswith=PENDING_CODE_PREFIX).order_by('-code').values_list('code', flat=True).first()
+    return int(last[len(PENDING_CODE_PREFIX):]) + 1 if last else 0
+
+
+def generate(count, start=None, seed=1, days=365, now=None, staff=DEFAULT_STAFF, workers=1,
+             batch_size=1000, progress=None):
+    """
+    Insert bills ``start``..``start + count``-1 (default: after the ones
+    already generated), each with its barcode. ``progress(done, total)`` is
+    called after every chunk. Returns the number of bills inserted.
+    """
+    start = next_index() if start is None else start
+    stop = start + count
+    admin, staff_pks = ensure_people(staff)
+    generator = BillGenerator(seed, now or default_now(), days, admin, staff_pks)
+    chunks = list(_chunks(start, stop))
+    done = 0
+    if workers <= 1 or connection.vendor == 'sqlite' or len(chunks) <= 1:
+        for chunk in chunks:
+            done += _insert_chunk(generator, *chunk, batch_size)
+            if progress:
+                progress(done, count)
+        return done
+
+    # Children open their own connections; they must not inherit ours
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork')) as pool:
+        futures = [pool.submit(_insert_chunk, generator, *chunk, batch_size) for chunk in chunks]
+        for future in futures:
+            done += future.result()
+            if progress:
+                progress(done, count)
+    return done
+
+
+def generate_spare_barcodes(count, seed=1, now=None, staff=DEFAULT_STAFF, batch_size=1000):
+    """Issued barcodes not yet used on a bill"""
+    admin, staff_pks = ensure_people(staff)
+    generator = BillGenerator(seed, now or default_now(), 1, admin, staff_pks)
+    start = next_spare_index()
+    with explicit_timestamps():
+        Barcode.objects.bulk_create(generator.spare_barcodes(start, start + count), batch_size=batch_size)
+    return count
+
+
+def generate_pending(count, seed=1, now=None, staff=DEFAULT_STAFF, batch_size=1000):
+    """
+    Pending bills issued shortly before ``now``, with active barcodes, on top
+    of the ones generate() leaves in transit: a pool of bills to scan
+    """
+    admin, staff_pks = ensure_people(staff)
+    generator = BillGenerator(seed, now or default_now(), 1, admin, staff_pks)
+    start = next_pending_index()
+    return _insert_pairs(generator.pending_pairs(start, start + count), batch_size)
+
+
+def default_now():
+    # Whole hours keep reruns within the same hour identical
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+def refresh_derived_tables():
+    """Rebuild what the bulk inserts skipped: rollups, search index, barcode counters and cached analytics"""
+    rebuild()
+    rebuild_index()
+    counters.reconcile()
+    bump_generation()
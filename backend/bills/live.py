@@ -0,0 +1,291 @@
+"""
+Live feed for the real-time dashboard (Server-Sent Events).
+
+Bill writes publish small events (bill.created / bill.completed /
+bill.cancelled) once their transaction commits. On PostgreSQL they travel
+through NOTIFY, so every worker process hears every write; elsewhere they are
+dispatched in-process only. Each process runs a single notifier task that fans
+events out to all connected dashboards and recomputes ``live_metrics`` at most
+once per change (and every METRICS_REFRESH_SECONDS, since overdue counts move
+with the clock), sending only the values that changed. N open dashboards
+therefore cost one computation per change instead of N polls.
+
+Writes are noticed across processes without NOTIFY too: the notifier watches
+the bill change counter (bills/changes.py) in the database and refreshes the
+metrics when it moves. Bill events themselves only reach the dashboards of
+the writing process there.
+
+EventSource cannot send an Authorization header, and a JWT in the URL ends up
+in access logs. The stream is therefore opened with a ticket from
+analytics/live/ticket/: a signed user id valid for LIVE_TICKET_SECONDS,
+good for nothing but opening the stream. Clients fetch a fresh one whenever
+they reconnect.
+"""
+import asyncio
+import json
+import logging
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import connection, connections, transaction
+from django.db.models import Avg, Count, Q
+from django.utils import timezone
+
+from .changes import current_token
+from .models import Bill
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'bills_live'
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+METRICS_MIN_INTERVAL_SECONDS = 1
+METRICS_REFRESH_SECONDS = 60
+LIVE_TICKET_SECONDS = 30
+LIVE_TICKET_SALT = 'bills.live.ticket'
+
+BILL_EVENT_FIELDS = ('id', 'code', 'amount', 'destination', 'status', 'date_issued', 'modified_date')
+
+
+def compute_live_metrics():
+    """The dashboard's live_metrics widget values"""
+    now = timezone.now()
+    avg_amount = Bill.objects.aggregate(avg=Avg('amount'))['avg'] or 0
+    pending = Bill.objects.filter(status='pending').aggregate(
+        active_shipments=Count('id'),
+        overdue_count=Count('id', filter=Q(eta__lt=now)),
+        # 50% above average
+        high_value_pending=Count('id', filter=Q(amount__gte=avg_amount * 1.5)),
+    )
+    recent_completions = Bill.objects.filter(
+        status='completed',
+        modified_date__gte=now - timedelta(hours=24),
+    ).count()
+    return {
+        'active_shipments': pending['active_shipments'],
+        'recent_completions': recent_completions,
+        'overdue_count': pending['overdue_count'],
+        'high_value_pending': pending['high_value_pending'],
+    }
+
+
+def issue_ticket(user):
+    """A short-lived ticket that opens the live stream as ``user``"""
+    return signing.TimestampSigner(salt=LIVE_TICKET_SALT).sign(str(user.pk))
+
+
+async def ticket_user(ticket):
+    """The active user a ticket was issued to, or None if it is invalid or expired"""
+    try:
+        user_pk = signing.TimestampSigner(salt=LIVE_TICKET_SALT).unsign(ticket, max_age=LIVE_TICKET_SECONDS)
+    except signing.BadSignature:
+        return None
+    return await get_user_model().objects.filter(pk=user_pk, is_active=True).afirst()
+
+
+def bill_event(kind, bill):
+    data = {field: getattr(bill, field) for field in BILL_EVENT_FIELDS}
+    return {'type': f'bill.{kind}', 'bill': json.loads(json.dumps(data, default=str))}
+
+
+def publish_bill_event(kind, bill):
+    """Announce a bill write to live dashboards once the transaction commits"""
+    event = bill_event(kind, bill)
+    if connection.vendor == 'postgresql':
+        # NOTIFY is only delivered if (and when) the transaction commits
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, json.dumps(event)])
+    else:
+        transaction.on_commit(lambda: broker.dispatch(event))
+
+
+class Subscriber:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, event):
+        """Runs on the subscriber's loop"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and make it reload the full state
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync'})
+
+
+class LiveFeedBroker:
+    """Per-process fan-out of live events to the connected SSE streams"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._notifiers = {}
+        self._metrics = None
+
+    def subscribe(self):
+        loop = asyncio.get_running_loop()
+        subscriber = Subscriber(loop)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if loop not in self._notifiers:
+                self._notifiers[loop] = Notifier(self, loop)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not any(other.loop is subscriber.loop for other in self._subscribers):
+                notifier = self._notifiers.pop(subscriber.loop, None)
+                if notifier:
+                    notifier.stop()
+
+    def dispatch(self, event):
+        """Hand ``event`` to every subscriber; safe to call from any thread"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            notifiers = list(self._notifiers.values())
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.push, event)
+        if event.get('type', '').startswith('bill.'):
+            for notifier in notifiers:
+                notifier.loop.call_soon_threadsafe(notifier.changed.set)
+
+    def current_metrics(self):
+        return self._metrics
+
+    def update_metrics(self, metrics):
+        """Store freshly computed metrics and return the values that changed"""
+        previous = self._metrics or {}
+        self._metrics = metrics
+        return {key: value for key, value in metrics.items() if previous.get(key) != value}
+
+
+class Notifier:
+    """
+    The single change notifier of one event loop: listens for NOTIFY (on
+    PostgreSQL), watches the bill change counter for writes made by other
+    processes, and recomputes live_metrics once per change.
+    """
+
+    def __init__(self, broker, loop):
+        self.broker = broker
+        self.loop = loop
+        self.changed = asyncio.Event()
+        self._listen_connection = None
+        self._task = loop.create_task(self._run())
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._task.cancel)
+
+    def _listen(self):
+        db = connections['default']
+        if db.vendor != 'postgresql':
+            return
+        self._listen_connection = db.get_new_connection(db.get_connection_params())
+        self._listen_connection.autocommit = True
+        with self._listen_connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+
+    def _on_notify(self):
+        self._listen_connection.poll()
+        while self._listen_connection.notifies:
+            notify = self._listen_connection.notifies.pop(0)
+            try:
+                self.broker.dispatch(json.loads(notify.payload))
+            except ValueError:
+                logger.warning('Ignoring malformed live event: %s', notify.payload)
+
+    def _unlisten(self):
+        if self._listen_connection is not None:
+            self.loop.remove_reader(self._listen_connection.fileno())
+            self._listen_connection.close()
+            self._listen_connection = None
+
+    async def _run(self):
+        try:
+            await sync_to_async(self._listen)()
+            if self._listen_connection is not None:
+                self.loop.add_reader(self._listen_connection.fileno(), self._on_notify)
+            last_token, last_refresh = None, None
+            while True:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=METRICS_MIN_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                woken = self.changed.is_set()
+                self.changed.clear()
+
+                # A bill event, a write seen through the change counter, or
+                # simply time passing all call for fresh metrics
+                token = await sync_to_async(current_token)()
+                now = self.loop.time()
+                expired = last_refresh is None or now - last_refresh >= METRICS_REFRESH_SECONDS
+                if not woken and token == last_token and not expired:
+                    continue
+                last_token, last_refresh = token, now
+
+                metrics = await sync_to_async(compute_live_metrics)()
+                delta = self.broker.update_metrics(metrics)
+                if delta:
+                    self.broker.dispatch({
+                        'type': 'metrics',
+                        'live_metrics': delta,
+                        'last_updated': timezone.now().isoformat(),
+                    })
+                # Coalesce bursts of writes into one computation per interval
+                await asyncio.sleep(METRICS_MIN_INTERVAL_SECONDS)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception('Live feed notifier stopped')
+        finally:
+            self._unlisten()
+
+
+broker = LiveFeedBroker()
+
+
+def format_event(event, event_id=None):
+    """One Server-Sent Events frame"""
+    lines = [f"event: {event['type']}"]
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(event, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+async def event_stream():
+    """Snapshot first, then live events, with a heartbeat comment to keep proxies from timing out"""
+    subscriber = broker.subscribe()
+    try:
+        async def snapshot():
+            metrics = broker.current_metrics()
+            if metrics is None:
+                metrics = await sync_to_async(compute_live_metrics)()
+                broker.update_metrics(metrics)
+            return {
+                'type': 'snapshot',
+                'live_metrics': metrics,
+                'last_updated': timezone.now().isoformat(),
+            }
+
+        event_id = 0
+        yield 'retry: 5000\n\n'
+        yield format_event(await snapshot(), event_id)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+            if event['type'] == 'resync':
+                event = await snapshot()
+            event_id += 1
+            yield format_event(event, event_id)
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from bills.archive import DEFAULT_CHUNK_SIZE, archive_after_days, archive_bills
+
+
+class Command(BaseCommand):
+    help = 'Move old completed and cancelled bills from the Bill table to the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=None,
+            help=f'Archive bills issued at least N days ago (default: BILL_ARCHIVE_AFTER_DAYS, {archive_after_days()})'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Bills moved per transaction (default: {DEFAULT_CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        moved = archive_bills(
+            older_than_days=options['older_than_days'],
+            chunk_size=options['chunk_size'],
+            progress=lambda moved: self.stdout.write(f'{moved} bills archived...'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} bills'))
@@ -0,0 +1,209 @@
+import json
+import math
+import platform
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from bills.datagen import (
+    PENDING_CODE_PREFIX, default_now, ensure_people, generate, generate_pending, generate_spare_barcodes,
+    refresh_derived_tables,
+)
+from codes.models import Barcode
+from userauth.models import User
+
+DEFAULT_SIZES = '10000,100000,1000000'
+# Issued barcodes besides the bills' own, per bill
+SPARE_BARCODE_RATIO = 0.1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database with bills at several sizes and report latency '
+        'percentiles, query counts and peak memory of the main endpoints as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                            help=f'Comma separated bill counts to benchmark at (default: {DEFAULT_SIZES})')
+        parser.add_argument('--runs', type=int, default=20, help='Timed requests per endpoint and size')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated data')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes generating the data in parallel (PostgreSQL only)')
+        parser.add_argument('--endpoint', action='append', help='Endpoint to time (repeatable, default: all)')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',') if size.strip()})
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of integers')
+        if not sizes or sizes[0] <= 0:
+            raise CommandError('--sizes must be positive')
+        endpoints = self.endpoints()
+        for name in options['endpoint'] or ():
+            if name not in endpoints:
+                raise CommandError(f"Unknown endpoint {name}; choose from {', '.join(endpoints)}")
+        selected = options['endpoint'] or list(endpoints)
+
+        report = {
+            'meta': {
+                'seed': options['seed'],
+                'runs': options['runs'],
+                'vendor': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+            },
+            'sizes': {},
+        }
+        with tempfile.TemporaryDirectory() as directory, self.throwaway_database(directory):
+            self.now = default_now()
+            self.authenticate()
+            seeded = 0
+            for size in sizes:
+                started = time.perf_counter()
+                # Every scan closes a bill: the warm-up, the timed runs and the traced one
+                pending = options['runs'] + 2 if 'scan' in selected else 0
+                self.seed_bills(seeded, size, options['seed'], options['workers'], pending)
+                seeded = size
+                seed_seconds = time.perf_counter() - started
+                self.stderr.write(f'Seeded {size} bills in {seed_seconds:.1f}s')
+                report['sizes'][str(size)] = {
+                    'seed_seconds': round(seed_seconds, 1),
+                    'endpoints': {
+                        name: self.measure(name, endpoints[name], options['runs'])
+                        for name in selected
+                    },
+                }
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    @contextmanager
+    def throwaway_database(self, directory):
+        """
+        A fresh test database (a temporary file on SQLite), process-local caches
+        and no read replicas, so nothing outside this run is read or touched
+        """
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+            test_settings['NAME'] = f'{directory}/bench.sqlite3'
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with override_settings(
+            CACHES={alias: locmem for alias in caches.settings},
+            DATABASE_REPLICAS=[],
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+            try:
+                yield
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+    def authenticate(self):
+        admin, _ = ensure_people()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(User.objects.get(pk=admin)).access_token}'
+        )
+
+    def seed_bills(self, start, stop, seed, workers, pending):
+        """
+        Add bills start..stop-1, each with its barcode, and ``pending`` more
+        bills in transit to scan, then rebuild the derived tables
+        """
+        generate(stop - start, start=start, seed=seed, now=self.now, workers=workers)
+        generate_spare_barcodes(int((stop - start) * SPARE_BARCODE_RATIO), seed=seed, now=self.now)
+        generate_pending(pending, seed=seed, now=self.now)
+        refresh_derived_tables()
+
+    def endpoints(self):
+        """name -> zero-argument callable making one request"""
+        day = (timezone.localdate() - timedelta(days=2)).isoformat()
+
+        def scan():
+            # From the pool seeded for this size (seed_bills)
+            code = Barcode.objects.filter(
+                status='active', code__startswith=PENDING_CODE_PREFIX,
+            ).values_list('code', flat=True).order_by('code').first()
+            if code is None:
+                raise CommandError('The pool of pending bills to scan is used up')
+            return self.client.post(reverse('scan'), {'code': code}, format='json')
+
+        return {
+            'bills_filtered': lambda: self.client.get(reverse('bills'), {
+                'date_issued_from': day, 'date_issued_to': day, 'material': 'gravel',
+            }),
+            'bills_search': lambda: self.client.get(reverse('bills'), {
+                'search': 'Himalayan', 'date_issued_from': day, 'date_issued_to': day,
+            }),
+            'active_bills': lambda: self.client.get(reverse('active_bills')),
+            'completed_bills': lambda: self.client.get(reverse('completed_bills')),
+            'completed_bills_cursor': lambda: self.client.get(reverse('completed_bills'), {'pagination': 'cursor'}),
+            'cancelled_bills': lambda: self.client.get(reverse('cancelled_bills')),
+            'scan': scan,
+            'analytics_overview': lambda: self.client.get(reverse('analytics_overview'), {'days': 30}),
+            'analytics_barcodes': lambda: self.client.get(reverse('analytics_barcodes')),
+            'analytics_performance': lambda: self.client.get(reverse('analytics_performance')),
+            'analytics_dashboard': lambda: self.client.get(reverse('analytics_dashboard')),
+        }
+
+    def measure(self, name, request, runs):
+        """Median/percentile latency over ``runs`` requests, then one traced request for queries and memory"""
+        def call():
+            # Time the real work, not the analytics response cache
+            for cache in caches.all():
+                cache.clear()
+            started = time.perf_counter()
+            response = request()
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 400:
+                raise CommandError(f'{name} returned {response.status_code}: {response.content[:200]}')
+            return elapsed
+
+        call()  # warm up
+        latencies = sorted(call() for _ in range(runs))
+
+        for cache in caches.all():
+            cache.clear()
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.stderr.write(f'  {name:<24} p50 {percentile(latencies, 0.5):>9.1f} ms')
+        return {
+            'p50_ms': round(percentile(latencies, 0.5), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+            'max_ms': round(latencies[-1], 1),
+            'queries': len(queries),
+            'peak_memory_kb': round(peak / 1024),
+            'response_bytes': len(response.content),
+        }
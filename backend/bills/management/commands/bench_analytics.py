@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from bills import analytics_views
+from bills.cache import bump_generation
+
+ENDPOINTS = {
+    'overview': analytics_views.analytics_overview,
+    'barcodes': analytics_views.analytics_barcodes,
+    'performance': analytics_views.analytics_performance,
+    'dashboard': analytics_views.analytics_dashboard,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the analytics endpoints with their queries run one after another '
+        'and concurrently (the response cache is bypassed)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Timed requests per endpoint and mode')
+        parser.add_argument('--days', type=int, default=30, help='The ?days= window to request')
+        parser.add_argument('--workers', type=int, default=8, help='Query threads for the concurrent mode')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), action='append',
+                            help='Endpoint to time (repeatable, default: all)')
+        parser.add_argument('--email', help='User to authenticate as (default: the first active user)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(is_active=True)
+        if options['email']:
+            users = users.filter(email=options['email'])
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('No active user to authenticate as')
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite always runs the analytics queries one after another; '
+                'run this against PostgreSQL to compare the two modes'
+            ))
+        token = str(RefreshToken.for_user(user).access_token)
+        factory = RequestFactory()
+
+        def timed_request(name, view):
+            request = factory.get(
+                f'/bills/analytics/{name}/',
+                {'days': options['days']},
+                HTTP_AUTHORIZATION=f'Bearer {token}',
+            )
+            # A fresh generation makes every request a cache miss
+            bump_generation()
+            started = time.perf_counter()
+            response = async_to_sync(view)(request)
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise CommandError(f'{name} returned {response.status_code}: {response.content[:200]}')
+            return elapsed
+
+        self.stdout.write(f"{'endpoint':<12} {'sequential ms':>14} {'concurrent ms':>14} {'speedup':>8}")
+        for name in options['endpoint'] or ENDPOINTS:
+            view = ENDPOINTS[name]
+            medians = []
+            for workers in (1, options['workers']):
+                with override_settings(ANALYTICS_QUERY_WORKERS=workers):
+                    timed_request(name, view)  # warm up connections and the thread pool
+                    medians.append(statistics.median(
+                        timed_request(name, view) for _ in range(options['runs'])
+                    ))
+            sequential, concurrent = medians
+            self.stdout.write(
+                f'{name:<12} {sequential:>14.1f} {concurrent:>14.1f} {sequential / concurrent:>7.2f}x'
+            )
@@ -0,0 +1,60 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from bills.models import Bill
+from bills.serializers import BillRowSerializer, BillSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the per-row cost of BillSerializer and the BillRowSerializer '
+        'fast path used by the bill lists, and check that their output is identical'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Bills to serialize (default: 5000)')
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per serializer (default: 5)')
+
+    def handle(self, *args, **options):
+        queryset = Bill.objects.select_related(
+            'issued_by__user', 'modified_by__user',
+        ).order_by('-date_issued')[:options['rows']]
+        bills = list(queryset)
+        if not bills:
+            raise CommandError('No bills to serialize; seed some with inject_dummy_data')
+        rows = list(BillRowSerializer.rows(queryset))
+
+        renderer = JSONRenderer()
+        if renderer.render(BillSerializer(bills, many=True).data) != renderer.render(BillRowSerializer.serialize(rows)):
+            raise CommandError('BillRowSerializer output differs from BillSerializer')
+
+        def per_row_us(serialize, fetch=None):
+            timings = []
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                serialize(fetch() if fetch else None)
+                timings.append((time.perf_counter() - started) * 1e6 / len(bills))
+            return statistics.median(timings)
+
+        results = {
+            'BillSerializer': (
+                per_row_us(lambda _: BillSerializer(bills, many=True).data),
+                per_row_us(lambda fetched: BillSerializer(fetched, many=True).data, lambda: list(queryset.all())),
+            ),
+            'BillRowSerializer': (
+                per_row_us(lambda _: BillRowSerializer.serialize(rows)),
+                per_row_us(BillRowSerializer.serialize, lambda: list(BillRowSerializer.rows(queryset))),
+            ),
+        }
+
+        self.stdout.write(f'{len(bills)} bills, median of {options["runs"]} runs')
+        self.stdout.write(f"{'serializer':<18} {'serialize us/row':>17} {'fetch+serialize us/row':>23}")
+        for name, (serialize_only, with_fetch) in results.items():
+            self.stdout.write(f'{name:<18} {serialize_only:>17.1f} {with_fetch:>23.1f}')
+        slow, fast = results['BillSerializer'], results['BillRowSerializer']
+        self.stdout.write(self.style.SUCCESS(
+            f'Fast path: {slow[0] / fast[0]:.1f}x faster to serialize, {slow[1] / fast[1]:.1f}x with the query'
+        ))
@@ -0,0 +1,75 @@
+import io
+import statistics
+import time
+from itertools import cycle, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from backend.renderers import FastJSONParser, FastJSONRenderer, orjson
+from bills.models import Bill
+from bills.serializers import BillRowSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DRF's JSONRenderer/JSONParser with the orjson-backed FastJSONRenderer/"
+        'FastJSONParser on a bill list response, and check that their results are identical'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bills', type=int, default=50000,
+                            help='Bills in the response; stored bills are repeated as needed (default: 50000)')
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per renderer and parser (default: 5)')
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            raise CommandError('orjson is not installed; FastJSONRenderer falls back to JSONRenderer')
+        queryset = Bill.objects.select_related(
+            'issued_by__user', 'modified_by__user',
+        ).order_by('-date_issued')[:options['bills']]
+        stored = BillRowSerializer.serialize(BillRowSerializer.rows(queryset))
+        if not stored:
+            raise CommandError('No bills to render; seed some with inject_dummy_data')
+        results = [
+            {**row, 'id': number}
+            for number, row in enumerate(islice(cycle(stored), options['bills']), start=1)
+        ]
+        data = {'results': results, 'count': len(results)}
+
+        body = JSONRenderer().render(data)
+        if FastJSONRenderer().render(data) != body:
+            raise CommandError('FastJSONRenderer output differs from JSONRenderer')
+        if FastJSONParser().parse(io.BytesIO(body)) != JSONParser().parse(io.BytesIO(body)):
+            raise CommandError('FastJSONParser result differs from JSONParser')
+
+        def median_ms(call):
+            timings = []
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                call()
+                timings.append((time.perf_counter() - started) * 1000)
+            return statistics.median(timings)
+
+        timings = {
+            'render': (
+                median_ms(lambda: JSONRenderer().render(data)),
+                median_ms(lambda: FastJSONRenderer().render(data)),
+            ),
+            'parse': (
+                median_ms(lambda: JSONParser().parse(io.BytesIO(body))),
+                median_ms(lambda: FastJSONParser().parse(io.BytesIO(body))),
+            ),
+        }
+
+        self.stdout.write(
+            f"{data['count']} bills ({len(body) / 1024 / 1024:.1f} MB), median of {options['runs']} runs"
+        )
+        self.stdout.write(f"{'':<7} {'stdlib ms':>10} {'orjson ms':>10}")
+        for name, (stdlib, fast) in timings.items():
+            self.stdout.write(f'{name:<7} {stdlib:>10.1f} {fast:>10.1f}')
+        self.stdout.write(self.style.SUCCESS(
+            f"orjson: {timings['render'][0] / timings['render'][1]:.1f}x faster to render, "
+            f"{timings['parse'][0] / timings['parse'][1]:.1f}x to parse"
+        ))
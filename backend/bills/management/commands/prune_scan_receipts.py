@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from bills.scanning import prune_receipts, receipt_retention_days
+
+
+class Command(BaseCommand):
+    help = 'Delete offline scan receipts (idempotency keys) older than SCAN_RECEIPT_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=None,
+            help=f'Delete receipts received at least N days ago (default: SCAN_RECEIPT_RETENTION_DAYS, {receipt_retention_days()})'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_receipts(older_than_days=options['older_than_days'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} scan receipts'))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bills.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily analytics rollup tables from the bills (archived ones included)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Only rebuild the last N local days (default: rebuild everything)'
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days'] is not None:
+            since = timezone.localdate() - timedelta(days=options['days'])
+        written = rebuild(since=since)
+        scope = f'since {since}' if since else 'from scratch'
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} rollup rows {scope}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from bills.search import INDEX_BATCH_SIZE, install_search_index, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the bill search documents and their full-text index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=INDEX_BATCH_SIZE,
+            help=f'Bills indexed per batch (default: {INDEX_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        install_search_index()
+        total = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} bills'))
@@ -1,14 +1,17 @@
-from django.db import models
+from django.db import models, transaction
 
 # Create your models here.
 
-class Bill(models.Model):
+class BillColumns(models.Model):
+    """
+    The columns of a bill other than its id and people, shared by the hot Bill
+    table, its archive and the view over both (see bills/archive.py)
+    """
     code = models.CharField(max_length=20)
     customer_name = models.CharField(max_length=100)
     date_issued = models.DateTimeField(auto_now_add=True)
     amount = models.FloatField()
     issue_location = models.CharField(max_length=100)
-    issued_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name='bills_issued')
     vehicle_number = models.CharField(max_length=20)
     material = models.CharField(max_length=100, choices=[
         ('roda', 'Roda'),
@@ -43,10 +46,19 @@ class Bill(models.Model):
         ('cancelled', 'Cancelled'),
     ], default='pending')
     remark = models.TextField(blank=True, null=True)
-    modified_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name='bills_modified', null=True, blank=True)
     modified_date = models.DateTimeField(null=True, blank=True)
+    # Bumped by every write, in commit order; see bills/changes.py
+    change_stamp = models.BigIntegerField(default=0, editable=False)
     # paid = models.BooleanField(default=False)
 
+    class Meta:
+        abstract = True
+
+
+class Bill(BillColumns):
+    issued_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name='bills_issued')
+    modified_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name='bills_modified', null=True, blank=True)
+
     class Meta:
         # Add database indexes for performance optimization
         indexes = [
@@ -54,11 +66,194 @@ class Bill(models.Model):
             models.Index(fields=['date_issued']),
             models.Index(fields=['modified_date']),
             models.Index(fields=['status', 'date_issued']),
+            # Serves keyset pagination of the completed/cancelled lists
+            models.Index(fields=['status', 'modified_date', 'id']),
             models.Index(fields=['code']),
             models.Index(fields=['vehicle_number']),
+            # Serves delta sync (bills/changes/)
+            models.Index(fields=['change_stamp']),
         ]
         # Order by latest first by default
         ordering = ['-date_issued']
 
     def __str__(self):
         return f"Bill {self.code} - {self.vehicle_number}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so the write hooks can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .changes import stamping
+
+        # Run the save and its post_save hooks (rollups, search index) in one
+        # transaction, stamped last (see changes.py)
+        with transaction.atomic(using=kwargs.get('using')), stamping(kwargs.get('using')) as stamps:
+            super().save(*args, **kwargs)
+            stamps.add([self])
+
+    def delete(self, using=None, keep_parents=False):
+        from .changes import stamping
+
+        # The tombstone left by the post_delete hook is stamped last too
+        with transaction.atomic(using=using), stamping(using):
+            return super().delete(using=using, keep_parents=keep_parents)
+
+
+class ArchivedBill(BillColumns):
+    """
+    A completed or cancelled bill moved out of Bill by `manage.py archive_bills`,
+    under its original id. The table is created by bills/archive.py: range
+    partitioned by date_issued month on PostgreSQL.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    issued_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE,
+                                  related_name='archived_bills_issued', db_constraint=False)
+    modified_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name='archived_bills_modified',
+                                    null=True, blank=True, db_constraint=False)
+
+    class Meta:
+        managed = False
+        indexes = [
+            models.Index(fields=['date_issued']),
+            models.Index(fields=['status', 'date_issued']),
+        ]
+
+    def __str__(self):
+        return f"Archived bill {self.code} - {self.vehicle_number}"
+
+
+class BillHistory(BillColumns):
+    """
+    Read-only view of Bill and ArchivedBill together, for the reads whose date
+    range reaches the archive (see bills/archive.py)
+    """
+    id = models.BigIntegerField(primary_key=True)
+    issued_by = models.ForeignKey('enterprise.Person', on_delete=models.DO_NOTHING, related_name='+',
+                                  db_constraint=False)
+    modified_by = models.ForeignKey('enterprise.Person', on_delete=models.DO_NOTHING, related_name='+',
+                                    null=True, blank=True, db_constraint=False)
+
+    class Meta:
+        managed = False
+        ordering = ['-date_issued']
+
+    def __str__(self):
+        return f"Bill {self.code} - {self.vehicle_number}"
+
+
+class BillSearchDocument(models.Model):
+    """
+    Denormalized search text for a Bill, kept in sync on save.
+
+    The text itself lives here; the vendor specific index over it (FTS5 on
+    SQLite, tsvector + pg_trgm on PostgreSQL) is created by bills/search.py.
+    """
+    bill = models.OneToOneField(Bill, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    document = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"Search document for bill {self.bill_id}"
+
+
+class DailyBillRollup(models.Model):
+    """
+    Bill counts and revenue per local issue date and dimension combination.
+
+    Maintained incrementally by bills/rollups.py whenever a bill is created,
+    changes status (or any other key column) or is deleted; rebuild with
+    `manage.py rebuild_rollups`.
+    """
+    date = models.DateField()
+    status = models.CharField(max_length=20)
+    material = models.CharField(max_length=100)
+    region = models.CharField(max_length=50)
+    vehicle_size = models.CharField(max_length=20)
+    issue_location = models.CharField(max_length=100)
+    bills_count = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'status', 'material', 'region', 'vehicle_size', 'issue_location'],
+                name='unique_daily_bill_rollup',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.status}: {self.bills_count} bills"
+
+
+class DailyDestinationRollup(models.Model):
+    """Bill counts and revenue per local issue date, status and destination"""
+    date = models.DateField()
+    status = models.CharField(max_length=20)
+    destination = models.CharField(max_length=100)
+    bills_count = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'status', 'destination'],
+                name='unique_daily_destination_rollup',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.status} {self.destination}: {self.bills_count} bills"
+
+
+class ScanReceipt(models.Model):
+    """
+    Outcome of a scan submitted with a client idempotency key, so a replayed
+    scan (e.g. an offline queue flushed twice) returns the original result
+    instead of being processed again. Keys are only unique per scanning
+    person, and receipts older than SCAN_RECEIPT_RETENTION_DAYS are pruned
+    (`manage.py prune_scan_receipts`).
+    """
+    idempotency_key = models.CharField(max_length=100)
+    code = models.CharField(max_length=20)
+    scanned_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    scanned_by = models.ForeignKey('enterprise.Person', on_delete=models.SET_NULL, related_name='scan_receipts', null=True, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    result = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scanned_by', 'idempotency_key'], name='unique_scan_receipt_key'),
+        ]
+        indexes = [
+            models.Index(fields=['received_at']),
+        ]
+
+    def __str__(self):
+        return f"Scan {self.idempotency_key} of {self.code}: {self.status_code}"
+
+
+class BillChangeCounter(models.Model):
+    """The last Bill.change_stamp handed out: a single row, see bills/changes.py"""
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Bill change stamp {self.value}"
+
+
+class BillTombstone(models.Model):
+    """A deleted bill, so clients syncing through bills/changes/ drop it too"""
+    bill_id = models.BigIntegerField(primary_key=True)
+    change_stamp = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"Deleted bill {self.bill_id} at change {self.change_stamp}"
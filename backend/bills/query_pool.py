@@ -0,0 +1,91 @@
+"""
+Running independent read queries concurrently.
+
+Django's async ORM methods all funnel into one thread per request, so they do
+not overlap. Instead every query is handed to a bounded thread pool. Worker threads use
+their own database connections, which they release after every query the
+way a request does (with CONN_MAX_AGE = 0 they close it, or hand it back
+to the DB_POOL pool), so idle threads hold none. While busy they hold at
+most ANALYTICS_QUERY_WORKERS extra connections per process.
+
+Inside a transaction the other connections would not see uncommitted rows
+(tests run inside one), so there the queries run one after another on the
+caller's connection instead. The same goes for SQLite: its queries run in
+process and hold the GIL for most of their time, so threads only add
+overhead there.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ANALYTICS_QUERY_WORKERS', 8),
+            thread_name_prefix='analytics-query',
+        )
+    return _executor
+
+
+def _run_isolated(query):
+    # Each query is treated like a request of its own (Django closes
+    # connections at request start and end the same way): broken or expired
+    # connections are dropped before it, and afterwards the connection goes
+    # back to the pool or is closed unless CONN_MAX_AGE keeps it.
+    close_old_connections()
+    try:
+        return query()
+    finally:
+        close_old_connections()
+
+
+def _in_caller_context(query):
+    """Run ``query`` in a copy of the caller's context (e.g. its database routing)"""
+    return functools.partial(contextvars.copy_context().run, _run_isolated, query)
+
+
+def _must_run_inline():
+    return (
+        getattr(settings, 'ANALYTICS_QUERY_WORKERS', 8) <= 1
+        or connection.vendor == 'sqlite'
+        or connection.in_atomic_block
+    )
+
+
+def _run_inline(queries):
+    return {name: query() for name, query in queries.items()}
+
+
+def run_queries(queries):
+    """
+    Evaluate a dict of zero-argument callables concurrently and return their
+    results under the same names. Each callable must fully evaluate its query
+    (e.g. ``lambda: list(queryset)``).
+    """
+    if _must_run_inline():
+        return _run_inline(queries)
+    executor = get_executor()
+    futures = {name: executor.submit(_in_caller_context(query)) for name, query in queries.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+async def gather_queries(queries):
+    """Async counterpart of run_queries: awaits all queries with asyncio.gather"""
+    if await sync_to_async(_must_run_inline)():
+        return await sync_to_async(_run_inline)(queries)
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, _in_caller_context(query))
+        for query in queries.values()
+    ))
+    return dict(zip(queries, results))
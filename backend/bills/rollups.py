@@ -0,0 +1,184 @@
+"""
+Incrementally maintained daily rollups of bills for the analytics endpoints.
+
+A bill contributes one unit of count and its amount of revenue to exactly one
+DailyBillRollup row (and one DailyDestinationRollup row), chosen by its local
+issue date and key columns. Writes move that contribution between rows, so
+analytics reads scale with the number of days rather than the number of bills.
+
+Deltas are applied like the barcode counters (codes/counters.py): one
+INSERT ... ON CONFLICT DO UPDATE per table and write, so a scan or a bulk
+close costs the same two statements whether or not the rows exist yet.
+"""
+from django.db import connections, router, transaction
+from django.db.models import DEFERRED, Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Bill, BillHistory, DailyBillRollup, DailyDestinationRollup
+
+ROLLUP_KEY_FIELDS = ('status', 'material', 'region', 'vehicle_size', 'issue_location')
+
+# Bill columns whose change moves a bill to a different rollup row
+TRACKED_FIELDS = ('date_issued', 'amount', 'destination') + ROLLUP_KEY_FIELDS
+
+REBUILD_BATCH_SIZE = 1000
+
+# Rollup rows per upsert statement (8 parameters each; SQLite allows 999)
+UPSERT_BATCH_SIZE = 100
+
+
+def bill_state(values):
+    """
+    The rollup contribution of a bill, from a model instance or a dict of
+    column values. Returns None for bills without an issue date.
+    """
+    if not isinstance(values, dict):
+        values = {field: getattr(values, field) for field in TRACKED_FIELDS}
+    if values.get('date_issued') is None:
+        return None
+    return (
+        timezone.localtime(values['date_issued']).date(),
+        tuple(values[field] for field in ROLLUP_KEY_FIELDS),
+        values['destination'],
+        values['amount'] or 0,
+    )
+
+
+def loaded_state(bill):
+    """The rollup state of ``bill`` as it was last read from / written to the database"""
+    loaded = getattr(bill, '_loaded_values', None) or {}
+    if all(field in loaded for field in TRACKED_FIELDS) and not any(
+        loaded[field] is DEFERRED for field in TRACKED_FIELDS
+    ):
+        return bill_state(loaded)
+    row = Bill.objects.filter(pk=bill.pk).values(*TRACKED_FIELDS).first()
+    return bill_state(row) if row else None
+
+
+def remember_state(bill):
+    """Record the current column values as the loaded state after a write"""
+    loaded = getattr(bill, '_loaded_values', None) or {}
+    loaded.update({field: getattr(bill, field) for field in TRACKED_FIELDS})
+    bill._loaded_values = loaded
+
+
+def _upsert(model, key_fields, deltas, using):
+    """
+    Add each (count, revenue) delta of {key: delta} to its rollup row, creating
+    missing rows, in one statement per UPSERT_BATCH_SIZE rows
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field) for field in key_fields)
+    # Sorted, so concurrent writers lock the rows in the same order
+    keys = sorted(key for key, (count, revenue) in deltas.items() if count or revenue)
+    placeholders = '(' + ', '.join(['%s'] * (len(key_fields) + 2)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+            batch = keys[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}, bills_count, revenue) '
+                f'VALUES {", ".join([placeholders] * len(batch))} '
+                f'ON CONFLICT ({columns}) DO UPDATE SET '
+                f'bills_count = {table}.bills_count + excluded.bills_count, '
+                f'revenue = {table}.revenue + excluded.revenue',
+                [value for key in batch for value in (*key, *deltas[key])],
+            )
+
+
+def apply(state, sign):
+    """Add (sign=1) or remove (sign=-1) one bill's contribution"""
+    if sign > 0:
+        record_changes([(None, state)])
+    else:
+        record_changes([(state, None)])
+
+
+def record_change(previous, current):
+    """Move a bill's contribution from its previous state to its current one"""
+    record_changes([(previous, current)])
+
+
+def record_changes(changes, using=None):
+    """
+    Apply many (previous, current) state pairs at once: one upsert per rollup
+    table (per UPSERT_BATCH_SIZE rows), whatever the number of bills or
+    whether the rows exist yet.
+    """
+    bill_deltas, destination_deltas = {}, {}
+
+    def add(state, sign):
+        if state is None:
+            return
+        date, key_values, destination, amount = state
+        for deltas, key in (
+            (bill_deltas, (date, *key_values)),
+            (destination_deltas, (date, key_values[0], destination)),
+        ):
+            count, revenue = deltas.get(key, (0, 0))
+            deltas[key] = (count + sign, revenue + sign * amount)
+
+    for previous, current in changes:
+        if previous != current:
+            add(previous, -1)
+            add(current, 1)
+
+    using = using or router.db_for_write(DailyBillRollup)
+    _upsert(DailyBillRollup, ('date',) + ROLLUP_KEY_FIELDS, bill_deltas, using)
+    _upsert(DailyDestinationRollup, ('date', 'status', 'destination'), destination_deltas, using)
+
+
+def rebuild(since=None, batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recompute the rollups from the bills, archived ones included, either
+    entirely or for local dates on/after ``since``. Returns the number of
+    rollup rows written.
+    """
+    current_tz = timezone.get_current_timezone()
+    bills = BillHistory.objects.order_by().annotate(
+        local_date=TruncDate('date_issued', tzinfo=current_tz),
+    )
+    bill_rollups = DailyBillRollup.objects.all()
+    destination_rollups = DailyDestinationRollup.objects.all()
+    if since is not None:
+        bills = bills.filter(local_date__gte=since)
+        bill_rollups = bill_rollups.filter(date__gte=since)
+        destination_rollups = destination_rollups.filter(date__gte=since)
+
+    written = 0
+    with transaction.atomic():
+        bill_rollups.delete()
+        destination_rollups.delete()
+
+        rows = bills.values('local_date', *ROLLUP_KEY_FIELDS).annotate(
+            bills_count=Count('id'), revenue=Sum('amount'),
+        )
+        objects = [
+            DailyBillRollup(
+                date=row['local_date'],
+                bills_count=row['bills_count'],
+                revenue=row['revenue'] or 0,
+                **{field: row[field] for field in ROLLUP_KEY_FIELDS},
+            )
+            for row in rows.iterator()
+        ]
+        DailyBillRollup.objects.bulk_create(objects, batch_size=batch_size)
+        written += len(objects)
+
+        rows = bills.values('local_date', 'status', 'destination').annotate(
+            bills_count=Count('id'), revenue=Sum('amount'),
+        )
+        objects = [
+            DailyDestinationRollup(
+                date=row['local_date'],
+                status=row['status'],
+                destination=row['destination'],
+                bills_count=row['bills_count'],
+                revenue=row['revenue'] or 0,
+            )
+            for row in rows.iterator()
+        ]
+        DailyDestinationRollup.objects.bulk_create(objects, batch_size=batch_size)
+        written += len(objects)
+    return written
@@ -0,0 +1,201 @@
+"""
+Scan processing shared by the live scan endpoint and the offline sync endpoint.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+
+from backend import metrics
+from codes.models import Barcode
+
+from . import changes, rollups
+from .models import Bill, ScanReceipt
+from .transitions import TransitionError, close_bill
+
+# Largest number of buffered scans accepted in one sync request
+MAX_SYNC_BATCH = 500
+
+# Scan receipts deleted per statement when pruning
+PRUNE_BATCH_SIZE = 1000
+
+# Device clocks may run slightly ahead of the server
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+SCAN_LATENCY_METRIC = 'scan'
+metrics.describe(SCAN_LATENCY_METRIC, 'Barcode scan latency by outcome', labels=('outcome',))
+
+# Scan outcome labels used for the latency histograms
+SCAN_OUTCOMES = {
+    status.HTTP_200_OK: 'completed',
+    status.HTTP_400_BAD_REQUEST: 'rejected',
+    status.HTTP_404_NOT_FOUND: 'not_found',
+    status.HTTP_409_CONFLICT: 'conflict',
+}
+
+
+def scan_outcome(status_code):
+    return SCAN_OUTCOMES.get(status_code, 'error')
+
+
+def _locked_barcode(code):
+    """
+    The barcode and its bill in one query, both rows locked until the end of
+    the transaction so scans of the same code queue up instead of conflicting
+    (the lock is a no-op on SQLite, which serializes writes).
+    """
+    barcode = (
+        Barcode.objects
+        .select_related('associated_bill')
+        .select_for_update()
+        .only(
+            'code', 'status', 'assigned_to', 'associated_bill__code', 'associated_bill__status',
+            *(f'associated_bill__{field}' for field in rollups.TRACKED_FIELDS),
+        )
+        .filter(code=code)
+        .first()
+    )
+    if barcode is not None and barcode.associated_bill is None:
+        # Barcodes activated before bills were linked to them
+        barcode.associated_bill = Bill.objects.select_for_update().filter(code=code).first()
+    return barcode
+
+
+def process_scan(code, person, scanned_at=None):
+    """
+    Complete the pending bill behind an active barcode.
+    Returns an (http status, payload) pair.
+    """
+    if not code:
+        return status.HTTP_400_BAD_REQUEST, {"error": "Code is required"}
+
+    with transaction.atomic():
+        barcode = _locked_barcode(code)
+        if not barcode:
+            return status.HTTP_404_NOT_FOUND, {"error": "Barcode not found"}
+        if barcode.status != 'active':
+            return status.HTTP_400_BAD_REQUEST, {"error": "Barcode is not active"}
+        bill = barcode.associated_bill
+        if not bill:
+            return status.HTTP_404_NOT_FOUND, {"error": "Bill not found for this barcode"}
+        if bill.status != 'pending':
+            return status.HTTP_400_BAD_REQUEST, {"error": f"Bill is already {bill.status}"}
+
+        try:
+            close_bill(bill, barcode, 'completed', person, completion_time(bill, scanned_at))
+        except TransitionError as e:
+            return status.HTTP_409_CONFLICT, {"error": str(e)}
+    return status.HTTP_200_OK, {"message": "Bill completed successfully"}
+
+
+def completion_time(bill, scanned_at):
+    """Use the device timestamp when it is plausible, otherwise the server time"""
+    now = timezone.now()
+    if scanned_at is None or scanned_at > now + MAX_CLOCK_SKEW or scanned_at < bill.date_issued:
+        return now
+    return min(scanned_at, now)
+
+
+def parse_scanned_at(value):
+    if not value:
+        return None
+    try:
+        scanned_at = parse_datetime(str(value))
+    except ValueError:
+        return None
+    if scanned_at is not None and timezone.is_naive(scanned_at):
+        scanned_at = timezone.make_aware(scanned_at)
+    return scanned_at
+
+
+def _result(key, code, status_code, payload, replayed):
+    return {
+        'key': key,
+        'code': code,
+        'status': status_code,
+        'replayed': replayed,
+        'result': payload,
+    }
+
+
+def sync_scans(scans, person):
+    """
+    Process a batch of buffered scans in one transaction.
+
+    Every scan carries a client idempotency key, unique per scanning person.
+    Keys that person used before (in an earlier batch or earlier in this one)
+    are answered from their ScanReceipt without touching the bill again, or
+    with a 409 when the key came with another code. Each new scan runs in its
+    own savepoint together with its receipt, so one bad scan cannot undo the
+    rest.
+    """
+    keys = [scan['key'] for scan in scans]
+    receipts = {
+        receipt.idempotency_key: receipt
+        for receipt in ScanReceipt.objects.filter(scanned_by=person, idempotency_key__in=keys)
+    }
+
+    results = []
+    # The closed bills are stamped once, at the end of the batch
+    with transaction.atomic(), changes.stamping():
+        for scan in scans:
+            key, code = scan['key'], scan['code']
+            receipt = receipts.get(key)
+            if receipt is None:
+                scanned_at = parse_scanned_at(scan.get('scanned_at'))
+                try:
+                    with transaction.atomic():
+                        status_code, payload = process_scan(code, person, scanned_at)
+                        receipt = ScanReceipt.objects.create(
+                            idempotency_key=key,
+                            code=code,
+                            scanned_at=scanned_at,
+                            scanned_by=person,
+                            status_code=status_code,
+                            result=payload,
+                        )
+                except IntegrityError:
+                    # The same key was committed concurrently by a retried request
+                    receipt = ScanReceipt.objects.filter(scanned_by=person, idempotency_key=key).first()
+                    if receipt is None:
+                        raise
+                else:
+                    receipts[key] = receipt
+                    results.append(_result(key, code, status_code, payload, replayed=False))
+                    continue
+                receipts[key] = receipt
+            if receipt.code != code:
+                # Not a retry: the device reused a key, and this scan was not processed
+                results.append(_result(key, code, status.HTTP_409_CONFLICT, {
+                    "error": f"Scan key {key} was already used for code {receipt.code}",
+                }, replayed=False))
+                continue
+            results.append(_result(key, receipt.code, receipt.status_code, receipt.result, replayed=True))
+    return results
+
+
+def receipt_retention_days():
+    return getattr(settings, 'SCAN_RECEIPT_RETENTION_DAYS', 30)
+
+
+def prune_receipts(older_than_days=None, now=None, batch_size=PRUNE_BATCH_SIZE):
+    """
+    Delete scan receipts received more than ``older_than_days`` (default
+    SCAN_RECEIPT_RETENTION_DAYS) ago, ``batch_size`` per statement. A scan
+    replayed after that is processed again, which is harmless for a bill
+    it already closed. Returns the number of receipts deleted.
+    """
+    if older_than_days is None:
+        older_than_days = receipt_retention_days()
+    cutoff = (now or timezone.now()) - timedelta(days=older_than_days)
+    expired = ScanReceipt.objects.filter(received_at__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(expired.order_by('received_at').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ScanReceipt.objects.filter(pk__in=ids).delete()[0]
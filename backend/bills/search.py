@@ -0,0 +1,215 @@
+"""
+Indexed search over bills.
+
+Every Bill has a BillSearchDocument row holding one lowercase line of text
+built from its searchable columns (including the issuer/modifier names, which
+would otherwise need joins). The index over that text depends on the database:
+
+* SQLite: an external-content FTS5 table with the trigram tokenizer, kept in
+  sync with triggers, so substring matches are index lookups ranked by bm25.
+* PostgreSQL: a generated tsvector column with a GIN index for ranking plus a
+  pg_trgm GIN index that serves the ILIKE substring matches.
+
+Any other backend falls back to an icontains filter chain over the columns,
+as do archived bills (bills/archive.py), which have no search document.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import ArchivedBill, Bill, BillHistory, BillSearchDocument
+
+# Columns copied into the search document, in order
+SEARCH_FIELDS = (
+    'code',
+    'vehicle_number',
+    'customer_name',
+    'destination',
+    'material',
+    'issue_location',
+    'issued_by__user__name',
+    'modified_by__user__name',
+    'remark',
+)
+
+# Saving a Bill only needs a re-index when one of these changes
+INDEXED_BILL_FIELDS = {
+    'code', 'vehicle_number', 'customer_name', 'destination', 'material',
+    'issue_location', 'issued_by', 'modified_by', 'remark',
+}
+
+# FTS5 trigram tokens need at least three characters
+MIN_TRIGRAM_LENGTH = 3
+
+INDEX_BATCH_SIZE = 1000
+
+SQLITE_FTS_TABLE = 'bills_billsearch_fts'
+
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        document,
+        content='bills_billsearchdocument',
+        content_rowid='bill_id',
+        tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS bills_billsearch_ai AFTER INSERT ON bills_billsearchdocument BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, document) VALUES (new.bill_id, new.document);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS bills_billsearch_ad AFTER DELETE ON bills_billsearchdocument BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, document) VALUES ('delete', old.bill_id, old.document);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS bills_billsearch_au AFTER UPDATE ON bills_billsearchdocument BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, document) VALUES ('delete', old.bill_id, old.document);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, document) VALUES (new.bill_id, new.document);
+    END""",
+]
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """ALTER TABLE bills_billsearchdocument ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', document)) STORED""",
+    """CREATE INDEX IF NOT EXISTS bills_billsearch_vector_gin
+        ON bills_billsearchdocument USING gin (search_vector)""",
+    """CREATE INDEX IF NOT EXISTS bills_billsearch_trgm_gin
+        ON bills_billsearchdocument USING gin (document gin_trgm_ops)""",
+]
+
+
+def install_search_index(using='default', **kwargs):
+    """Create the vendor specific index objects (post_migrate handler, idempotent)"""
+    from django.db import connections
+
+    conn = connections[using]
+    if conn.vendor == 'sqlite':
+        statements = SQLITE_DDL
+    elif conn.vendor == 'postgresql':
+        statements = POSTGRES_DDL
+    else:
+        return
+    with conn.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def build_document(values):
+    """Flatten the SEARCH_FIELDS of a .values() row into one lowercase line"""
+    parts = [str(values[field]) for field in SEARCH_FIELDS if values.get(field)]
+    return ' | '.join(parts).lower()
+
+
+def index_bills(bill_ids):
+    """(Re)build the search documents for the given bills"""
+    bill_ids = list(bill_ids)
+    for start in range(0, len(bill_ids), INDEX_BATCH_SIZE):
+        chunk = bill_ids[start:start + INDEX_BATCH_SIZE]
+        rows = Bill.objects.filter(pk__in=chunk).order_by().values('id', *SEARCH_FIELDS)
+        documents = [
+            BillSearchDocument(bill_id=row['id'], document=build_document(row))
+            for row in rows
+        ]
+        BillSearchDocument.objects.bulk_create(
+            documents,
+            update_conflicts=True,
+            unique_fields=['bill'],
+            update_fields=['document'],
+        )
+
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE):
+    """Re-index every bill, returning the number of documents written"""
+    total = 0
+    last_id = 0
+    while True:
+        chunk = list(
+            Bill.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not chunk:
+            return total
+        index_bills(chunk)
+        total += len(chunk)
+        last_id = chunk[-1]
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _legacy_filter(queryset, terms):
+    """Every term somewhere in the SEARCH_FIELDS columns themselves (icontains)"""
+    condition = Q()
+    for term in terms:
+        condition &= reduce(or_, (Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS))
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def _sqlite_search(queryset, terms):
+    table = Bill._meta.db_table
+    if all(len(term) >= MIN_TRIGRAM_LENGTH for term in terms):
+        # Each term is a quoted FTS5 phrase; adjacent phrases are ANDed
+        match = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+        matching = RawSQL(
+            f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s",
+            (match,),
+        )
+        rank = RawSQL(
+            f"SELECT -bm25({SQLITE_FTS_TABLE}) FROM {SQLITE_FTS_TABLE} "
+            f"WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = \"{table}\".\"id\"",
+            (match,),
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matching).annotate(search_rank=rank)
+
+    # Too short for trigrams: scan the (narrow) document table instead
+    where = ' AND '.join("document LIKE %s ESCAPE '\\'" for _ in terms)
+    matching = RawSQL(
+        f"SELECT bill_id FROM bills_billsearchdocument WHERE {where}",
+        tuple(_like_pattern(term) for term in terms),
+    )
+    return queryset.filter(id__in=matching).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def _postgres_search(queryset, terms):
+    table = Bill._meta.db_table
+    query = ' '.join(terms)
+    where = ' AND '.join('document ILIKE %s' for _ in terms)
+    matching = RawSQL(
+        f"SELECT bill_id FROM bills_billsearchdocument WHERE {where}",
+        tuple(_like_pattern(term) for term in terms),
+    )
+    rank = RawSQL(
+        "SELECT ts_rank(search_vector, plainto_tsquery('simple', %s)) + word_similarity(%s, document) "
+        f"FROM bills_billsearchdocument WHERE bill_id = \"{table}\".\"id\"",
+        (query, query),
+        output_field=FloatField(),
+    )
+    return queryset.filter(id__in=matching).annotate(search_rank=rank)
+
+
+def search_bills(queryset, query):
+    """
+    Filter a Bill queryset down to the bills matching ``query`` and annotate
+    each with a ``search_rank`` (higher is better). Every whitespace separated
+    term must appear somewhere in the bill's search document.
+    """
+    terms = query.lower().split()
+    if not terms:
+        return queryset
+    if queryset.model is BillHistory:
+        # Archived bills have no search document: the bills still in Bill
+        # match through the index, the archived ones by their columns
+        indexed = search_bills(Bill.objects.order_by(), query).values('id')
+        archived = _legacy_filter(ArchivedBill.objects.order_by(), terms).values('id')
+        return queryset.filter(Q(id__in=indexed) | Q(id__in=archived)).annotate(
+            search_rank=Value(0.0, output_field=FloatField()),
+        )
+    if queryset.model is not Bill:
+        return _legacy_filter(queryset, terms)
+    if connection.vendor == 'sqlite':
+        return _sqlite_search(queryset, terms)
+    if connection.vendor == 'postgresql':
+        return _postgres_search(queryset, terms)
+    return _legacy_filter(queryset, terms)
@@ -2,7 +2,21 @@ from rest_framework import serializers
 from .models import Bill
 from codes.models import Barcode
 from enterprise.models import Person
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
+from .changes import stamping
+from .transitions import BARCODE_STATUS_FOR, TransitionError, close_bill, transition_barcode
+from backend.timing import serializing
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    """Reports the time spent serializing bill lists in the Server-Timing header"""
+
+    def to_representation(self, data):
+        with serializing():
+            return super().to_representation(data)
+
 
 class BillSerializer(serializers.ModelSerializer):
     issued_by_name = serializers.SerializerMethodField()
@@ -10,63 +24,62 @@ class BillSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bill
         fields = '__all__'
+        list_serializer_class = TimedListSerializer
 
     def create(self, validated_data):
         code = validated_data.get('code')
         issued_by = validated_data.get('issued_by')
-        print("haha",code)
+        barcode = None
         if code:
             barcode = Barcode.objects.filter(code=code).first()
             if not barcode:
                 raise serializers.ValidationError("Barcode with this code does not exist.")
             if barcode.assigned_to != issued_by:
                 raise serializers.ValidationError("This barcode was not issued to you")
-
-            if barcode and barcode.status == 'issued':
-                barcode.status = 'active'
-                barcode.save()
-            else:
-            # If no barcode is found or it's not issued, return with an error
+            if barcode.status != 'issued':
                 raise serializers.ValidationError("Barcode is either not issued or already expired.")
 
-        bill = Bill.objects.create(**validated_data)
-        barcode.associated_bill = bill
-        barcode.save()
-        if bill.region == 'local':
-            bill.status = 'completed'
-            bill.modified_by = bill.issued_by
-            bill.modified_date = timezone.now()
-            barcode.status = 'used'
-            barcode.save()
-            bill.save()
+        # One stamp for the bill, after its barcode and (local) close are written
+        with transaction.atomic(), stamping():
+            bill = Bill.objects.create(**validated_data)
+            if barcode:
+                try:
+                    # Fails if another request activated the barcode since we read it
+                    transition_barcode(barcode, 'active', associated_bill=bill)
+                    if bill.region == 'local':
+                        close_bill(bill, barcode, 'completed', bill.issued_by)
+                except TransitionError:
+                    raise serializers.ValidationError("Barcode is either not issued or already expired.")
         return bill
     
     def update(self, instance, validated_data):
-
-        # Handle issued_by field - use first Person or create a default one
         status = validated_data.get('status')
         code = validated_data.get('code')
-        print(validated_data)
-        print("code", code)
-        if code:
-            barcode = Barcode.objects.get(code=code)
-            print("barcode", barcode)
-            if barcode and barcode.status == 'active':
-                if status == 'completed':
-                    barcode.status = 'used'
-                elif status == 'cancelled':
-                    barcode.status = 'cancelled'
-                else:
-                    raise serializers.ValidationError("Invalid status for bill.")
-                barcode.save()
-            else:
-                raise serializers.ValidationError("Barcode is either not active or already expired.")
-        else:
+        if not code:
             raise serializers.ValidationError("Barcode code is required for updating the bill.")
-        for attr, value in validated_data.items():
-            print("HERE AS WELL", attr, value)
-            setattr(instance, attr, value)
-        instance.save()
+        barcode = Barcode.objects.filter(code=code).first()
+        if not barcode or barcode.status != 'active':
+            raise serializers.ValidationError("Barcode is either not active or already expired.")
+        if status not in BARCODE_STATUS_FOR:
+            raise serializers.ValidationError("Invalid status for bill.")
+
+        other_fields = {
+            attr: value for attr, value in validated_data.items()
+            if attr not in ('status', 'modified_by', 'modified_date') and getattr(instance, attr) != value
+        }
+        with transaction.atomic(), stamping():
+            try:
+                close_bill(
+                    instance, barcode, status,
+                    validated_data.get('modified_by', instance.modified_by),
+                    validated_data.get('modified_date'),
+                )
+            except TransitionError as e:
+                raise serializers.ValidationError(str(e))
+            if other_fields:
+                for attr, value in other_fields.items():
+                    setattr(instance, attr, value)
+                instance.save(update_fields=list(other_fields))
         return instance
     
     def get_issued_by_name(self, obj):
@@ -78,3 +91,56 @@ class BillSerializer(serializers.ModelSerializer):
         if obj.modified_by:
             return obj.modified_by.user.name
         return None
+
+
+class BillRowSerializer:
+    """
+    Read-only fast path for the bill lists: the same output as
+    BillSerializer(many=True), built straight from .values() rows without
+    instantiating models or running DRF fields. Only the datetimes need
+    converting; DB values of the other fields already are what DRF returns.
+    """
+    _field_names = None
+    _datetime_fields = None
+
+    @classmethod
+    def field_names(cls):
+        if cls._field_names is None:
+            fields = BillSerializer().fields
+            cls._datetime_fields = [
+                name for name, field in fields.items() if isinstance(field, serializers.DateTimeField)
+            ]
+            cls._field_names = list(fields)
+        return cls._field_names
+
+    @classmethod
+    def rows(cls, queryset):
+        """The values() queryset the list endpoints paginate and serialize"""
+        names = [
+            name for name in cls.field_names() if name not in ('issued_by_name', 'modified_by_name')
+        ]
+        return queryset.values(
+            *names,
+            issued_by_name=F('issued_by__user__name'),
+            modified_by_name=F('modified_by__user__name'),
+        )
+
+    @classmethod
+    def serialize(cls, rows):
+        names = cls.field_names()
+        datetime_fields = cls._datetime_fields
+        tz = timezone.get_current_timezone()
+        data = []
+        with serializing():
+            for row in rows:
+                item = {name: row[name] for name in names}
+                for name in datetime_fields:
+                    value = item[name]
+                    if value is not None:
+                        # As DRF's DateTimeField: current time zone, ISO 8601, UTC as Z
+                        value = value.astimezone(tz).isoformat()
+                        if value.endswith('+00:00'):
+                            value = value[:-6] + 'Z'
+                        item[name] = value
+                data.append(item)
+        return data
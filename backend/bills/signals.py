@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from codes.models import Barcode
+
+from . import cache, changes, live, rollups, search
+from .models import Bill
+
+
+@receiver(pre_save, sender=Bill)
+def remember_rollup_state(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not (set(update_fields) & set(rollups.TRACKED_FIELDS)):
+        return
+    instance._rollup_previous = rollups.loaded_state(instance)
+
+
+@receiver(post_save, sender=Bill)
+def update_rollups(sender, instance, created, raw=False, **kwargs):
+    """Move the bill's count/revenue between daily rollup rows"""
+    if raw:
+        return
+    if created:
+        rollups.apply(rollups.bill_state(instance), 1)
+    elif hasattr(instance, '_rollup_previous'):
+        rollups.record_change(instance._rollup_previous, rollups.bill_state(instance))
+        del instance._rollup_previous
+    rollups.remember_state(instance)
+
+
+@receiver(post_delete, sender=Bill)
+def remove_from_rollups(sender, instance, **kwargs):
+    rollups.apply(rollups.loaded_state(instance), -1)
+
+
+@receiver(post_delete, sender=Bill)
+def leave_tombstone(sender, instance, using, **kwargs):
+    """Delta sync clients (bills/changes/) learn about deletions from the tombstone"""
+    changes.record_deletion(instance.pk, using)
+
+
+@receiver(post_save, sender=Bill)
+def index_saved_bill(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Keep the bill's search document in sync with its searchable columns"""
+    if raw:
+        return
+    if update_fields is not None and not (set(update_fields) & search.INDEXED_BILL_FIELDS):
+        return
+    search.index_bills([instance.pk])
+
+
+@receiver(post_save, sender=Bill)
+def announce_created_bill(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        live.publish_bill_event('created', instance)
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_user_name(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    instance._previous_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reindex_renamed_user_bills(sender, instance, created, **kwargs):
+    """Issuer/modifier names are denormalized into the search documents"""
+    previous_name = getattr(instance, '_previous_name', None)
+    if created or previous_name is None or previous_name == instance.name:
+        return
+    bill_ids = Bill.objects.filter(
+        Q(issued_by__user=instance) | Q(modified_by__user=instance)
+    ).values_list('pk', flat=True)
+    search.index_bills(bill_ids)
+    # Names are also part of the bill rows: delta sync clients (and the list
+    # ETags) see the bills as changed
+    changes.stamp_bills(bill_ids, locked=False)
+    # ... and of the analytics responses
+    cache.bump_generation_on_commit()
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+@receiver(post_save, sender=Barcode)
+@receiver(post_delete, sender=Barcode)
+def invalidate_analytics_cache(sender, raw=False, **kwargs):
+    """Cached analytics responses are stale after any bill or barcode write"""
+    if not raw:
+        cache.bump_generation_on_commit()
@@ -0,0 +1,71 @@
+from django.db.models import Count, Sum
+
+BILL_STATUSES = ('pending', 'completed', 'cancelled')
+
+# Columns that can be requested as facets with ?facets=material,region,...
+FACET_FIELDS = ('material', 'region', 'vehicle_size', 'issue_location')
+
+
+def parse_facets(value):
+    """
+    Turn a comma separated ?facets= value into a tuple of known facet fields.
+    Raises ValueError for names that are not facets, so a typo is reported
+    instead of silently leaving the facet out.
+    """
+    if not value:
+        return ()
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = sorted(set(requested) - set(FACET_FIELDS) - {'all'})
+    if unknown:
+        raise ValueError(f"Unknown facets: {', '.join(unknown)} (choose from all, {', '.join(FACET_FIELDS)})")
+    if 'all' in requested:
+        return FACET_FIELDS
+    return tuple(name for name in FACET_FIELDS if name in requested)
+
+
+def summarize_bills(queryset, facets=()):
+    """
+    Compute status counts, amount totals and optional facet counts for a
+    filtered Bill queryset in a single grouped query.
+
+    The queryset is grouped by status plus every requested facet column and
+    the (small) result is folded in Python, so the cost is one round trip
+    regardless of how many facets are asked for.
+    """
+    group_by = ('status',) + tuple(facets)
+    rows = queryset.order_by().values(*group_by).annotate(
+        bill_count=Count('id'),
+        amount_total=Sum('amount'),
+    )
+
+    status_counts = {name: 0 for name in BILL_STATUSES}
+    status_totals = {name: 0 for name in BILL_STATUSES}
+    facet_counts = {name: {} for name in facets}
+    for row in rows:
+        bill_status = row['status']
+        status_counts[bill_status] = status_counts.get(bill_status, 0) + row['bill_count']
+        status_totals[bill_status] = status_totals.get(bill_status, 0) + (row['amount_total'] or 0)
+        for name in facets:
+            counts = facet_counts[name]
+            counts[row[name]] = counts.get(row[name], 0) + row['bill_count']
+
+    summary = {
+        'count': sum(status_counts.values()),
+        'totals': {
+            'pending_total': status_totals['pending'],
+            'completed_total': status_totals['completed'],
+            'cancelled_total': status_totals['cancelled'],
+            # Cancelled bills never count towards the grand total
+            'grand_total': status_totals['pending'] + status_totals['completed'],
+        },
+        'status_counts': status_counts,
+    }
+    if facets:
+        summary['facets'] = {
+            name: [
+                {'value': value, 'count': count}
+                for value, count in sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+            ]
+            for name, counts in facet_counts.items()
+        }
+    return summary
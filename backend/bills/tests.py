@@ -1,3 +1,814 @@
-from django.test import TestCase
+import asyncio
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from backend.testing import (
+    QueryBudgetTestCase, authenticated_client, bill_data, make_barcode, make_bill, make_person,
+)
+from codes import counters
+from codes.models import Barcode, BarcodeStatusCounter
+
+from . import bulk, completion_stats, live, rollups, scanning
+from .archive import archive_bills
+from .models import (
+    Bill, BillChangeCounter, BillHistory, DailyBillRollup, DailyDestinationRollup, ScanReceipt,
+)
+from .search import SEARCH_FIELDS, index_bills, search_bills
+from .serializers import BillRowSerializer, BillSerializer
+from .transitions import TransitionError, close_bill
+
+
+class BillQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = make_person()
+
+    def seed_bills(self, count):
+        for _ in range(count):
+            make_bill(self.staff, 'pending')
+            make_bill(self.staff, 'completed', modified_by=self.admin)
+            make_bill(self.staff, 'cancelled', modified_by=self.admin)
+
+    def next_active_code(self):
+        return Barcode.objects.filter(status='active').values_list('code', flat=True).first()
+
+    def test_bill_list(self):
+        self.assertQueryBudget(4, self.seed_bills, lambda: self.client.get(reverse('bills')))
+
+    def test_bill_list_with_facets(self):
+        self.assertQueryBudget(4, self.seed_bills, lambda: self.client.get(
+            reverse('bills'), {'status': 'completed', 'facets': 'material,region'},
+        ))
+
+    def test_bill_list_summary_values(self):
+        specs = [
+            ('pending', 100.5, 'gravel', 'local', 'Himal Traders'),
+            ('pending', 200.0, 'roda', 'crossborder', 'Himal Traders'),
+            ('completed', 300.25, 'gravel', 'crossborder', 'Himal Traders'),
+            ('completed', 50.0, 'gravel', 'local', 'Himal Traders'),
+            ('cancelled', 999.0, 'chips', 'local', 'Himal Traders'),
+            # Filtered out by the search
+            ('completed', 7000.0, 'gravel', 'local', 'Sagar Suppliers'),
+        ]
+        for bill_status, amount, material, region, customer in specs:
+            bill = make_bill(self.staff, bill_status, modified_by=self.admin)
+            Bill.objects.filter(pk=bill.pk).update(
+                amount=amount, material=material, region=region, customer_name=customer,
+            )
+        index_bills(Bill.objects.values_list('pk', flat=True))
+
+        response = self.client.get(reverse('bills'), {'search': 'himal', 'facets': 'material,region'})
+        self.assertEqual(response.status_code, 200)
+
+        matched = [spec for spec in specs if spec[4] == 'Himal Traders']
+        self.assertEqual(
+            sorted(row['id'] for row in response.data['results']),
+            sorted(Bill.objects.filter(customer_name='Himal Traders').values_list('pk', flat=True)),
+        )
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(response.data['status_counts'], {'pending': 2, 'completed': 2, 'cancelled': 1})
+        self.assertEqual(response.data['totals'], {
+            'pending_total': 300.5,
+            'completed_total': 350.25,
+            'cancelled_total': 999.0,
+            'grand_total': 650.75,
+        })
+        self.assertEqual(response.data['totals']['grand_total'], sum(
+            amount for bill_status, amount, *_ in matched if bill_status != 'cancelled'
+        ))
+        self.assertEqual(response.data['facets'], {
+            'material': [
+                {'value': 'gravel', 'count': 3}, {'value': 'chips', 'count': 1}, {'value': 'roda', 'count': 1},
+            ],
+            'region': [{'value': 'local', 'count': 3}, {'value': 'crossborder', 'count': 2}],
+        })
+
+    def test_bill_list_unknown_facets(self):
+        response = self.client.get(reverse('bills'), {'facets': 'material,colour'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('colour', response.data['error'])
+        # 'all' and stray commas are fine
+        response = self.client.get(reverse('bills'), {'facets': 'all,'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['facets']), {'material', 'region', 'vehicle_size', 'issue_location'})
+
+    def test_row_serializer_matches_bill_serializer(self):
+        make_bill(self.staff, 'pending')  # no modified_by or modified_date
+        make_bill(self.staff, 'completed', modified_by=self.admin)
+        cancelled = make_bill(self.staff, 'cancelled', modified_by=self.admin)
+        Bill.objects.filter(pk=cancelled.pk).update(
+            date_issued=datetime(2024, 12, 31, 18, 15, tzinfo=dt_timezone.utc),
+            modified_date=datetime(2025, 1, 1, 0, 0, 0, 123456, tzinfo=dt_timezone.utc),
+        )
+        queryset = Bill.objects.select_related('issued_by__user', 'modified_by__user').order_by('id')
+
+        # Asia/Kathmandu (+05:45, crossing midnight) and UTC ("Z")
+        for tz in (None, 'UTC'):
+            with timezone.override(tz or timezone.get_default_timezone()):
+                fast = BillRowSerializer.serialize(BillRowSerializer.rows(queryset))
+                slow = BillSerializer(queryset, many=True).data
+            self.assertEqual([list(row.items()) for row in fast], [list(row.items()) for row in slow], tz)
+            if tz is None:
+                self.assertEqual(fast[2]['date_issued'], '2025-01-01T00:00:00+05:45')
+        self.assertIsNone(fast[0]['modified_by'])
+        self.assertEqual(fast[2]['modified_date'], '2025-01-01T00:00:00.123456Z')
+
+    def test_active_bills(self):
+        self.assertQueryBudget(3, self.seed_bills, lambda: self.client.get(reverse('active_bills')))
+
+    # The history lists also read the archive horizon (bills_with_archive),
+    # cached afterwards but cleared here
+    def test_completed_bills(self):
+        self.assertQueryBudget(5, self.seed_bills, lambda: self.client.get(reverse('completed_bills')))
+
+    def test_completed_bills_cursor(self):
+        self.assertQueryBudget(4, self.seed_bills, lambda: self.client.get(
+            reverse('completed_bills'), {'pagination': 'cursor'},
+        ))
+
+    def test_cursor_pages_with_ties_and_nulls(self):
+        bills = [make_bill(self.staff, 'completed', modified_by=self.admin).pk for _ in range(7)]
+        Bill.objects.filter(pk__in=bills[:4]).update(modified_date=timezone.now() - timedelta(days=1))
+        Bill.objects.filter(pk__in=bills[4:]).update(modified_date=None)
+        # Tied dates by id, newest first, then the undated ones
+        expected = sorted(bills[:4], reverse=True) + sorted(bills[4:], reverse=True)
+
+        pages = []
+        url, params = reverse('completed_bills'), {'pagination': 'cursor', 'page_size': 2}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([row['id'] for row in response.data['results']])
+            url, params = response.data['next'], None
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:6], expected[6:]])
+
+        # Walking back from the last page gives the same pages
+        backwards = []
+        url = response.data['previous']
+        while url:
+            response = self.client.get(url)
+            backwards.append([row['id'] for row in response.data['results']])
+            url = response.data['previous']
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_bad_cursor(self):
+        make_bill(self.staff, 'completed', modified_by=self.admin)
+
+        def encode(payload):
+            return base64.urlsafe_b64encode(payload.encode()).decode()
+
+        cursors = [
+            'garbage', 'Zm9v', 'é', encode('[1]'), encode('{"i": 1}'), encode('{"d": "yesterday", "i": 1}'),
+            encode('{"d": null, "i": "x"}'), encode('{"d": null, "i": 1e400}'), encode('{"d": null, "i": 1e30}'),
+        ]
+        for cursor in cursors:
+            for name in ('completed_bills', 'cancelled_bills'):
+                response = self.client.get(reverse(name), {'pagination': 'cursor', 'cursor': cursor})
+                self.assertEqual(response.status_code, 400, (name, cursor))
+
+    def test_cancelled_bills(self):
+        self.assertQueryBudget(5, self.seed_bills, lambda: self.client.get(reverse('cancelled_bills')))
+
+    def test_bill_changes(self):
+        # Two of them find where the page of changed bills and tombstones ends
+        self.assertQueryBudget(7, self.seed_bills, lambda: self.client.get(
+            reverse('bill_changes'), {'since': 1, 'status': 'pending'},
+        ))
+
+    def test_change_stamp_taken_last(self):
+        bill = make_bill(self.staff, 'pending')
+        counter = BillChangeCounter._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('scan'), {'code': bill.code}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        statements = [query['sql'] for query in queries.captured_queries]
+        counter_update = next(i for i, sql in enumerate(statements) if sql.startswith(f'UPDATE "{counter}"'))
+        # Only the stamp itself and the end of the transaction follow the counter increment
+        for sql in statements[counter_update + 1:]:
+            self.assertTrue(sql.startswith(('UPDATE "bills_bill" SET "change_stamp"', 'RELEASE SAVEPOINT')), sql)
+        bill.refresh_from_db()
+        self.assertEqual(bill.change_stamp, BillChangeCounter.objects.get().value)
+
+    def test_bill_changes_since_token(self):
+        closed = make_bill(self.staff, 'pending')
+        token = self.client.get(reverse('bill_changes'), {'status': 'pending'}).data['token']
+        created = make_bill(self.staff, 'pending')
+        response = self.client.post(reverse('scan'), {'code': closed.code}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        response = self.client.get(reverse('bill_changes'), {'since': token, 'status': 'pending'})
+        self.assertEqual([row['id'] for row in response.data['results']], [created.pk])
+        self.assertEqual(response.data['removed'], [closed.pk])
+        self.assertGreater(response.data['token'], token)
+        response = self.client.get(reverse('bill_changes'), {'since': response.data['token']})
+        self.assertEqual((response.data['results'], response.data['removed']), ([], []))
+
+    def test_bill_changes_future_token(self):
+        make_bill(self.staff, 'pending')
+        token = self.client.get(reverse('bill_changes')).data['token']
+        for since in (token + 1, '99999999999999999999999'):
+            response = self.client.get(reverse('bill_changes'), {'since': since})
+            self.assertEqual(response.status_code, 400, since)
+            self.assertTrue(response.data['resync'])
+
+    @override_settings(BILL_CHANGES_LIMIT=2)
+    def test_bill_changes_pages(self):
+        def walk(since):
+            """Every page from ``since``: ([(result ids, removed ids, has_more)], last token)"""
+            pages = []
+            while True:
+                data = self.client.get(reverse('bill_changes'), {'since': since}).data
+                pages.append(([row['id'] for row in data['results']], data['removed'], data['has_more']))
+                since = data['token']
+                if not data['has_more']:
+                    return pages, since
+
+        bills = [make_bill(self.staff, 'pending') for _ in range(3)]
+        deleted = make_bill(self.staff, 'completed')
+        pages, token = walk(0)
+        self.assertEqual(pages, [
+            ([bills[0].pk, bills[1].pk], [], True),
+            ([bills[2].pk, deleted.pk], [], False),
+        ])
+        self.assertEqual(token, BillChangeCounter.objects.get().value)
+
+        # One stamp for the three bills closed together: a page never splits it
+        ids = [bill.pk for bill in bills]
+        self.client.post(reverse('bulk_bill_status'), {'ids': ids, 'status': 'completed'}, format='json')
+        deleted_id = deleted.pk
+        deleted.delete()
+        pages, token = walk(token)
+        self.assertEqual(pages, [(ids, [], True), ([], [deleted_id], False)])
+        self.assertEqual(token, BillChangeCounter.objects.get().value)
+
+    def test_bill_list_reads_archive(self):
+        def seed_archived(count):
+            self.seed_bills(count)
+            Bill.objects.exclude(status='pending').update(date_issued=timezone.now() - timedelta(days=400))
+            archive_bills(older_than_days=365)
+
+        self.assertQueryBudget(5, seed_archived, lambda: self.client.get(
+            reverse('bills'), {'date_issued_from': '2000-01-01'},
+        ))
+        self.assertEqual(Bill.objects.count(), 12)
+        self.assertEqual(len(self.client.get(reverse('bills')).data['results']), 12)
+        response = self.client.get(reverse('bills'), {'date_issued_from': '2000-01-01', 'status': 'completed'})
+        self.assertEqual(response.data['count'], 12)
+
+    def test_archived_bills_stay_listed(self):
+        self.seed_bills(2)
+        token = self.client.get(reverse('bill_changes')).data['token']
+        archived = set(Bill.objects.exclude(status='pending').values_list('pk', flat=True))
+        Bill.objects.filter(pk__in=archived).update(date_issued=timezone.now() - timedelta(days=400))
+        self.assertEqual(archive_bills(older_than_days=365), 4)
+
+        # Gone from the hot table, so delta sync clients drop them...
+        response = self.client.get(reverse('bill_changes'), {'since': token})
+        self.assertEqual(set(response.data['removed']), archived)
+        # ...but the history lists still show them
+        for name in ('completed_bills', 'cancelled_bills'):
+            for params in ({}, {'pagination': 'cursor'}):
+                response = self.client.get(reverse(name), params)
+                self.assertEqual(len(response.data['results']), 2, (name, params))
+
+    def test_bill_list_date_range(self):
+        day = timezone.localdate() - timedelta(days=3)
+        midnight = timezone.make_aware(timezone.datetime(day.year, day.month, day.day))
+        inside, after = make_bill(self.staff), make_bill(self.staff)
+        Bill.objects.filter(pk=inside.pk).update(date_issued=midnight + timedelta(hours=23, minutes=59, seconds=59.5))
+        Bill.objects.filter(pk=after.pk).update(date_issued=midnight + timedelta(days=1))
+
+        response = self.client.get(reverse('bills'), {
+            'date_issued_from': day.isoformat(), 'date_issued_to': day.isoformat(),
+        })
+        self.assertEqual([row['id'] for row in response.data['results']], [inside.pk])
+        response = self.client.get(reverse('bills'), {'date_issued_to': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_bill(self):
+        def create():
+            barcode = make_barcode(self.admin, self.admin)
+            return self.client.post(reverse('bills'), bill_data(barcode.code), format='json')
+
+        self.assertQueryBudget(23, self.seed_bills, create, status_code=201)
+
+    def test_complete_bill(self):
+        def complete():
+            code = self.next_active_code()
+            bill = Bill.objects.get(code=code)
+            return self.client.patch(
+                reverse('bill_detail', args=[bill.pk]), {'code': code, 'status': 'completed'}, format='json',
+            )
+
+        self.assertQueryBudget(23, self.seed_bills, complete)
+
+    def test_bulk_status(self):
+        def complete_all():
+            ids = list(Bill.objects.filter(status='pending').values_list('pk', flat=True))
+            return self.client.post(reverse('bulk_bill_status'), {'ids': ids, 'status': 'completed'}, format='json')
+
+        self.assertQueryBudget(16, self.seed_bills, complete_all)
+
+    def test_scan(self):
+        self.assertQueryBudget(17, self.seed_bills, lambda: self.client.post(
+            reverse('scan'), {'code': self.next_active_code()}, format='json',
+        ))
+
+    def test_scan_sync(self):
+        def sync():
+            scans = [
+                {'code': code, 'key': f'scan-{code}'}
+                for code in Barcode.objects.filter(status='active').values_list('code', flat=True)[:2]
+            ]
+            return self.client.post(reverse('scan_sync'), {'scans': scans}, format='json')
+
+        self.assertQueryBudget(38, self.seed_bills, sync)
+
+    def derived_rows(self):
+        """The rollups, barcode counters and change counter a losing transition must not move"""
+        return [
+            sorted(DailyBillRollup.objects.exclude(bills_count=0).values_list(
+                'date', 'status', 'material', 'region', 'vehicle_size', 'issue_location', 'bills_count', 'revenue',
+            )),
+            sorted(DailyDestinationRollup.objects.exclude(bills_count=0).values_list(
+                'date', 'status', 'destination', 'bills_count', 'revenue',
+            )),
+            sorted(BarcodeStatusCounter.objects.exclude(count=0).values_list(
+                'assigned_to', 'status', 'associated', 'count',
+            )),
+            BillChangeCounter.objects.values_list('value', flat=True).first(),
+        ]
+
+    def test_losing_transition(self):
+        bill = make_bill(self.staff, 'pending')
+        barcode = Barcode.objects.get(code=bill.code)
+        stale_bill, stale_barcode = Bill.objects.get(pk=bill.pk), Barcode.objects.get(pk=barcode.pk)
+        close_bill(bill, barcode, 'cancelled', self.admin)
+        before = self.derived_rows()
+
+        # Read as pending before the cancel won
+        with self.assertRaisesMessage(TransitionError, 'was changed by another request'):
+            close_bill(stale_bill, stale_barcode, 'completed', self.admin)
+        # Known to be closed already
+        with self.assertRaisesMessage(TransitionError, 'cannot move from cancelled to completed'):
+            close_bill(bill, barcode, 'completed', self.admin)
+        response = self.client.post(reverse('scan'), {'code': bill.code}, format='json')
+        self.assertEqual((response.status_code, response.data), (400, {'error': 'Barcode is not active'}))
+
+        self.assertEqual(self.derived_rows(), before)
+        bill.refresh_from_db()
+        barcode.refresh_from_db()
+        self.assertEqual((bill.status, barcode.status), ('cancelled', 'cancelled'))
+
+    def test_bulk_status_outcomes(self):
+        first, raced, expired, last = (make_bill(self.staff, 'pending') for _ in range(4))
+        completed = make_bill(self.staff, 'completed')
+        cancelled = make_bill(self.staff, 'cancelled')
+        barcode = Barcode.objects.get(code=expired.code)
+        barcode.status = 'cancelled'
+        barcode.save()
+        missing = Bill.objects.order_by('-pk').values_list('pk', flat=True).first() + 1
+
+        close_bills = bulk.close_bills
+
+        def race_then_close(*args):
+            # Another request cancels this bill between the reads and the writes
+            close_bill(Bill.objects.get(pk=raced.pk), Barcode.objects.get(code=raced.code), 'cancelled', self.staff)
+            return close_bills(*args)
+
+        ids = [first.pk, completed.pk, cancelled.pk, missing, first.pk, raced.pk, expired.pk, last.pk]
+        with mock.patch.object(bulk, 'close_bills', side_effect=race_then_close):
+            response = self.client.post(reverse('bulk_bill_status'), {'ids': ids, 'status': 'completed'}, format='json')
+        outcomes = [
+            (outcome['id'], outcome['ok'], outcome.get('status'), outcome.get('error'))
+            for outcome in response.data['results']
+        ]
+        self.assertEqual(outcomes, [
+            (first.pk, True, 'completed', None),
+            (completed.pk, False, 'completed', 'Bill is already completed'),
+            (cancelled.pk, False, 'cancelled', 'Bill is already cancelled'),
+            (missing, False, None, 'Bill not found'),
+            (first.pk, False, 'completed', 'Bill listed more than once'),
+            (raced.pk, False, 'pending', f'Bill {raced.code} was changed by another request'),
+            (expired.pk, False, 'pending', 'Barcode is either not active or already expired.'),
+            (last.pk, True, 'completed', None),
+        ])
+        self.assertEqual((response.data['updated'], response.data['failed']), (2, 6))
+        raced.refresh_from_db()
+        self.assertEqual(raced.status, 'cancelled')
+
+        # Only the winners moved the rollups and counters
+        maintained = self.derived_rows()[:3]
+        rollups.rebuild()
+        counters.reconcile()
+        self.assertEqual(self.derived_rows()[:3], maintained)
+
+    def sync(self, *scans, client=None):
+        response = (client or self.client).post(reverse('scan_sync'), {
+            'scans': [{'key': key, 'code': code} for key, code in scans],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(result['key'], result['status'], result['replayed']) for result in response.data['results']]
+
+    def test_scan_sync_replays_keys(self):
+        bill = make_bill(self.staff, 'pending')
+        self.assertEqual(self.sync(('k1', bill.code)), [('k1', 200, False)])
+        bill.refresh_from_db()
+        stamp = bill.change_stamp
+
+        # The same key again, alone and twice more in one batch
+        self.assertEqual(self.sync(('k1', bill.code)), [('k1', 200, True)])
+        self.assertEqual(self.sync(('k1', bill.code), ('k1', bill.code)), [('k1', 200, True), ('k1', 200, True)])
+        bill.refresh_from_db()
+        self.assertEqual((bill.status, bill.change_stamp), ('completed', stamp))
+        self.assertEqual(ScanReceipt.objects.filter(idempotency_key='k1').count(), 1)
+
+    def test_scan_sync_duplicates_in_batch(self):
+        bill = make_bill(self.staff, 'pending')
+        self.assertEqual(self.sync(('k1', bill.code), ('k1', bill.code), ('k2', bill.code)), [
+            ('k1', 200, False),
+            ('k1', 200, True),
+            # Another key for the same code is a second scan of a closed bill
+            ('k2', 400, False),
+        ])
+        self.assertEqual(ScanReceipt.objects.count(), 2)
+
+    def test_scan_sync_keeps_batch_past_failures(self):
+        first, last = make_bill(self.staff, 'pending'), make_bill(self.staff, 'pending')
+        closed = make_bill(self.staff, 'completed')
+        self.assertEqual(self.sync(('a', first.code), ('b', 'NO-SUCH-CODE'), ('c', closed.code), ('d', last.code)), [
+            ('a', 200, False), ('b', 404, False), ('c', 400, False), ('d', 200, False),
+        ])
+        self.assertEqual(
+            set(Bill.objects.filter(pk__in=[first.pk, last.pk]).values_list('status', flat=True)), {'completed'},
+        )
+        # Failures are receipts too: a retry gets the same answer
+        self.assertEqual(self.sync(('b', 'NO-SUCH-CODE')), [('b', 404, True)])
+
+    def test_scan_sync_keys_per_person(self):
+        first, second = make_bill(self.staff, 'pending'), make_bill(self.staff, 'pending')
+        self.assertEqual(self.sync(('k1', first.code)), [('k1', 200, False)])
+        # Another device counting from the same key is not a replay
+        other = authenticated_client(make_person(role='Admin', location=self.admin.location))
+        self.assertEqual(self.sync(('k1', second.code), client=other), [('k1', 200, False)])
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'completed')
+
+    def test_scan_sync_key_reused_for_another_code(self):
+        first, second = make_bill(self.staff, 'pending'), make_bill(self.staff, 'pending')
+        self.assertEqual(self.sync(('k1', first.code), ('k1', second.code)), [('k1', 200, False), ('k1', 409, False)])
+        self.assertEqual(self.sync(('k1', second.code)), [('k1', 409, False)])
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'pending')
+        # The stored answer is still there for the real retry
+        self.assertEqual(self.sync(('k1', first.code)), [('k1', 200, True)])
+
+    def test_prune_scan_receipts(self):
+        bill = make_bill(self.staff, 'pending')
+        self.sync(('old', 'NO-SUCH-CODE'), ('new', bill.code))
+        ScanReceipt.objects.filter(idempotency_key='old').update(received_at=timezone.now() - timedelta(days=31))
+        with override_settings(SCAN_RECEIPT_RETENTION_DAYS=30):
+            self.assertEqual(scanning.prune_receipts(batch_size=1), 1)
+        self.assertEqual(list(ScanReceipt.objects.values_list('idempotency_key', flat=True)), ['new'])
+        self.assertEqual(scanning.prune_receipts(older_than_days=0, now=timezone.now() + timedelta(seconds=1)), 1)
+
+    def test_scan_sync_concurrent_receipt(self):
+        bill = make_bill(self.staff, 'pending')
+        # Committed by a retried request after this batch looked the keys up
+        ScanReceipt.objects.create(
+            idempotency_key='k1', code=bill.code, scanned_by=self.admin, status_code=200, result={'message': 'earlier'},
+        )
+        receipts = ScanReceipt.objects
+        lookups = [receipts.none(), receipts.filter(scanned_by=self.admin, idempotency_key='k1')]
+        with mock.patch.object(receipts, 'filter', side_effect=lookups):
+            response = self.client.post(reverse('scan_sync'), {'scans': [
+                {'key': 'k1', 'code': bill.code},
+            ]}, format='json')
+        self.assertEqual(response.data['results'][0]['result'], {'message': 'earlier'})
+        self.assertTrue(response.data['results'][0]['replayed'])
+        # The scan itself was rolled back with its savepoint
+        bill.refresh_from_db()
+        self.assertEqual(bill.status, 'pending')
+
+    def test_scan_metrics(self):
+        self.assertQueryBudget(1, self.seed_bills, lambda: self.client.get(reverse('scan_metrics')))
+
+    def test_active_bills_not_modified(self):
+        self.seed_bills(2)
+        etag = self.client.get(reverse('active_bills'))['ETag']
+        with self.assertNumQueries(2):  # the user behind the token and the change counter
+            response = self.client.get(reverse('active_bills'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Written as by another worker process: this one's cache generation is not bumped
+        make_bill(self.staff, 'pending')
+        response = self.client.get(reverse('active_bills'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_active_bills_etag_follows_renames(self):
+        make_bill(self.staff, 'pending')
+        etag = self.client.get(reverse('active_bills'))['ETag']
+        self.staff.user.name = 'Renamed Staff'
+        self.staff.user.save()
+        response = self.client.get(reverse('active_bills'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['issued_by_name'], 'Renamed Staff')
+
+
+class BillSearchTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = make_person()
+        self.staff.user.name = 'Ishwor Karki'
+        self.staff.user.save()
+        self.admin.user.name = 'Maya Gurung'
+        self.admin.user.save()
+        self.bill = make_bill(self.staff, 'completed', modified_by=self.admin)
+        Bill.objects.filter(pk=self.bill.pk).update(
+            code='SRCH0042', vehicle_number='BA 9 PA 7788', customer_name='Himal Traders',
+            destination='Biratnagar', material='boulders', issue_location='Butwal', remark='night shift',
+        )
+        index_bills([self.bill.pk])
+        self.other = make_bill(make_person(), 'completed')
+
+    def matches(self, query, queryset=None):
+        return set(search_bills(Bill.objects.all() if queryset is None else queryset, query).values_list('pk', flat=True))
+
+    def test_each_indexed_column_matches(self):
+        terms = {
+            'code': 'srch0042', 'vehicle_number': '7788', 'customer_name': 'himal',
+            'destination': 'biratnagar', 'material': 'boulders', 'issue_location': 'butwal',
+            'issued_by__user__name': 'ishwor', 'modified_by__user__name': 'gurung', 'remark': 'night',
+        }
+        self.assertEqual(set(terms), set(SEARCH_FIELDS))
+        for field, term in terms.items():
+            self.assertEqual(self.matches(term), {self.bill.pk}, field)
+            # Upper case, and too short for the trigram index
+            self.assertEqual(self.matches(term.upper()), {self.bill.pk}, field)
+            self.assertIn(self.bill.pk, self.matches(term[:2]), field)
+
+    def test_terms_are_anded(self):
+        self.assertEqual(self.matches('himal boulders'), {self.bill.pk})
+        self.assertEqual(self.matches('himal pokhara'), set())
+        self.assertEqual(self.matches('hi bo'), {self.bill.pk})
+        # The other bill matches one of the terms alone
+        self.assertEqual(self.matches('gravel'), {self.other.pk})
+        self.assertEqual(self.matches('gravel himal'), set())
+
+    def test_renames_reindex(self):
+        bill = Bill.objects.get(pk=self.bill.pk)
+        bill.customer_name = 'Sagarmatha Suppliers'
+        bill.save()
+        self.assertEqual(self.matches('sagarmatha'), {self.bill.pk})
+        self.assertEqual(self.matches('himal'), set())
+
+        self.staff.user.name = 'Pradeep Thapa'
+        self.staff.user.save()
+        self.assertEqual(self.matches('pradeep'), {self.bill.pk})
+        self.assertEqual(self.matches('ishwor'), set())
+
+        response = self.client.get(reverse('completed_bills'), {'search': 'pradeep sagarmatha'})
+        self.assertEqual([row['id'] for row in response.data['results']], [self.bill.pk])
+
+    def test_history_fallback(self):
+        Bill.objects.filter(pk=self.bill.pk).update(date_issued=timezone.now() - timedelta(days=400))
+        archive_bills(older_than_days=365)
+        self.assertEqual(self.matches('himal'), set())
+        # Archived bills have no search document: BillHistory matches the columns
+        history = BillHistory.objects.all()
+        for query in ('himal', 'ishwor', 'HIMAL TRADERS', 'himal boulders', 'hi bo'):
+            self.assertEqual(self.matches(query, history), {self.bill.pk}, query)
+        self.assertEqual(self.matches('himal gravel', history), set())
+        # ...and the bills still in Bill through their documents
+        self.assertEqual(self.matches('gravel', history), {self.other.pk})
+        self.assertEqual(search_bills(history, 'himal').get().search_rank, 0.0)
+
+        for params in ({'search': 'himal'}, {'search': 'himal', 'date_issued_from': '2000-01-01'}):
+            response = self.client.get(reverse('completed_bills'), params)
+            self.assertEqual([row['id'] for row in response.data['results']], [self.bill.pk], params)
+
+
+class AnalyticsQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = make_person()
+
+    def seed_bills(self, count):
+        for _ in range(count):
+            make_bill(self.staff, 'pending')
+            make_bill(self.staff, 'completed', modified_by=self.admin)
+            make_bill(self.staff, 'cancelled', modified_by=self.admin)
+            make_barcode(self.staff, self.admin)
+
+    def test_overview(self):
+        self.assertQueryBudget(11, self.seed_bills, lambda: self.client.get(
+            reverse('analytics_overview'), {'days': 30},
+        ))
+
+    def test_overview_matches_bills(self):
+        days = 7
+        today = timezone.localdate()
+
+        def local(day, hour, minute=0):
+            return timezone.make_aware(datetime.combine(today - timedelta(days=day), datetime.min.time()).replace(
+                hour=hour, minute=minute,
+            ))
+
+        # (status, days ago, local hour, minute, amount, material, destination, overdue)
+        specs = [
+            ('pending', 1, 12, 0, 100.0, 'gravel', 'Pokhara', True),
+            ('pending', 3, 9, 0, 250.0, 'roda', 'Butwal', False),
+            ('completed', 1, 15, 0, 400.0, 'gravel', 'Pokhara', False),
+            ('completed', 5, 8, 30, 75.5, 'chips', 'Pokhara', False),
+            ('cancelled', 2, 10, 0, 999.0, 'gravel', 'Butwal', False),
+            # First and last minute of the oldest day in the period
+            ('completed', days - 1, 0, 10, 60.0, 'roda', 'Dharan', False),
+            ('pending', days - 1, 23, 50, 40.0, 'gravel', 'Dharan', True),
+            # The previous period, and before it
+            ('completed', days, 23, 50, 500.0, 'gravel', 'Pokhara', False),
+            ('pending', 2 * days - 1, 12, 0, 500.0, 'gravel', 'Pokhara', True),
+            ('completed', 2 * days, 12, 0, 500.0, 'gravel', 'Pokhara', False),
+        ]
+        for bill_status, day, hour, minute, amount, material, destination, overdue in specs:
+            bill = make_bill(self.staff, bill_status, modified_by=self.admin)
+            Bill.objects.filter(pk=bill.pk).update(
+                date_issued=local(day, hour, minute), amount=amount, material=material, destination=destination,
+                eta=timezone.now() + timedelta(hours=-1 if overdue else 6),
+            )
+        # One more issued just now, counted today
+        make_bill(self.staff, 'pending')
+        rollups.rebuild()
+
+        response = self.client.get(reverse('analytics_overview'), {'days': days})
+        self.assertEqual(response.status_code, 200, response.content)
+
+        # The same numbers straight from the bills
+        start_day = today - timedelta(days=days - 1)
+        bills = [(bill, timezone.localtime(bill.date_issued).date()) for bill in Bill.objects.all()]
+        period = [bill for bill, day in bills if start_day <= day <= today]
+        counted = [bill for bill in period if bill.status != 'cancelled']
+        previous = [
+            bill for bill, day in bills
+            if start_day - timedelta(days=days) <= day < start_day and bill.status != 'cancelled'
+        ]
+
+        def by(key):
+            grouped = {}
+            for bill in counted:
+                count, revenue = grouped.get(key(bill), (0, 0))
+                grouped[key(bill)] = (count + 1, revenue + bill.amount)
+            return grouped
+
+        summary = response.data['summary']
+        self.assertEqual(len(counted), 7)
+        self.assertEqual(summary['total_bills'], len(counted))
+        self.assertEqual(summary['completed_bills'], sum(bill.status == 'completed' for bill in counted))
+        self.assertEqual(summary['pending_bills'], sum(bill.status == 'pending' for bill in counted))
+        self.assertEqual(summary['cancelled_bills'], sum(bill.status == 'cancelled' for bill in period))
+        self.assertEqual(summary['overdue_bills'], sum(
+            bill.status == 'pending' and bill.eta < timezone.now() for bill in period
+        ))
+        self.assertAlmostEqual(summary['total_revenue'], sum(bill.amount for bill in counted))
+        self.assertAlmostEqual(summary['completed_revenue'], sum(
+            bill.amount for bill in counted if bill.status == 'completed'
+        ))
+        self.assertEqual(len(previous), 2)
+        self.assertEqual(summary['growth_rate'], round((len(counted) - len(previous)) / len(previous) * 100, 2))
+
+        self.assertEqual(
+            [(row['date'], row['bills_count'], row['revenue']) for row in response.data['daily_trends']],
+            [
+                (day.isoformat(), count, revenue)
+                for day, (count, revenue) in sorted(by(lambda bill: timezone.localdate(bill.date_issued)).items())
+            ],
+        )
+        self.assertEqual(response.data['daily_trends'][0]['date'], start_day.isoformat())
+        self.assertEqual(
+            {row['material']: (row['count'], row['revenue']) for row in response.data['material_distribution']},
+            by(lambda bill: bill.material),
+        )
+        self.assertEqual(
+            {row['destination']: (row['count'], row['revenue']) for row in response.data['top_destinations']},
+            by(lambda bill: bill.destination),
+        )
+        self.assertEqual(response.data['date_range']['start'], timezone.make_aware(
+            datetime.combine(start_day, datetime.min.time())
+        ).isoformat())
+
+    def test_barcodes(self):
+        self.assertQueryBudget(5, self.seed_bills, lambda: self.client.get(reverse('analytics_barcodes')))
+
+    def test_performance(self):
+        # One of them reads the archive horizon, to know whether the period reaches the archive
+        self.assertQueryBudget(17, self.seed_bills, lambda: self.client.get(reverse('analytics_performance')))
+
+    def completed_after(self, *durations, **fields):
+        """Completed bills issued two days ago and closed ``durations`` hours later"""
+        issued = timezone.now() - timedelta(days=2)
+        for hours in durations:
+            bill = make_bill(self.staff, 'completed', modified_by=self.admin)
+            Bill.objects.filter(pk=bill.pk).update(
+                date_issued=issued, modified_date=issued + timedelta(hours=hours), **fields,
+            )
+
+    def test_performance_bucket_widths(self):
+        def histogram(response):
+            buckets = response.data['completion_times']['histogram']['buckets']
+            return [(bucket['start_hours'], bucket['count']) for bucket in buckets]
+
+        self.completed_after(1.5, 2.5, 30.5)
+        response = self.client.get(reverse('analytics_performance'), {'bucket_hours': 1})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(histogram(response), [(1, 1), (2, 1), (30, 1)])
+        response = self.client.get(reverse('analytics_performance'), {'bucket_hours': 24})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(histogram(response), [(0, 2), (24, 1)])
+        response = self.client.get(reverse('analytics_performance'), {'bucket_hours': 24, 'unread': 1})
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_performance_bad_bucket_hours(self):
+        for value in ('abc', 'nan', 'inf', '-inf', '0', '-1', '1e9', ''):
+            response = self.client.get(reverse('analytics_performance'), {'bucket_hours': value})
+            self.assertEqual(response.status_code, 400, value)
+            self.assertIn('bucket_hours', response.data['error'])
+
+    def test_completion_time_stats(self):
+        self.completed_after(1.5, 2.5, 3.5, 10.5)
+        self.completed_after(5, material='sand')
+        make_bill(self.staff, 'cancelled', modified_by=self.admin)
+        make_bill(self.staff, 'pending')
+
+        # SQLite has no percentile_cont: percentiles come from the streamed, sorted values_list
+        streamed = mock.patch.object(
+            completion_stats, '_streamed_percentiles', wraps=completion_stats._streamed_percentiles,
+        )
+        with streamed as streamed_percentiles, mock.patch.object(completion_stats, 'STREAM_CHUNK_SIZE', 1):
+            response = self.client.get(reverse('analytics_performance'))
+        self.assertTrue(streamed_percentiles.called)
+
+        times = response.data['completion_times']
+        # Sorted: 1.5, 2.5, 3.5, 5, 10.5 (percentile_cont interpolates between ranks)
+        self.assertEqual(times['overall'], {
+            'count': 5, 'mean_hours': 4.6, 'p50_hours': 3.5, 'p90_hours': 8.3, 'p99_hours': 10.28,
+        })
+        self.assertEqual(
+            [(bucket['start_hours'], bucket['count']) for bucket in times['histogram']['buckets']],
+            [(1, 1), (2, 1), (3, 1), (5, 1), (10, 1)],
+        )
+        self.assertEqual(times['breakdowns']['material'], [
+            {'material': 'gravel', 'count': 4, 'mean_hours': 4.5, 'p50_hours': 3.0, 'p90_hours': 8.4, 'p99_hours': 10.29},
+            {'material': 'sand', 'count': 1, 'mean_hours': 5.0, 'p50_hours': 5.0, 'p90_hours': 5.0, 'p99_hours': 5.0},
+        ])
+        self.assertEqual(response.data['performance_summary']['avg_completion_time_hours'], 4.6)
+
+    def test_dashboard(self):
+        self.assertQueryBudget(7, self.seed_bills, lambda: self.client.get(reverse('analytics_dashboard')))
+
+    def test_overview_not_modified(self):
+        self.seed_bills(2)
+        etag = self.client.get(reverse('analytics_overview'), {'days': 30})['ETag']
+        with self.assertNumQueries(2):  # the user behind the token and their person (the tenant)
+            response = self.client.get(reverse('analytics_overview'), {'days': 30}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('analytics_overview'), {'days': 7}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_stats(self):
+        self.assertQueryBudget(1, self.seed_bills, lambda: self.client.get(reverse('analytics_cache_stats')))
+
+    async def test_live_feed_sends_committed_writes(self):
+        bill = await sync_to_async(make_bill)(self.staff, 'pending')
+        subscriber = live.broker.subscribe()
+        try:
+            def scan():
+                with self.captureOnCommitCallbacks(execute=True):
+                    return self.client.post(reverse('scan'), {'code': bill.code}, format='json')
+
+            response = await sync_to_async(scan)()
+            self.assertEqual(response.status_code, 200)
+            while True:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=5)
+                if event['type'].startswith('bill.'):
+                    break
+            self.assertEqual((event['type'], event['bill']['id']), ('bill.completed', bill.pk))
+        finally:
+            live.broker.unsubscribe(subscriber)
+
+    def test_live_ticket(self):
+        ticket = self.client.post(reverse('analytics_live_ticket')).data['ticket']
+        self.assertEqual(async_to_sync(live.ticket_user)(ticket), self.admin.user)
+        self.assertIsNone(async_to_sync(live.ticket_user)(ticket + 'x'))
+        # A JWT in the query string does not open the stream
+        jwt = str(RefreshToken.for_user(self.admin.user).access_token)
+        response = APIClient().get(reverse('analytics_live'), {'token': jwt})
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,163 @@
+"""
+Status transitions for barcodes and bills.
+
+Every transition is a conditional UPDATE ... WHERE status = <expected>; the
+number of affected rows tells whether this writer won. A writer that raced
+another one (two scanners flipping the same active barcode, a scan and a
+cancel hitting the same bill) gets a TransitionError instead of silently
+overwriting the other's result, so no row lock or global serialization is
+needed. These UPDATEs send no model signals: closing a bill maintains the
+rollups, search document, change stamps, barcode counters, analytics cache and
+live feed itself.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from codes import counters
+from codes.models import Barcode
+
+from . import cache, changes, live, rollups, search
+from .models import Bill
+
+BARCODE_TRANSITIONS = {
+    'issued': ('active',),
+    'active': ('used', 'cancelled'),
+    'used': (),
+    'cancelled': (),
+}
+
+BILL_TRANSITIONS = {
+    'pending': ('completed', 'cancelled'),
+    'completed': (),
+    'cancelled': (),
+}
+
+# Barcode status that goes with each closed bill status
+BARCODE_STATUS_FOR = {
+    'completed': 'used',
+    'cancelled': 'cancelled',
+}
+
+
+class TransitionError(Exception):
+    """The requested transition is not allowed, or the row changed underneath us"""
+
+
+def check_transition(edges, current, target, label):
+    if target not in edges.get(current, ()):
+        raise TransitionError(f'{label} cannot move from {current} to {target}')
+
+
+def _compare_and_set(model, pks, expected, target, **values):
+    """UPDATE the rows of ``pks`` still in ``expected``; returns how many were updated"""
+    return model.objects.filter(pk__in=pks, status=expected).update(status=target, **values)
+
+
+def transition_barcode(barcode, target, **values):
+    """
+    Move one barcode from its current (in-memory) status to ``target``; call
+    it in a transaction, which its status counter update is part of
+    """
+    check_transition(BARCODE_TRANSITIONS, barcode.status, target, 'Barcode')
+    now = timezone.now()
+    previous = counters.barcode_state(barcode)
+    if not _compare_and_set(Barcode, [barcode.pk], barcode.status, target, updated_at=now, **values):
+        raise TransitionError(f'Barcode {barcode.code} is no longer {barcode.status}')
+    barcode.status = target
+    barcode.updated_at = now
+    for field, value in values.items():
+        setattr(barcode, field, value)
+    counters.record_changes([(previous, counters.barcode_state(barcode))])
+    return barcode
+
+
+def _close_rows(bills, barcodes, target, person, when):
+    """
+    Set-based close of ``bills`` and their ``barcodes``: one conditional
+    UPDATE per table. Returns False (after writing nothing that survives
+    the caller's savepoint) when any row was not in its expected state.
+    """
+    barcode_target = BARCODE_STATUS_FOR[target]
+    updated = _compare_and_set(
+        Bill, [bill.pk for bill in bills], 'pending', target,
+        modified_by=person, modified_date=when,
+    )
+    if updated != len(bills):
+        return False
+    updated = _compare_and_set(
+        Barcode, [barcode.pk for barcode in barcodes], 'active', barcode_target,
+        updated_at=timezone.now(),
+    )
+    return updated == len(barcodes)
+
+
+def close_bills(pairs, target, person, when=None):
+    """
+    Move pending bills to ``target`` (completed/cancelled) together with their
+    active barcodes. ``pairs`` is a list of (bill, barcode) read earlier.
+
+    All pairs are first closed with two set-based UPDATEs; if another writer
+    got to any of the rows in the meantime, that attempt is rolled back and the
+    pairs are retried one by one so only the contested ones fail.
+    Returns {bill pk: error message} for the pairs that could not be closed.
+    """
+    when = when or timezone.now()
+    for bill, barcode in pairs:
+        check_transition(BILL_TRANSITIONS, bill.status, target, 'Bill')
+        check_transition(BARCODE_TRANSITIONS, barcode.status, BARCODE_STATUS_FOR[target], 'Barcode')
+    previous = {bill.pk: rollups.loaded_state(bill) for bill, _ in pairs}
+
+    errors = {}
+    # No savepoint of its own when nested (a scan): the attempts below have
+    # theirs, and any other failure marks the enclosing transaction for rollback
+    with transaction.atomic(savepoint=False), changes.stamping() as stamps:
+        try:
+            with transaction.atomic():
+                if not _close_rows([bill for bill, _ in pairs], [barcode for _, barcode in pairs],
+                                   target, person, when):
+                    raise TransitionError('Concurrent update')
+            closed = pairs
+        except TransitionError:
+            closed = []
+            for bill, barcode in pairs:
+                try:
+                    with transaction.atomic():
+                        if not _close_rows([bill], [barcode], target, person, when):
+                            raise TransitionError(f'Bill {bill.code} was changed by another request')
+                except TransitionError as e:
+                    errors[bill.pk] = str(e)
+                else:
+                    closed.append((bill, barcode))
+
+        state_changes, barcode_changes = [], []
+        for bill, barcode in closed:
+            bill.status = target
+            bill.modified_by = person
+            bill.modified_date = when
+            barcode_previous = counters.barcode_state(barcode)
+            barcode.status = BARCODE_STATUS_FOR[target]
+            state_changes.append((previous[bill.pk], rollups.bill_state(bill)))
+            barcode_changes.append((barcode_previous, counters.barcode_state(barcode)))
+        if closed:
+            rollups.record_changes(state_changes)
+            counters.record_changes(barcode_changes)
+            # modified_by is part of the search document
+            search.index_bills([bill.pk for bill, _ in closed])
+            cache.bump_generation_on_commit()
+            for bill, _ in closed:
+                live.publish_bill_event(target, bill)
+            # Stamped when the outermost stamping block ends, after every
+            # other write of the transaction (see changes.py)
+            stamps.add([bill for bill, _ in closed])
+
+    for bill, _ in closed:
+        rollups.remember_state(bill)
+    return errors
+
+
+def close_bill(bill, barcode, target, person, when=None):
+    """Close a single bill and its barcode, raising TransitionError if it lost a race"""
+    errors = close_bills([(bill, barcode)], target, person, when)
+    if errors:
+        raise TransitionError(errors[bill.pk])
+    return bill
@@ -5,16 +5,23 @@ from . import analytics_views
 urlpatterns = [
     path('bills/', views.BillView.as_view(), name='bills'),
     path('bills/<int:pk>/', views.BillView.as_view(), name='bill_detail'),
+    path('bills/bulk-status/', views.BulkBillStatusView.as_view(), name='bulk_bill_status'),
     path('scan/', views.ScanView.as_view(), name='scan'),
+    path('scan/sync/', views.ScanSyncView.as_view(), name='scan_sync'),
+    path('scan/metrics/', views.scan_metrics, name='scan_metrics'),
     
     # Optimized bill endpoints by status
     path('bills/active/', views.get_active_bills, name='active_bills'),
     path('bills/completed/', views.get_completed_bills, name='completed_bills'),
     path('bills/cancelled/', views.get_cancelled_bills, name='cancelled_bills'),
+    path('bills/changes/', views.get_bill_changes, name='bill_changes'),
     
     # Analytics endpoints
     path('analytics/overview/', analytics_views.analytics_overview, name='analytics_overview'),
     path('analytics/barcodes/', analytics_views.analytics_barcodes, name='analytics_barcodes'),
     path('analytics/performance/', analytics_views.analytics_performance, name='analytics_performance'),
     path('analytics/dashboard/', analytics_views.analytics_dashboard, name='analytics_dashboard'),
+    path('analytics/live/', analytics_views.analytics_live, name='analytics_live'),
+    path('analytics/live/ticket/', analytics_views.analytics_live_ticket, name='analytics_live_ticket'),
+    path('analytics/cache/', analytics_views.analytics_cache_stats, name='analytics_cache_stats'),
 ]
@@ -1,13 +1,25 @@
+from datetime import datetime, timedelta
+
 from django.shortcuts import render
 from rest_framework.response import Response
 from rest_framework.views import APIView 
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q, Sum
+from rest_framework.exceptions import NotFound, ParseError
 from .models import Bill
-from codes.models import Barcode
-from .serializers import BillSerializer
+from .serializers import BillRowSerializer, BillSerializer
+from .pagination import KeysetPagination, use_keyset_pagination
+from .summary import parse_facets, summarize_bills
+from .search import search_bills
+from .scanning import MAX_SYNC_BATCH, SCAN_LATENCY_METRIC, process_scan, scan_outcome, sync_scans
+from .bulk import BULK_TARGET_STATUSES, MAX_BULK_TRANSITION, bulk_transition
+from .changes import changes_since, current_token
+from .archive import bills_for_range, bills_with_archive
+from .conditional import conditional_get
+from backend import metrics
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
 class CustomPagination(PageNumberPagination):
@@ -15,8 +27,16 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+
+def get_status_paginator(request):
+    """Page-number pagination by default, keyset pagination with ?pagination=cursor"""
+    if use_keyset_pagination(request):
+        return KeysetPagination()
+    return CustomPagination()
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get('active_bills')
 def get_active_bills(request):
     """Get all active (pending) bills for the user's enterprise - no pagination needed"""
     try:
@@ -28,18 +48,12 @@ def get_active_bills(request):
         # Apply search filter if provided
         search_query = request.GET.get('search', '').strip()
         if search_query:
-            queryset = queryset.filter(
-                Q(code__icontains=search_query) |
-                Q(vehicle_number__icontains=search_query) |
-                Q(destination__icontains=search_query) |
-                Q(material__icontains=search_query) |
-                Q(customer_name__icontains=search_query)
-            ).order_by('-date_issued')
+            queryset = search_bills(queryset, search_query).order_by('-search_rank', '-date_issued')
         
-        serializer = BillSerializer(queryset, many=True)
+        results = BillRowSerializer.serialize(BillRowSerializer.rows(queryset))
         return Response({
-            'results': serializer.data,
-            'count': queryset.count()
+            'results': results,
+            'count': len(results)
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -50,37 +64,34 @@ def get_active_bills(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get('completed_bills')
 def get_completed_bills(request):
     """Get paginated completed bills for the user's enterprise"""
     try:
         
-        # Get completed bills for the enterprise
-        queryset = Bill.objects.filter(
+        # Get completed bills for the enterprise, archived ones included
+        queryset = bills_with_archive().filter(
             status='completed'
         ).select_related('issued_by__user', 'modified_by__user').order_by('-modified_date')
         
         # Apply search filter if provided
         search_query = request.GET.get('search', '').strip()
         if search_query:
-            queryset = queryset.filter(
-                Q(code__icontains=search_query) |
-                Q(vehicle_number__icontains=search_query) |
-                Q(destination__icontains=search_query) |
-                Q(material__icontains=search_query) |
-                Q(customer_name__icontains=search_query)
-            ).order_by('-modified_date')
+            queryset = search_bills(queryset, search_query).order_by('-search_rank', '-modified_date')
         
-        # Apply pagination
-        paginator = CustomPagination()
-        paginated_bills = paginator.paginate_queryset(queryset, request)
+        # Apply pagination (cursor mode skips the COUNT(*) and OFFSET scan)
+        paginator = get_status_paginator(request)
+        rows = BillRowSerializer.rows(queryset)
+        paginated_bills = paginator.paginate_queryset(rows, request)
         
         if paginated_bills is not None:
-            serializer = BillSerializer(paginated_bills, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            return paginator.get_paginated_response(BillRowSerializer.serialize(paginated_bills))
         
-        serializer = BillSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(BillRowSerializer.serialize(rows), status=status.HTTP_200_OK)
         
+    except (NotFound, ParseError):
+        # Page out of range, malformed pagination cursor
+        raise
     except Exception as e:
         return Response(
             {'error': f'Failed to fetch completed bills: {str(e)}'}, 
@@ -89,62 +100,131 @@ def get_completed_bills(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get('cancelled_bills')
 def get_cancelled_bills(request):
     """Get paginated cancelled bills for the user's enterprise"""
     try:
         
-        # Get cancelled bills for the enterprise
-        queryset = Bill.objects.filter(
+        # Get cancelled bills for the enterprise, archived ones included
+        queryset = bills_with_archive().filter(
             status='cancelled'
         ).select_related('issued_by__user', 'modified_by__user').order_by('-modified_date')
         
         # Apply search filter if provided
         search_query = request.GET.get('search', '').strip()
         if search_query:
-            queryset = queryset.filter(
-                Q(code__icontains=search_query) |
-                Q(vehicle_number__icontains=search_query) |
-                Q(destination__icontains=search_query) |
-                Q(material__icontains=search_query) |
-                Q(customer_name__icontains=search_query)
-            ).order_by('-modified_date')
+            queryset = search_bills(queryset, search_query).order_by('-search_rank', '-modified_date')
         
-        # Apply pagination
-        paginator = CustomPagination()
-        paginated_bills = paginator.paginate_queryset(queryset, request)
+        # Apply pagination (cursor mode skips the COUNT(*) and OFFSET scan)
+        paginator = get_status_paginator(request)
+        rows = BillRowSerializer.rows(queryset)
+        paginated_bills = paginator.paginate_queryset(rows, request)
         
         if paginated_bills is not None:
-            serializer = BillSerializer(paginated_bills, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            return paginator.get_paginated_response(BillRowSerializer.serialize(paginated_bills))
         
-        serializer = BillSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(BillRowSerializer.serialize(rows), status=status.HTTP_200_OK)
         
+    except (NotFound, ParseError):
+        # Page out of range, malformed pagination cursor
+        raise
     except Exception as e:
         return Response(
             {'error': f'Failed to fetch cancelled bills: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('bill_changes')
+def get_bill_changes(request):
+    """
+    Bills created or changed after ?since=<token>, so clients can keep a list
+    current without reloading it. With ?status=, only bills now in that status
+    are returned and the ids of those that left it are listed under
+    'removed' (deleted and archived bills always are). Pass the returned
+    token as the next since; since=0 returns everything, with nothing
+    removed. Changes come in pages of about BILL_CHANGES_LIMIT rows: while
+    'has_more' is true, ask again right away with the new token.
+    """
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        since = -1
+    if since < 0:
+        return Response({"error": "since must be a token returned by this endpoint"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    status_filter = request.GET.get('status') or None
+    statuses = [value for value, _ in Bill._meta.get_field('status').choices]
+    if status_filter is not None and status_filter not in statuses:
+        return Response({"error": f"status must be one of: {', '.join(statuses)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    current = getattr(request, 'bill_change_token', None)
+    if current is None:
+        current = current_token()
+    if since > current:
+        # A token from another database (a restore, a reset counter) or made up:
+        # resuming from it would skip every change up to it
+        return Response({
+            "error": "since is ahead of this server's changes; reload the list and start again from since=0",
+            "resync": True,
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    changed, removed, token = changes_since(since, status_filter, token=current)
+    return Response({
+        'results': BillRowSerializer.serialize(BillRowSerializer.rows(changed)),
+        'removed': removed,
+        'token': token,
+        'has_more': token < current,
+    }, status=status.HTTP_200_OK)
+
+def _filter_day_range(queryset, field, start, end):
+    """
+    Filter ``field`` to the range ``start``..``end`` (either may be empty).
+    Dates are whole days in the current time zone, so the end date is
+    included up to midnight; datetimes are taken as they are (naive ones in
+    the current time zone). Raises ValueError for anything else.
+    """
+    for bound, value in (('start', start), ('end', end)):
+        if not value:
+            continue
+        try:
+            day = parse_date(value)
+            moment = None if day else parse_datetime(value)
+        except ValueError:
+            moment = day = None
+        if moment is None and day is None:
+            raise ValueError(f'Invalid {field} filter: {value!r}')
+        if moment is not None:
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            lookup = 'gte' if bound == 'start' else 'lte'
+        else:
+            if bound == 'end':
+                day += timedelta(days=1)
+            moment = timezone.make_aware(datetime(day.year, day.month, day.day))
+            lookup = 'gte' if bound == 'start' else 'lt'
+        queryset = queryset.filter(**{f'{field}__{lookup}': moment})
+    return queryset
+
+
 class BillView(APIView):
+    @method_decorator(conditional_get('bills'))
     def get(self, request):
-        # Start with base queryset - add enterprise filtering for security
-        queryset = Bill.objects.all(
+        # Start with base queryset - add enterprise filtering for security.
+        # Date ranges reaching back to archived bills read through to the archive
+        bills = bills_for_range(
+            date_issued=(request.GET.get('date_issued_from'), request.GET.get('date_issued_to')),
+            modified_date=(request.GET.get('date_modified_from'), request.GET.get('date_modified_to')),
+        )
+        queryset = bills.all(
         ).select_related('issued_by__user', 'modified_by__user').order_by('-date_issued')
         
         # Apply filters
         search_query = request.GET.get('search')
         if search_query:
-            queryset = queryset.filter(
-                Q(code__icontains=search_query) |
-                Q(vehicle_number__icontains=search_query) |
-                Q(destination__icontains=search_query) |
-                Q(material__icontains=search_query) |
-                Q(issue_location__icontains=search_query) |
-                Q(issued_by__user__name__icontains=search_query) |
-                Q(modified_by__user__name__icontains=search_query) |
-                Q(remark__icontains=search_query)
-            )
+            queryset = search_bills(queryset, search_query).order_by('-search_rank', '-date_issued')
         
         # Status filter
         status_filter = request.GET.get('status')
@@ -176,23 +256,14 @@ class BillView(APIView):
         if modified_by_filter:
             queryset = queryset.filter(modified_by__user__name__icontains=modified_by_filter)
         
-        # Date issued range
-        date_issued_from = request.GET.get('date_issued_from')
-        if date_issued_from:
-            queryset = queryset.filter(date_issued__gte=date_issued_from)
-        
-        date_issued_to = request.GET.get('date_issued_to')
-        if date_issued_to:
-            queryset = queryset.filter(date_issued__lte=date_issued_to + ' 23:59:59')
-        
-        # Date modified range
-        date_modified_from = request.GET.get('date_modified_from')
-        if date_modified_from:
-            queryset = queryset.filter(modified_date__gte=date_modified_from)
-        
-        date_modified_to = request.GET.get('date_modified_to')
-        if date_modified_to:
-            queryset = queryset.filter(modified_date__lte=date_modified_to + ' 23:59:59')
+        # Date issued and date modified ranges, whole local days
+        try:
+            queryset = _filter_day_range(queryset, 'date_issued',
+                                        request.GET.get('date_issued_from'), request.GET.get('date_issued_to'))
+            queryset = _filter_day_range(queryset, 'modified_date',
+                                        request.GET.get('date_modified_from'), request.GET.get('date_modified_to'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         # Amount range
         amount_from = request.GET.get('amount_from')
@@ -203,48 +274,26 @@ class BillView(APIView):
         if amount_to:
             queryset = queryset.filter(amount__lte=amount_to)
         
-        # Return all results without pagination, including totals
-        serializer = BillSerializer(queryset, many=True)
-        
-        # Calculate totals
-        pending_total = queryset.filter(status='pending').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        completed_total = queryset.filter(status='completed').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        cancelled_total = queryset.filter(status='cancelled').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
+        try:
+            facets = parse_facets(request.GET.get('facets'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        grand_total = pending_total + completed_total
+        # Return all results without pagination, including totals
+        results = BillRowSerializer.serialize(BillRowSerializer.rows(queryset))
         
-        # Count by status
-        status_counts = {
-            'pending': queryset.filter(status='pending').count(),
-            'completed': queryset.filter(status='completed').count(),
-            'cancelled': queryset.filter(status='cancelled').count(),
-        }
+        # Status counts, totals and optional facets in one grouped query
+        summary = summarize_bills(queryset, facets=facets)
         
         return Response({
-            'results': serializer.data,
-            'count': queryset.count(),
-            'totals': {
-                'pending_total': pending_total,
-                'completed_total': completed_total,
-                'cancelled_total': cancelled_total,
-                'grand_total': grand_total,
-            },
-            'status_counts': status_counts,
+            'results': results,
+            **summary,
         }, status=status.HTTP_200_OK)
 
     def post(self, request):
         person = request.user.person
         if person:
             request.data['issued_by'] = person
-        print(request.data)
         serializer = BillSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
@@ -252,7 +301,6 @@ class BillView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     def patch(self, request, pk):
-        print(request.data)
         try:
             bill = Bill.objects.get(pk=pk)
         except Bill.DoesNotExist:
@@ -268,28 +316,93 @@ class BillView(APIView):
 
 
 
+class BulkBillStatusView(APIView):
+    """Complete or cancel many pending bills in one request"""
+
+    def post(self, request):
+        target_status = request.data.get('status')
+        if target_status not in BULK_TARGET_STATUSES:
+            return Response(
+                {"error": f"status must be one of: {', '.join(BULK_TARGET_STATUSES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        ids = request.data.get('ids')
+        codes = request.data.get('codes')
+        if (ids is None) == (codes is None):
+            return Response({"error": "Provide either ids or codes"}, status=status.HTTP_400_BAD_REQUEST)
+        identifiers = ids if ids is not None else codes
+        if not isinstance(identifiers, list) or not identifiers:
+            return Response({"error": "ids/codes must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(identifiers) > MAX_BULK_TRANSITION:
+            return Response(
+                {"error": f"At most {MAX_BULK_TRANSITION} bills can be updated at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            if ids is not None:
+                ids = [int(pk) for pk in ids]
+            else:
+                codes = [str(code) for code in codes]
+        except (TypeError, ValueError):
+            return Response({"error": "ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        outcomes = bulk_transition(target_status, request.user.person, ids=ids, codes=codes)
+        updated = sum(1 for outcome in outcomes if outcome['ok'])
+        return Response({
+            'results': outcomes,
+            'updated': updated,
+            'failed': len(outcomes) - updated,
+        }, status=status.HTTP_200_OK)
+
+
 class ScanView(APIView):
     def post(self, request):
-        code = request.data.get('code')
-        if not code:
-            return Response({"error": "Code is required"}, status=status.HTTP_400_BAD_REQUEST)
+        with metrics.timed(SCAN_LATENCY_METRIC) as timer:
+            status_code, payload = process_scan(request.data.get('code'), request.user.person)
+            timer['label'] = scan_outcome(status_code)
+        return Response(payload, status=status_code)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def scan_metrics(request):
+    """
+    Scan latency per outcome (p50/p95/p99 in ms) for this worker process
+    """
+    return Response({
+        'latency': metrics.snapshot(SCAN_LATENCY_METRIC),
+    }, status=status.HTTP_200_OK)
+
+
+class ScanSyncView(APIView):
+    """Flush a device's offline scan queue in one request"""
+
+    def post(self, request):
+        scans = request.data.get('scans')
+        if not isinstance(scans, list) or not scans:
+            return Response({"error": "scans must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(scans) > MAX_SYNC_BATCH:
+            return Response(
+                {"error": f"At most {MAX_SYNC_BATCH} scans can be synced at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        for scan in scans:
+            if not isinstance(scan, dict) or not scan.get('key') or not scan.get('code'):
+                return Response(
+                    {"error": "Every scan needs a key and a code"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if len(str(scan['key'])) > 100:
+                return Response({"error": "Scan keys are limited to 100 characters"}, status=status.HTTP_400_BAD_REQUEST)
 
-        barcode = Barcode.objects.filter(code=code).first()
-        if not barcode:
-            return Response({"error": "Barcode not found"}, status=status.HTTP_404_NOT_FOUND)
-        if barcode and barcode.status != 'active':
-            return Response({"error": "Barcode is not active"}, status=status.HTTP_400_BAD_REQUEST)
-        bill = Bill.objects.filter(code=code).first()
-        if not bill:
-            return Response({"error": "Bill not found for this barcode"}, status=status.HTTP_404_NOT_FOUND)
-        if bill:
-            if bill.status == 'pending':
-                bill.status = 'completed'
-                bill.modified_by = request.user.person
-                bill.modified_date = timezone.now()
-                bill.save()
-                barcode.status = 'used'
-                barcode.save()
-                return Response({"message": "Bill completed successfully"}, status=status.HTTP_200_OK)
-            elif status == 'completed':
-                return Response({"error": "Bill is already completed"}, status=status.HTTP_400_BAD_REQUEST)
+        scans = [
+            {'key': str(scan['key']), 'code': str(scan['code']), 'scanned_at': scan.get('scanned_at')}
+            for scan in scans
+        ]
+        results = sync_scans(scans, request.user.person)
+        return Response({
+            'results': results,
+            'processed': sum(1 for result in results if not result['replayed']),
+            'replayed': sum(1 for result in results if result['replayed']),
+        }, status=status.HTTP_200_OK)
@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Barcode
+from .models import Barcode, BarcodeIssueJob
 
 # Register your models here.
 
-admin.site.register(Barcode)
\ No newline at end of file
+admin.site.register(Barcode)
+admin.site.register(BarcodeIssueJob)
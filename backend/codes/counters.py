@@ -0,0 +1,116 @@
+"""
+Transactionally maintained barcode counters for the barcode analytics.
+
+Every barcode contributes one to exactly one BarcodeStatusCounter row, chosen
+by its assignee, status and whether it is linked to a bill. Each write to
+barcodes moves those contributions in the same transaction: bulk issuing
+(codes/issuance.py), activation and closing (bills/transitions.py) and,
+through signals, single saves and deletes. Generated data (bills/datagen.py)
+is reconciled afterwards instead. The summary is then one grouped read of a
+table sized by assignees rather than by every code ever issued.
+
+Deltas are applied with a single upsert per write (INSERT ... ON CONFLICT DO
+UPDATE, PostgreSQL and SQLite 3.24+), so the number of queries does not
+depend on whether the counter rows exist yet.
+"""
+from collections import Counter
+
+from django.db import connections, router, transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Barcode, BarcodeStatusCounter
+
+STATUSES = [value for value, _ in Barcode._meta.get_field('status').choices]
+
+# Counter rows per upsert statement (4 parameters each; SQLite allows 999)
+UPSERT_BATCH_SIZE = 200
+
+
+def barcode_state(barcode):
+    """The counter key of a barcode, from a model instance"""
+    return (barcode.assigned_to_id, barcode.status, barcode.associated_bill_id is not None)
+
+
+def _upsert(deltas, using):
+    """Add each delta of {key: delta} to its counter row, creating missing rows"""
+    connection = connections[using]
+    table = connection.ops.quote_name(BarcodeStatusCounter._meta.db_table)
+    # Sorted, so concurrent writers lock the rows in the same order
+    keys = sorted(key for key, delta in deltas.items() if delta)
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+            batch = keys[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} (assigned_to_id, status, associated, count) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (assigned_to_id, status, associated) '
+                f'DO UPDATE SET count = {table}.count + excluded.count',
+                [value for key in batch for value in (*key, deltas[key])],
+            )
+
+
+def record_changes(changes, using=None):
+    """
+    Apply many (previous, current) barcode states at once; None stands for
+    a barcode that did not exist before / no longer exists.
+    """
+    deltas = Counter()
+    for previous, current in changes:
+        if previous == current:
+            continue
+        if previous is not None:
+            deltas[previous] -= 1
+        if current is not None:
+            deltas[current] += 1
+    _upsert(deltas, using or router.db_for_write(BarcodeStatusCounter))
+
+
+def record_created(barcodes, using=None):
+    """Count barcodes inserted without signals (bulk_create)"""
+    record_changes([(None, barcode_state(barcode)) for barcode in barcodes], using)
+
+
+def summary():
+    """
+    Barcode totals in one read: {'total', 'associated', 'by_status': {status:
+    count}}, every status present
+    """
+    by_status = dict.fromkeys(STATUSES, 0)
+    total = associated = 0
+    rows = BarcodeStatusCounter.objects.values('status', 'associated').annotate(count=Sum('count')).order_by()
+    for row in rows:
+        by_status[row['status']] = by_status.get(row['status'], 0) + row['count']
+        total += row['count']
+        if row['associated']:
+            associated += row['count']
+    return {'total': total, 'associated': associated, 'by_status': by_status}
+
+
+def reconcile():
+    """Recompute every counter from the Barcode table. Returns the number of counter rows written."""
+    using = router.db_for_write(BarcodeStatusCounter)
+    with transaction.atomic(using=using):
+        # Writers wait for the new counters before applying their deltas; on
+        # SQLite the DELETE takes the database write lock
+        if connections[using].vendor == 'postgresql':
+            with connections[using].cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {BarcodeStatusCounter._meta.db_table} IN EXCLUSIVE MODE')
+        BarcodeStatusCounter.objects.using(using).all().delete()
+        counters = _count_barcodes(using)
+        BarcodeStatusCounter.objects.using(using).bulk_create(counters, batch_size=1000)
+    return len(counters)
+
+
+def _count_barcodes(using):
+    rows = Barcode.objects.using(using).values('assigned_to', 'status').annotate(
+        linked=Count('id', filter=Q(associated_bill__isnull=False)),
+        unlinked=Count('id', filter=Q(associated_bill__isnull=True)),
+    ).order_by()
+    counters = []
+    for row in rows.iterator():
+        for associated, count in ((True, row['linked']), (False, row['unlinked'])):
+            if count:
+                counters.append(BarcodeStatusCounter(
+                    assigned_to_id=row['assigned_to'], status=row['status'], associated=associated, count=count,
+                ))
+    return counters
@@ -0,0 +1,198 @@
+"""
+Issuing numeric barcode ranges.
+
+The range is walked in batches: each batch looks up which of its codes already
+exist (an index lookup bounded by the batch, never the whole table) and inserts
+the rest with one bulk_create. Results are reported as runs of consecutive
+codes instead of one entry per code. Ranges above
+BARCODE_BACKGROUND_ISSUE_THRESHOLD run as a tracked BarcodeIssueJob.
+
+Jobs run on a thread of the process that accepted them and die with it. The
+thread records a heartbeat with every batch; a queued or running job without
+one for BARCODE_ISSUE_JOB_STALE_SECONDS is marked failed, when it is polled
+or by `manage.py expire_issue_jobs`. Issuing the range again finishes it:
+the codes already created are skipped.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import counters
+from .models import Barcode, BarcodeIssueJob
+
+logger = logging.getLogger(__name__)
+
+CODE_WIDTH = 6
+ISSUE_BATCH_SIZE = 5000
+
+
+def background_threshold():
+    return getattr(settings, 'BARCODE_BACKGROUND_ISSUE_THRESHOLD', 50000)
+
+
+def stale_after():
+    return timedelta(seconds=getattr(settings, 'BARCODE_ISSUE_JOB_STALE_SECONDS', 300))
+
+
+def format_code(number):
+    return str(number).zfill(CODE_WIDTH)
+
+
+def _extend_ranges(ranges, number):
+    """Append ``number`` to a list of [first, last] runs"""
+    if ranges and ranges[-1][1] == number - 1:
+        ranges[-1][1] = number
+    else:
+        ranges.append([number, number])
+
+
+def format_ranges(ranges):
+    return [
+        {'from': format_code(first), 'to': format_code(last), 'count': last - first + 1}
+        for first, last in ranges
+    ]
+
+
+def issue_range(lowerbound, upperbound, assigned_to, assigned_by, batch_size=ISSUE_BATCH_SIZE, on_progress=None):
+    """
+    Create the missing barcodes in [lowerbound, upperbound] for ``assigned_to``.
+    Returns a summary dict with counts and the issued/skipped runs.
+    ``on_progress(summary)`` is called after every committed batch.
+    """
+    issued, skipped = [], []
+    summary = {'processed_count': 0, 'issued_count': 0, 'skipped_count': 0}
+    assigned_at = timezone.now()
+
+    for batch_start in range(lowerbound, upperbound + 1, batch_size):
+        numbers = range(batch_start, min(batch_start + batch_size - 1, upperbound) + 1)
+        codes = [format_code(number) for number in numbers]
+        with transaction.atomic():
+            existing = set(Barcode.objects.filter(code__in=codes).values_list('code', flat=True))
+            new_barcodes = []
+            for number, code in zip(numbers, codes):
+                if code in existing:
+                    _extend_ranges(skipped, number)
+                else:
+                    _extend_ranges(issued, number)
+                    new_barcodes.append(Barcode(
+                        code=code,
+                        assigned_to=assigned_to,
+                        assigned_by=assigned_by,
+                        assigned_at=assigned_at,
+                    ))
+            Barcode.objects.bulk_create(new_barcodes, batch_size=batch_size)
+            # bulk_create sends no signals: count the new barcodes in their transaction
+            counters.record_created(new_barcodes)
+
+        summary['processed_count'] += len(codes)
+        summary['issued_count'] += len(new_barcodes)
+        summary['skipped_count'] += len(existing)
+        if on_progress:
+            on_progress(summary)
+
+    if summary['issued_count']:
+        # bulk_create sends no post_save, so invalidate cached analytics here
+        from bills.cache import bump_generation_on_commit
+        bump_generation_on_commit()
+
+    summary['issued_ranges'] = format_ranges(issued)
+    summary['skipped_ranges'] = format_ranges(skipped)
+    return summary
+
+
+def run_issue_job(job_id):
+    """Process a BarcodeIssueJob, recording progress after every batch"""
+    job = BarcodeIssueJob.objects.select_related('assigned_to', 'assigned_by').get(pk=job_id)
+    BarcodeIssueJob.objects.filter(pk=job_id).update(status='running', heartbeat_at=timezone.now())
+
+    def record_progress(summary):
+        BarcodeIssueJob.objects.filter(pk=job_id).update(
+            processed_count=summary['processed_count'],
+            issued_count=summary['issued_count'],
+            skipped_count=summary['skipped_count'],
+            heartbeat_at=timezone.now(),
+        )
+
+    try:
+        summary = issue_range(
+            job.lowerbound, job.upperbound, job.assigned_to, job.assigned_by,
+            on_progress=record_progress,
+        )
+    except Exception as e:
+        logger.exception('Barcode issue job %s failed', job_id)
+        BarcodeIssueJob.objects.filter(pk=job_id).update(
+            status='failed', error=str(e), finished_at=timezone.now(),
+        )
+        return
+    BarcodeIssueJob.objects.filter(pk=job_id).update(
+        status='completed',
+        issued_ranges=summary['issued_ranges'],
+        skipped_ranges=summary['skipped_ranges'],
+        finished_at=timezone.now(),
+    )
+
+
+def _run_in_thread(job_id):
+    try:
+        run_issue_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def start_issue_job(lowerbound, upperbound, assigned_to, assigned_by):
+    """Queue a background issue job; the worker thread starts once the job row is committed"""
+    job = BarcodeIssueJob.objects.create(
+        lowerbound=lowerbound,
+        upperbound=upperbound,
+        assigned_to=assigned_to,
+        assigned_by=assigned_by,
+    )
+    thread = threading.Thread(target=_run_in_thread, args=(job.pk,), daemon=True)
+    transaction.on_commit(thread.start)
+    return job
+
+
+def is_stale(job, now=None):
+    """Whether ``job`` is unfinished and its thread has not been heard from for too long"""
+    if job.status not in ('queued', 'running'):
+        return False
+    return (job.heartbeat_at or job.created_at) < (now or timezone.now()) - stale_after()
+
+
+def expire_stale_jobs(now=None, **filters):
+    """Mark the stale jobs (optionally narrowed by ``filters``) failed; returns how many"""
+    now = now or timezone.now()
+    cutoff = now - stale_after()
+    return BarcodeIssueJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, created_at__lt=cutoff),
+        status__in=('queued', 'running'), **filters,
+    ).update(
+        status='failed',
+        error='The job was interrupted. Issue the range again to finish it; codes already issued are skipped.',
+        finished_at=now,
+    )
+
+
+def serialize_job(job):
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'lowerbound': format_code(job.lowerbound),
+        'upperbound': format_code(job.upperbound),
+        'total_count': job.total_count,
+        'processed_count': job.processed_count,
+        'issued_count': job.issued_count,
+        'skipped_count': job.skipped_count,
+        'progress': job.progress,
+        'issued_ranges': job.issued_ranges,
+        'skipped_ranges': job.skipped_ranges,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from codes.issuance import expire_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Mark barcode issue jobs whose worker stopped (no progress for BARCODE_ISSUE_JOB_STALE_SECONDS) failed'
+
+    def handle(self, *args, **options):
+        expired = expire_stale_jobs()
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} stale barcode issue jobs'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from codes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the barcode status counters from the Barcode table'
+
+    def handle(self, *args, **options):
+        written = reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} barcode counter rows'))
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from enterprise.models import Person
 
@@ -17,9 +17,16 @@ class Barcode(models.Model):
     assigned_to = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name="assigned_barcodes")
     assigned_at = models.DateTimeField( default=timezone.now)
     assigned_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name="assigned_barcodes_by")
-    associated_bill = models.ForeignKey('bills.Bill', on_delete=models.CASCADE, related_name='barcodes', null=True, blank=True)
+    # No database constraint: an archived bill keeps its id (see bills/archive.py)
+    associated_bill = models.ForeignKey('bills.Bill', on_delete=models.CASCADE, related_name='barcodes', null=True, blank=True,
+                                        db_constraint=False)
     def __str__(self):
         return f"Code: {self.code}, Status: {self.status}"
+
+    def save(self, *args, **kwargs):
+        # The save and its status counter update (codes/signals.py) in one transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
     
     class Meta:
         indexes = [
@@ -29,6 +36,68 @@ class Barcode(models.Model):
         ]
 
 
+class BarcodeStatusCounter(models.Model):
+    """
+    Number of barcodes per assignee, status and whether they are linked to a
+    bill, kept up to date by codes/counters.py in the transaction of every
+    barcode write; recompute with `manage.py reconcile_barcode_counters`.
+    """
+    # No constraint and DO_NOTHING: the assignee's barcodes may be deleted
+    # (and uncounted) after the person is
+    assigned_to = models.ForeignKey('enterprise.Person', on_delete=models.DO_NOTHING, related_name='+',
+                                    db_constraint=False)
+    status = models.CharField(max_length=20)
+    associated = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['assigned_to', 'status', 'associated'],
+                name='unique_barcode_status_counter',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.assigned_to_id} {self.status}: {self.count} barcodes"
+
+
+class BarcodeIssueJob(models.Model):
+    """Progress of a large barcode range being issued in the background"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    lowerbound = models.PositiveIntegerField()
+    upperbound = models.PositiveIntegerField()
+    assigned_to = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name='barcode_issue_jobs')
+    assigned_by = models.ForeignKey('enterprise.Person', on_delete=models.CASCADE, related_name='barcode_issue_jobs_started')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    processed_count = models.PositiveIntegerField(default=0)
+    issued_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    issued_ranges = models.JSONField(default=list, blank=True)
+    skipped_ranges = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last sign of life from the thread running the job (see codes/issuance.py)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Issue job {self.pk}: {self.lowerbound}-{self.upperbound} ({self.status})"
+
+    @property
+    def total_count(self):
+        return self.upperbound - self.lowerbound + 1
+
+    @property
+    def progress(self):
+        return round(self.processed_count / self.total_count * 100, 2) if self.total_count else 100.0
+
+
 # class Assignment(models.Model):
 #     barcode_from = models.IntegerField()
 #     barcode_to = models.IntegerField()
@@ -0,0 +1,36 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters
+from .models import Barcode
+
+COUNTED_FIELDS = {'assigned_to', 'assigned_to_id', 'status', 'associated_bill', 'associated_bill_id'}
+
+
+@receiver(pre_save, sender=Barcode)
+def remember_counter_state(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not (set(update_fields) & COUNTED_FIELDS):
+        return
+    row = sender.objects.filter(pk=instance.pk).values('assigned_to_id', 'status', 'associated_bill_id').first()
+    instance._counter_previous = (
+        (row['assigned_to_id'], row['status'], row['associated_bill_id'] is not None) if row else None
+    )
+
+
+@receiver(post_save, sender=Barcode)
+def update_counters(sender, instance, created, raw=False, using=None, **kwargs):
+    """Move the barcode between status counters"""
+    if raw:
+        return
+    if created:
+        counters.record_changes([(None, counters.barcode_state(instance))], using)
+    elif hasattr(instance, '_counter_previous'):
+        counters.record_changes([(instance._counter_previous, counters.barcode_state(instance))], using)
+        del instance._counter_previous
+
+
+@receiver(post_delete, sender=Barcode)
+def remove_from_counters(sender, instance, using=None, **kwargs):
+    counters.record_changes([(counters.barcode_state(instance), None)], using)
@@ -1,3 +1,97 @@
-from django.test import TestCase
+from datetime import timedelta
+from itertools import count
 
-# Create your tests here.
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from backend.testing import QueryBudgetTestCase, make_barcode, make_bill, make_person
+
+from . import counters
+from .issuance import expire_stale_jobs, stale_after
+from .models import Barcode, BarcodeIssueJob
+
+
+class BarcodeQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = make_person()
+
+    def seed_barcodes(self, count):
+        # Several holders, so a per-row lookup of the assignee would show up
+        for _ in range(count):
+            make_barcode(make_person(), self.admin)
+
+    def test_issued_barcodes(self):
+        self.assertQueryBudget(4, self.seed_barcodes, lambda: self.client.get(reverse('issue_barcode')))
+
+    def test_issued_barcodes_filtered(self):
+        self.assertQueryBudget(4, self.seed_barcodes, lambda: self.client.get(
+            reverse('issue_barcode'), {'status': 'issued', 'search': 'QB'},
+        ))
+
+    def test_issue_range(self):
+        ranges = count(start=900000, step=100)
+
+        def issue():
+            lowerbound = next(ranges)
+            return self.client.post(reverse('issue_barcode'), {
+                'lowerbound': lowerbound,
+                'upperbound': lowerbound + 9,
+                'assigned_to': self.staff.pk,
+            }, format='json')
+
+        self.assertQueryBudget(8, self.seed_barcodes, issue, status_code=201)
+
+    def test_issue_job(self):
+        job = BarcodeIssueJob.objects.create(
+            lowerbound=1, upperbound=10, assigned_to=self.staff, assigned_by=self.admin,
+        )
+        self.assertQueryBudget(3, self.seed_barcodes, lambda: self.client.get(
+            reverse('barcode_issue_job', args=[job.pk]),
+        ))
+
+    def test_stale_issue_job_fails(self):
+        job = BarcodeIssueJob.objects.create(
+            lowerbound=1, upperbound=10, assigned_to=self.staff, assigned_by=self.admin,
+        )
+        response = self.client.get(reverse('barcode_issue_job', args=[job.pk]))
+        self.assertEqual(response.data['job']['status'], 'queued')
+
+        BarcodeIssueJob.objects.filter(pk=job.pk).update(
+            status='running', heartbeat_at=timezone.now() - stale_after() - timedelta(seconds=1),
+        )
+        response = self.client.get(reverse('barcode_issue_job', args=[job.pk]))
+        self.assertEqual(response.data['job']['status'], 'failed')
+        self.assertTrue(response.data['job']['finished_at'])
+        self.assertEqual(expire_stale_jobs(), 0)
+
+    def test_counters_follow_writes(self):
+        self.seed_barcodes(3)
+        scanned = make_bill(self.staff, 'pending')
+        cancelled = make_bill(self.staff, 'pending')
+        deleted = make_bill(self.staff, 'completed')
+        response = self.client.post(reverse('issue_barcode'), {
+            'lowerbound': 900000, 'upperbound': 900009, 'assigned_to': self.staff.pk,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        response = self.client.post(reverse('scan'), {'code': scanned.code}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('bulk_bill_status'), {
+                'ids': [cancelled.pk], 'status': 'cancelled',
+            }, format='json')
+        self.assertTrue(response.data['results'][0]['ok'], response.content)
+        deleted.delete()
+
+        # The counter upsert comes before the change stamp, which is taken last
+        statements = [query['sql'] for query in queries.captured_queries]
+        upsert = next(i for i, sql in enumerate(statements) if sql.startswith('INSERT INTO "codes_barcodestatuscounter"'))
+        stamp = next(i for i, sql in enumerate(statements) if sql.startswith('UPDATE "bills_billchangecounter"'))
+        self.assertLess(upsert, stamp)
+
+        maintained = counters.summary()
+        self.assertEqual(maintained['total'], Barcode.objects.count())
+        counters.reconcile()
+        self.assertEqual(counters.summary(), maintained)
@@ -4,4 +4,5 @@ from . import views
 urlpatterns = [
     # path('persons/',views.PersonView.as_view(),name='persons')
     path('issue-barcode/', views.IssueBarcodeView.as_view(), name='issue_barcode'),
+    path('issue-barcode/jobs/<int:pk>/', views.BarcodeIssueJobView.as_view(), name='barcode_issue_job'),
 ]
\ No newline at end of file
@@ -5,7 +5,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import permission_classes
 from rest_framework.pagination import PageNumberPagination
 import random
-from .models import Barcode
+from .models import Barcode, BarcodeIssueJob
+from .issuance import (
+    background_threshold, expire_stale_jobs, is_stale, issue_range, serialize_job, start_issue_job,
+)
 from enterprise.models import Person
 # Create your views here.
 
@@ -18,7 +21,7 @@ class IssueBarcodeView(APIView):
         
         # Start with base queryset
         queryset = Barcode.objects.filter(
-        ).select_related('assigned_to', 'assigned_by').order_by('code')
+        ).select_related('assigned_to__user', 'assigned_by__user').order_by('code')
         
         # Filter by assigned_to if provided
         assigned_to_filter = request.GET.get('assigned_to')
@@ -73,23 +76,39 @@ class IssueBarcodeView(APIView):
         if not lowerbound or not upperbound:
             return Response({'error': 'Lowerbound and upperbound are required.'}, status=400)
 
+        try:
+            lowerbound, upperbound = int(lowerbound), int(upperbound)
+        except (TypeError, ValueError):
+            return Response({'error': 'Lowerbound and upperbound must be numbers.'}, status=400)
+        if lowerbound < 0 or upperbound < lowerbound:
+            return Response({'error': 'Upperbound must not be smaller than lowerbound.'}, status=400)
+
         assigned_by = person
         assigned_to_id = request.data.get('assigned_to')
         assigned_to = Person.objects.get(user=assigned_to_id)
-        # person = Person.objects.get(id=assigned_to_id)
-        existing_codes = set(Barcode.objects.values_list('code', flat=True))
-        # collect new codes in order
-        new_codes_list = []
-        for code in range(lowerbound, upperbound + 1):
-            code_str = str(code).zfill(6)
-            if code_str not in existing_codes:
-                new_codes_list.append(code_str)
-        if not new_codes_list:
+
+        # Very large ranges are issued by a background job the client can poll
+        if upperbound - lowerbound + 1 > background_threshold():
+            job = start_issue_job(lowerbound, upperbound, assigned_to, assigned_by)
+            return Response({'job': serialize_job(job)}, status=202)
+
+        summary = issue_range(lowerbound, upperbound, assigned_to, assigned_by)
+        if not summary['issued_count']:
             return Response({'error': 'No new barcodes to issue.'}, status=400)
-        issued_codes = []
-        # create barcodes one by one to preserve order
-        for code_str in new_codes_list:
-            Barcode.objects.create(code=code_str, assigned_to=assigned_to, assigned_by=assigned_by)
-            issued_codes.append(code_str)
-        return Response({'issued_codes': issued_codes}, status=201)
+        return Response(summary, status=201)
+
+
+class BarcodeIssueJobView(APIView):
+    permission_classes = [IsAuthenticated]
 
+    def get(self, request, pk):
+        if request.user.person.role != 'Admin':
+            return Response({'error': 'You do not have permission to view issue jobs.'}, status=403)
+        try:
+            job = BarcodeIssueJob.objects.get(pk=pk)
+        except BarcodeIssueJob.DoesNotExist:
+            return Response({'error': 'Issue job not found.'}, status=404)
+        # Its thread may have died with the process that ran it
+        if is_stale(job) and expire_stale_jobs(pk=job.pk):
+            job.refresh_from_db()
+        return Response({'job': serialize_job(job)})
@@ -8,6 +8,9 @@ python manage.py makemigrations bills codes enterprise userauth --noinput
 echo "===> Running migrations..."
 python manage.py migrate --noinput
 
+echo "===> Expiring interrupted barcode issue jobs..."
+python manage.py expire_issue_jobs
+
 # 2. (Optional) Re-collect static files if anything changed
 echo "===> Collecting static files..."
 python manage.py collectstatic --noinput
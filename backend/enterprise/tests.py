@@ -1,3 +1,18 @@
-from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from backend.testing import QueryBudgetTestCase, make_location, make_person
+
+
+class PersonQueryBudgetTests(QueryBudgetTestCase):
+    def seed_people(self, count):
+        for _ in range(count):
+            make_person(location=make_location())
+
+    def test_persons(self):
+        self.assertQueryBudget(3, self.seed_people, lambda: self.client.get(reverse('persons')))
+
+    def test_role(self):
+        self.assertQueryBudget(2, self.seed_people, lambda: self.client.get(reverse('user_role')))
+
+    def test_profile(self):
+        self.assertQueryBudget(3, self.seed_people, lambda: self.client.get(reverse('user_profile')))
@@ -16,7 +16,7 @@ class PersonView(APIView):
         if user.person.role != 'Admin':
             return Response({'error': 'You do not have permission to view this resource.'}, status=403)
         # Get all persons in the same enterprise
-        persons = Person.objects.all()
+        persons = Person.objects.select_related('user')
         serializer = PersonSerializer(persons, many=True)
         return Response(serializer.data)
 
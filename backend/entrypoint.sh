@@ -7,12 +7,15 @@ python manage.py makemigrations --noinput userauth bills codes enterprise
 # Run migrations
 python manage.py migrate --noinput
 
+# Fail barcode issue jobs whose worker died with a previous container
+python manage.py expire_issue_jobs
+
 # Collect static files
 python manage.py collectstatic --noinput
 
 # Start the application
 if [ "$1" = "gunicorn" ]; then
-    exec gunicorn backend.wsgi:application --bind 0.0.0.0:8000
+    exec gunicorn -c gunicorn.conf.py
 else
     exec python manage.py runserver 0.0.0.0:8000
 fi
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""
+Gunicorn settings, picked by GUNICORN_PROFILE:
+
+  asgi    uvicorn workers running backend.asgi (default; needed by the
+          live dashboard feed)
+  gevent  gevent workers running backend.wsgi with cooperative psycopg2; pair
+          it with DB_POOL=1 so each worker shares a bounded connection pool
+          among its greenlets
+  sync    plain sync workers running backend.wsgi
+"""
+import os
+
+profile = os.environ.get('GUNICORN_PROFILE', 'asgi')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 3))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+if profile == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif profile == 'gevent':
+    wsgi_app = 'backend.wsgi:application'
+    worker_class = 'gevent'
+    # Concurrent requests per worker; keep DB_POOL_MAX_SIZE well below it so
+    # slow analytics requests queue for a connection instead of piling onto
+    # the database, while scans keep flowing
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+elif profile == 'sync':
+    wsgi_app = 'backend.wsgi:application'
+    worker_class = 'sync'
+else:
+    raise RuntimeError(f'Unknown GUNICORN_PROFILE {profile!r}')
+
+
+# Workers share their metrics through this directory (backend/prometheus.py)
+metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR', '')
+
+
+def on_starting(server):
+    if metrics_dir:
+        # Snapshots of an earlier run would be summed in
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.startswith('worker-'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def post_fork(server, worker):
+    if profile == 'gevent':
+        from backend.db_pool.green import make_psycopg_green
+        make_psycopg_green()
+    if metrics_dir:
+        from backend.prometheus import start_snapshot_writer
+        start_snapshot_writer(metrics_dir)
+
+
+def child_exit(server, worker):
+    if metrics_dir:
+        # Its histograms still count; its pool gauges are gone
+        from backend.prometheus import write_snapshot
+        write_snapshot(metrics_dir, pid=worker.pid, live=False)
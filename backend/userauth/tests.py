@@ -1,3 +1,14 @@
-from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from backend.testing import QueryBudgetTestCase, make_person
+
+
+class UserQueryBudgetTests(QueryBudgetTestCase):
+    def seed_people(self, count):
+        for _ in range(count):
+            make_person()
+
+    def test_login(self):
+        self.assertQueryBudget(2, self.seed_people, lambda: self.client.post(reverse('login'), {
+            'email': self.admin.user.email, 'password': 'password',
+        }, format='json'))
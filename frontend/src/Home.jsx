@@ -1,6 +1,6 @@
 "use client"
 
-import { useState, useEffect, useCallback } from "react"
+import { useState, useEffect, useCallback, useRef } from "react"
 import BarcodeScanner from "./BarcodeScanner"
 import ScanNotification from "./components/ScanNotification"
 import Navbar from "./components/Navbar"
@@ -9,6 +9,7 @@ import { logout } from "./redux/accessSlice"
 import { useDispatch } from "react-redux"
 import { useNavigate } from "react-router-dom"
 import useAxios from "./utils/useAxios"
+import useLiveFeed from "./hooks/useLiveFeed"
 import { CheckCircle, Clock, Truck, X, XCircle, AlertTriangle, MapPin, Calendar, User, Package, CreditCard, Flag, FileText, Shield } from "lucide-react"
 import { Button } from "./components/ui/button"
 import {
@@ -197,6 +198,18 @@ export default function Home() {
     return () => window.removeEventListener("focus", handleFocus)
   }, [fetchActiveShipments, fetchCompletedShipments, fetchCancelledShipments, completedPage, cancelledPage])
 
+  // Refresh the lists when bills change anywhere (live feed), once per burst
+  const liveRefresh = useRef(null)
+  useLiveFeed(() => {
+    clearTimeout(liveRefresh.current)
+    liveRefresh.current = setTimeout(() => {
+      fetchActiveShipments()
+      fetchCompletedShipments(completedPage)
+      fetchCancelledShipments(cancelledPage)
+    }, 500)
+  })
+  useEffect(() => () => clearTimeout(liveRefresh.current), [])
+
   // Search effect with debouncing
   useEffect(() => {
     const timeoutId = setTimeout(() => {
@@ -429,15 +442,12 @@ export default function Home() {
     if (selectedActiveIds.size === 0) return
     setIsBulkCompleting(true)
     try {
-      const toComplete = activeShipments.filter(t => selectedActiveIds.has(t.id))
-      const results = await Promise.allSettled(
-        toComplete.map(t =>
-          api.patch(`/bills/bills/${t.id}/`, { status: "completed", code: t.billNumber })
-        )
-      )
-
-      const success = results.filter(r => r.status === "fulfilled").length
-      const failed = results.length - success
+      const response = await api.post('/bills/bills/bulk-status/', {
+        ids: [...selectedActiveIds],
+        status: 'completed',
+      })
+      const success = response.data.updated
+      const failed = response.data.failed
 
       // Refresh lists
       await fetchActiveShipments()
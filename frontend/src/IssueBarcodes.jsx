@@ -34,7 +34,7 @@ export default function IssueBarcodes() {
   const [users, setUsers] = useState([]);
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [submitStatus, setSubmitStatus] = useState({ type: "", message: "" });
-  const [issuedCodes, setIssuedCodes] = useState([]);
+  const [issuedRanges, setIssuedRanges] = useState([]);
   const [copiedCode, setCopiedCode] = useState(null);
   const [existingBarcodes, setExistingBarcodes] = useState([]);
   const [isLoadingBarcodes, setIsLoadingBarcodes] = useState(false);
@@ -120,6 +120,35 @@ export default function IssueBarcodes() {
     }));
   };
 
+  // The API reports issued codes as runs: [{ from: "000001", to: "000100", count: 100 }].
+  // They are shown as runs; single codes are only spelled out for the download.
+  const issuedCount = issuedRanges.reduce((total, range) => total + range.count, 0);
+
+  const formatRange = ({ from, to, count }) => (count === 1 ? from : `${from} - ${to}`);
+
+  // Stop polling a background job after this long; the server fails jobs whose worker died
+  const ISSUE_JOB_POLL_INTERVAL_MS = 1000;
+  const ISSUE_JOB_MAX_WAIT_MS = 15 * 60 * 1000;
+
+  const waitForIssueJob = async (job) => {
+    const deadline = Date.now() + ISSUE_JOB_MAX_WAIT_MS;
+    while (job.status === "queued" || job.status === "running") {
+      if (Date.now() > deadline) {
+        throw new Error(
+          `Barcode issuing is still running (${job.progress}%). Check the issued barcodes list later.`
+        );
+      }
+      setSubmitStatus({
+        type: "info",
+        message: `Issuing barcodes... ${job.progress}%`,
+      });
+      await new Promise((resolve) => setTimeout(resolve, ISSUE_JOB_POLL_INTERVAL_MS));
+      const response = await api.get(`codes/issue-barcode/jobs/${job.id}/`);
+      job = response.data.job;
+    }
+    return job;
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     setIsSubmitting(true);
@@ -134,11 +163,24 @@ export default function IssueBarcodes() {
 
       const response = await api.post(`codes/issue-barcode/`, requestData);
 
-      setIssuedCodes(response.data.issued_codes);
-      setSubmitStatus({
-        type: "success",
-        message: `Successfully issued ${response.data.issued_codes.length} barcode(s)!`,
-      });
+      if (response.status === 202) {
+        // Large ranges are issued in the background; poll the job until it finishes
+        const job = await waitForIssueJob(response.data.job);
+        if (job.status === "failed") {
+          throw new Error(job.error || "Barcode issuing failed.");
+        }
+        setIssuedRanges(job.issued_ranges);
+        setSubmitStatus({
+          type: "success",
+          message: `Successfully issued ${job.issued_count} barcode(s)!`,
+        });
+      } else {
+        setIssuedRanges(response.data.issued_ranges);
+        setSubmitStatus({
+          type: "success",
+          message: `Successfully issued ${response.data.issued_count} barcode(s)!`,
+        });
+      }
 
       // Reset form
       setFormData({
@@ -192,8 +234,20 @@ export default function IssueBarcodes() {
   };
 
   const downloadCodes = () => {
-    const codesText = issuedCodes.join("\n");
-    const blob = new Blob([codesText], { type: "text/plain" });
+    // Built in parts of DOWNLOAD_PART_SIZE codes, never one array of every code
+    const DOWNLOAD_PART_SIZE = 10000;
+    const parts = [];
+    for (const { from, to } of issuedRanges) {
+      const last = parseInt(to, 10);
+      for (let start = parseInt(from, 10); start <= last; start += DOWNLOAD_PART_SIZE) {
+        const lines = [];
+        for (let n = start; n <= Math.min(start + DOWNLOAD_PART_SIZE - 1, last); n++) {
+          lines.push(String(n).padStart(from.length, "0"));
+        }
+        parts.push(lines.join("\n") + "\n");
+      }
+    }
+    const blob = new Blob(parts, { type: "text/plain" });
     const url = URL.createObjectURL(blob);
     const a = document.createElement("a");
     a.href = url;
@@ -226,6 +280,8 @@ export default function IssueBarcodes() {
               className={`p-3 rounded-lg text-sm border ${
                 submitStatus.type === "success"
                   ? "bg-green-50 text-green-800 border-green-200"
+                  : submitStatus.type === "info"
+                  ? "bg-blue-50 text-blue-800 border-blue-200"
                   : "bg-red-50 text-red-800 border-red-200"
               }`}
             >
@@ -349,7 +405,7 @@ export default function IssueBarcodes() {
 
           {/* Results Section */}
           <div className="space-y-4">
-            {issuedCodes.length > 0 ? (
+            {issuedRanges.length > 0 ? (
               <div className="bg-white rounded-lg border border-gray-200 p-4 sm:p-6">
                 <div className="flex flex-col sm:flex-row sm:justify-between sm:items-center mb-4 gap-2">
                   <div className="flex items-center gap-2">
@@ -358,7 +414,7 @@ export default function IssueBarcodes() {
                       Generated Codes
                     </h2>
                     <span className="text-sm text-gray-500">
-                      ({issuedCodes.length})
+                      ({issuedCount})
                     </span>
                   </div>
                   <Button
@@ -373,29 +429,34 @@ export default function IssueBarcodes() {
                 </div>
 
                 <div className="space-y-3 max-h-96 overflow-y-auto">
-                  {issuedCodes.map((code, index) => (
+                  {issuedRanges.map((range) => (
                     <div
-                      key={index}
+                      key={range.from}
                       className="border border-gray-200 rounded-lg p-3"
                     >
                       {/* Barcode Visual */}
                       <div className="text-center mb-3">
                         <div className="font-mono text-xs text-gray-700 mb-1 bg-gray-50 p-2 rounded overflow-x-auto">
-                          {generateBarcode(code)}
+                          {generateBarcode(range.from)}
                         </div>
                         <div className="font-mono text-sm font-semibold text-gray-900 bg-gray-50 p-2 rounded border break-all">
-                          {code}
+                          {formatRange(range)}
                         </div>
+                        {range.count > 1 && (
+                          <div className="text-xs text-gray-500 mt-1">
+                            {range.count} codes
+                          </div>
+                        )}
                       </div>
 
                       {/* Copy Button */}
                       <Button
-                        onClick={() => copyToClipboard(code)}
+                        onClick={() => copyToClipboard(formatRange(range))}
                         variant="outline"
                         size="sm"
                         className="w-full"
                       >
-                        {copiedCode === code ? (
+                        {copiedCode === formatRange(range) ? (
                           <div className="flex items-center gap-1 text-green-600">
                             <CheckCircle className="h-4 w-4" />
                             <span>Copied!</span>
@@ -0,0 +1,72 @@
+import { useEffect, useRef } from 'react';
+import useAxios from '../utils/useAxios';
+
+const baseURL = import.meta.env.VITE_BACKEND_URL;
+
+// Bill events sent by the live feed (bills/analytics/live/)
+const BILL_EVENTS = ['bill.created', 'bill.completed', 'bill.cancelled'];
+const RECONNECT_DELAY_MS = 5000;
+
+/**
+ * Subscribe to the live feed while mounted. onEvent receives every bill event
+ * ({ type, bill }), and { type: 'resync' } after a reconnection, since events
+ * may have been missed in between.
+ *
+ * EventSource cannot send the JWT, so each connection is opened with a
+ * short-lived ticket; a dropped stream reconnects with a fresh one.
+ */
+export const useLiveFeed = (onEvent) => {
+  const api = useAxios();
+  const handler = useRef(onEvent);
+  handler.current = onEvent;
+
+  useEffect(() => {
+    let source = null;
+    let retry = null;
+    let stopped = false;
+    let connectedBefore = false;
+
+    const scheduleReconnect = () => {
+      if (!stopped) {
+        retry = setTimeout(connect, RECONNECT_DELAY_MS);
+      }
+    };
+
+    const connect = async () => {
+      try {
+        const response = await api.post('/bills/analytics/live/ticket/');
+        if (stopped) return;
+        source = new EventSource(
+          `${baseURL}/bills/analytics/live/?ticket=${encodeURIComponent(response.data.ticket)}`
+        );
+      } catch (error) {
+        console.error('Live feed unavailable:', error);
+        scheduleReconnect();
+        return;
+      }
+
+      // Sent first on every connection
+      source.addEventListener('snapshot', () => {
+        if (connectedBefore) handler.current({ type: 'resync' });
+        connectedBefore = true;
+      });
+      BILL_EVENTS.forEach((type) =>
+        source.addEventListener(type, (message) => handler.current(JSON.parse(message.data)))
+      );
+      source.onerror = () => {
+        // The browser would retry with the same, soon expired, ticket
+        source.close();
+        scheduleReconnect();
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, []);
+};
+
+export default useLiveFeed;